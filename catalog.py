@@ -0,0 +1,186 @@
+"""
+
+catalog.py
+~~~~~~~~~~
+
+Local store of scraped Paintings pages.
+
+Each page of json data is saved to disk along with the time it was
+fetched, so repeated picks sample from local data and Wikiart is only
+asked again once a page goes stale.
+
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import json
+import logging
+import os
+import os.path
+import time
+
+from locks import FileLock
+from utils import CATALOG_TTL
+
+
+logger = logging.getLogger(__name__)
+
+
+class Catalog:
+    """Cache of Paintings entries, one file per json page.
+
+    Args:
+        fetch: callable taking a page number and returning an iterable
+            of painting records (dicts).
+        path (`str`): directory to store pages in.
+        ttl (`int`, optional): seconds before a stored page is stale.
+
+    """
+
+    def __init__(self, fetch, path, ttl=CATALOG_TTL):
+        self.fetch = fetch
+        self.path = path
+        self.ttl = ttl
+
+        # Records read or fetched so far, so long-running processes
+        # don't read the same page file again.
+        self._records = {}
+
+        os.makedirs(path, exist_ok=True)
+
+    def _page_file(self, page):
+        return os.path.join(self.path, f'page-{page}.json')
+
+    def _lock_file(self, page):
+        return os.path.join(self.path, f'page-{page}.lock')
+
+    def _load(self, page):
+        """Return stored record of `page` or None if there isn't one. """
+        try:
+            with open(self._page_file(page), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger.warning('Corrupt catalog page %s. Ignoring.', page)
+            return None
+
+    def _store(self, page, paintings):
+        """Write `paintings` of `page` to disk along with fetch time. """
+        record = {'fetched': time.time(), 'paintings': paintings}
+
+        # Write to temp file first so readers never see a half-written page.
+        tmp = self._page_file(page) + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(record, f)
+        os.replace(tmp, self._page_file(page))
+
+        return record
+
+    def is_fresh(self, record):
+        """Check if a stored page record is younger than `ttl`. """
+        return record is not None and time.time() - record['fetched'] < self.ttl
+
+    def paintings(self, page):
+        """Return painting records of `page`, fetching it only if stale.
+
+        Processes sharing `path` fetch a stale page once: the others
+        wait for it and read the stored copy.
+
+        Raises:
+            TimeoutError: if another process fetching the page doesn't
+                finish within `LOCK_TIMEOUT` seconds.
+            Any exceptions raised by `fetch`.
+
+        """
+        record = self._records.get(page)
+        if not self.is_fresh(record):
+            record = self._load(page)
+
+        if not self.is_fresh(record):
+            with FileLock(self._lock_file(page)):
+                # Another process may have stored it since.
+                record = self._load(page)
+                if not self.is_fresh(record):
+                    logger.info('Fetching page %s.', page)
+                    record = self._store(page, list(self.fetch(page)))
+                else:
+                    logger.info('Using page %s fetched by another run.', page)
+        else:
+            logger.info('Using cached page %s.', page)
+
+        self._records[page] = record
+
+        return record['paintings']
+
+    def urls(self, page):
+        """Return image urls of `page`. """
+        return [p['image'] for p in self.paintings(page) if p.get('image')]
+
+    def iter_paintings(self, start=1, workers=1):
+        """Yield painting records page by page, fetching pages ahead in parallel.
+
+        Only `start` is fetched before the first page is yielded. Each
+        time another page is asked for, up to `workers` following pages
+        are kept in flight on a thread pool, so walking past used up
+        pages doesn't wait on one request at a time.
+
+        Args:
+            start (`int`, optional): first page to yield.
+            workers (`int`, optional): max number of pages fetched at once.
+                Less than 1 counts as 1.
+
+        Yields:
+            Tuples of page number and list of painting records, in page order.
+
+        """
+        pages = itertools.count(start)
+        workers = max(workers, 1)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            page = next(pages)
+            pending = deque([(page, pool.submit(self.paintings, page))])
+            try:
+                while pending:
+                    page, future = pending.popleft()
+                    yield page, future.result()
+
+                    while len(pending) < workers:
+                        page = next(pages)
+                        pending.append((page, pool.submit(self.paintings, page)))
+            finally:
+                # Don't wait on pages nobody asked for yet.
+                for _, future in pending:
+                    future.cancel()
+
+    def iter_urls(self, start=1, workers=1):
+        """Yield image urls page by page. See `iter_paintings`.
+
+        Yields:
+            Tuples of page number and list of image urls, in page order.
+
+        """
+        pages = self.iter_paintings(start, workers)
+        try:
+            for page, paintings in pages:
+                yield page, [p['image'] for p in paintings if p.get('image')]
+        finally:
+            pages.close()
+
+    def loaded_pages(self):
+        """Return list of (page, record) of pages read or fetched so far.
+
+        Records are dicts with the fetch time under 'fetched' and the
+        painting records under 'paintings'.
+
+        """
+        # Copied since pool threads may add pages meanwhile.
+        return sorted(self._records.copy().items())
+
+    def invalidate(self, page):
+        """Remove stored copy of `page`. """
+        self._records.pop(page, None)
+        try:
+            os.remove(self._page_file(page))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,197 @@
+"""
+
+daemon.py
+~~~~~~~~~
+
+Long-running wallpaper changer.
+
+Instead of starting a new process for every change, the daemon keeps
+its HTTP session, database connection and catalog in memory, changes
+the wallpaper on a schedule and listens on a local Unix socket for
+commands like `next`.
+
+"""
+import datetime
+import logging
+import os
+import selectors
+import socket
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class Schedule:
+    """When to change the wallpaper.
+
+    Args:
+        interval (`int`, optional): seconds between changes.
+        times (`list`, optional): 'HH:MM' times of day to change at.
+
+    Raises:
+        ValueError: if a time isn't in 'HH:MM' format or neither
+            `interval` nor `times` is given.
+
+    """
+
+    def __init__(self, interval=None, times=()):
+        if not interval and not times:
+            raise ValueError('Schedule needs an interval or times of day.')
+
+        self.interval = interval
+        self.times = [datetime.datetime.strptime(t, '%H:%M').time() for t in times]
+
+    def next_run(self, now):
+        """Return timestamp of first change after timestamp `now`. """
+        candidates = []
+
+        if self.interval:
+            candidates.append(now + self.interval)
+
+        today = datetime.date.fromtimestamp(now)
+        for t in self.times:
+            at = datetime.datetime.combine(today, t).timestamp()
+            if at <= now:
+                at = datetime.datetime.combine(
+                    today + datetime.timedelta(days=1), t
+                ).timestamp()
+            candidates.append(at)
+
+        return min(candidates)
+
+
+class Daemon:
+    """Change wallpaper on a schedule and on request over a Unix socket.
+
+    Args:
+        change: callable that changes the wallpaper and returns the path
+            of the new image.
+        schedule: `Schedule` of automatic changes.
+        socket_path (`str`): path of control socket.
+        after_change (optional): callable run after each change once the
+            client got its reply, e.g. to refill the prefetch queue.
+
+    """
+
+    def __init__(self, change, schedule, socket_path, after_change=None):
+        self.change = change
+        self.schedule = schedule
+        self.socket_path = socket_path
+        self.after_change = after_change
+        self.running = False
+
+    def _listen(self):
+        """Bind control socket, replacing a stale one.
+
+        Raises:
+            RuntimeError: if another daemon is listening already.
+
+        """
+        if os.path.exists(self.socket_path):
+            try:
+                send_command(self.socket_path, 'ping', timeout=1)
+            except OSError:
+                os.remove(self.socket_path)
+            else:
+                raise RuntimeError(f'Daemon already running on {self.socket_path}.')
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen()
+        return server
+
+    def _change(self):
+        """Change wallpaper and return reply for client. """
+        try:
+            path = self.change()
+        except Exception as err:
+            logger.exception('Changing wallpaper failed.')
+            return f'error {err}'
+        return f'ok {path}'
+
+    def _after_change(self):
+        if self.after_change is not None:
+            try:
+                self.after_change()
+            except Exception:
+                logger.exception('Post-change step failed.')
+
+    def _handle(self, conn):
+        """Answer a single command on connection `conn`.
+
+        Returns:
+            True if the wallpaper was changed.
+
+        """
+        with conn:
+            conn.settimeout(5)
+            try:
+                command = conn.makefile('r').readline().strip()
+            except OSError:
+                logger.warning('Failed to read command.')
+                return False
+
+            changed = False
+            if command == 'next':
+                reply = self._change()
+                changed = True
+            elif command == 'ping':
+                reply = 'ok pong'
+            elif command == 'stop':
+                self.running = False
+                reply = 'ok stopping'
+            else:
+                reply = f'error unknown command {command!r}'
+
+            try:
+                conn.sendall(reply.encode() + b'\n')
+            except OSError:
+                logger.warning('Client left before reply.')
+
+        return changed
+
+    def serve_forever(self):
+        """Run until a `stop` command is received. """
+        server = self._listen()
+        logger.info('Daemon listening on %s', self.socket_path)
+
+        try:
+            with selectors.DefaultSelector() as sel:
+                sel.register(server, selectors.EVENT_READ)
+
+                self.running = True
+                next_run = self.schedule.next_run(time.time())
+
+                while self.running:
+                    if sel.select(max(0, next_run - time.time())):
+                        changed = self._handle(server.accept()[0])
+                    elif time.time() >= next_run:
+                        logger.info(self._change())
+                        changed = True
+                    else:
+                        continue
+
+                    if changed:
+                        next_run = self.schedule.next_run(time.time())
+                        self._after_change()
+        finally:
+            server.close()
+            os.remove(self.socket_path)
+
+
+def send_command(socket_path, command, timeout=None):
+    """Send `command` to daemon listening on `socket_path`.
+
+    Raises:
+        OSError: if no daemon is listening.
+
+    Returns:
+        Reply of daemon, like 'ok /path/to/image.jpg'.
+
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(socket_path)
+        client.sendall(command.encode() + b'\n')
+        return client.makefile('r').readline().strip()
@@ -6,18 +6,337 @@ db.py
 Sqlite3 database wrapper for download history.
 
 The database stores information on downloaded images to prevent
-downloading images more than once.
+downloading images more than once, the content digest and perceptual
+hash of each image url, a manifest of the image files in download
+directories so cleaning them up doesn't have to stat every file, and
+the records of the `Paintings` json data split into paintings and
+artists so selection and stats don't need the network.
 
 """
 import logging
+import os
 import os.path
 import sqlite3
+import time
 
-from utils import data_dir
+from utils import (
+    IMAGE_EXTENSIONS,
+    LOCK_TIMEOUT,
+    MANIFEST_RESCAN_INTERVAL,
+    SOURCE,
+    data_dir,
+    painting_year,
+    url_key,
+)
 
 
 logger = logging.getLogger(__name__)
 
+# Max number of urls bound to a single query (SQLite's default limit is 999).
+MAX_QUERY_VARS = 500
+
+# Connection settings. WAL lets several wikiwall processes read while one
+# writes, and NORMAL sync is still safe from corruption under WAL.
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 64 * 1024 * 1024,
+    'cache_size': -8000,
+}
+
+# States of a downloaded image. Picked images are reserved by a run
+# while it downloads or shows them. Prefetched images wait in a queue directory
+# until they are shown. Skipped images looked like an earlier one and
+# are never shown, but aren't picked again either.
+STATE_PICKED = 'picked'
+STATE_SHOWN = 'shown'
+STATE_PREFETCHED = 'prefetched'
+STATE_SKIPPED = 'skipped'
+
+# Keys of painting records returned by `DownloadDatabase.painting`, as in
+# the `Paintings` json data.
+PAINTING_KEYS = (
+    'image',
+    'id',
+    'title',
+    'artistName',
+    'year',
+    'width',
+    'height',
+    'paintingUrl',
+)
+
+# Seconds to wait for another process's write lock before giving up.
+BUSY_TIMEOUT = 30
+
+# Statements, formatted with the table name once per DownloadDatabase.
+SQL = {
+    'create_table': '''
+        CREATE TABLE IF NOT EXISTS {table} (
+            id integer PRIMARY KEY,
+            url text NOT NULL UNIQUE,
+            state text NOT NULL DEFAULT 'shown',
+            path text,
+            picked real)
+    ''',
+    'columns': '''
+        PRAGMA table_info({table})
+    ''',
+    'add_state': '''
+        ALTER TABLE {table} ADD COLUMN state text NOT NULL DEFAULT 'shown'
+    ''',
+    'add_path': '''
+        ALTER TABLE {table} ADD COLUMN path text
+    ''',
+    'add_picked': '''
+        ALTER TABLE {table} ADD COLUMN picked real
+    ''',
+    'create_state_index': '''
+        CREATE INDEX IF NOT EXISTS {table}_state ON {table} (state)
+    ''',
+    'add': '''
+        INSERT OR IGNORE INTO {table} (url, state, path)
+        VALUES (?, ?, ?)
+    ''',
+    'add_reserved': '''
+        UPDATE {table} SET state=?, path=? WHERE url=? AND state='picked'
+    ''',
+    'reserve': '''
+        INSERT OR IGNORE INTO {table} (url, state, picked)
+        VALUES (?, 'picked', ?)
+    ''',
+    'expire_picks': '''
+        DELETE FROM {table} WHERE state='picked' AND (picked IS NULL OR picked < ?)
+    ''',
+    'release': '''
+        DELETE FROM {table} WHERE url=? AND state='picked'
+    ''',
+    'add_many': '''
+        INSERT OR IGNORE INTO {table} (url)
+        VALUES (?)
+    ''',
+    'is_duplicate': '''
+        SELECT url FROM {table} WHERE url=?
+    ''',
+    'seen': '''
+        SELECT url FROM {table}
+        WHERE url IN ({params}) AND (state != 'picked' OR picked >= ?)
+    ''',
+    'new': '''
+        SELECT c.url FROM temp.candidates AS c
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {table} AS d
+            WHERE d.url = c.url AND (d.state != 'picked' OR d.picked >= ?))
+        ORDER BY c.rowid
+    ''',
+    'count': '''
+        SELECT count(*) FROM {table}
+    ''',
+    'next_prefetched': '''
+        SELECT url, path FROM {table} WHERE state='prefetched' ORDER BY id LIMIT 1
+    ''',
+    'claim_prefetched': '''
+        UPDATE {table} SET state='picked', picked=? WHERE url=? AND state='prefetched'
+    ''',
+    'count_prefetched': '''
+        SELECT count(*) FROM {table} WHERE state='prefetched'
+    ''',
+    'mark_shown': '''
+        UPDATE {table} SET state='shown', path=? WHERE url=?
+    ''',
+    'remove': '''
+        DELETE FROM {table} WHERE url=?
+    ''',
+    'create_files': '''
+        CREATE TABLE IF NOT EXISTS {table}_files (
+            path text PRIMARY KEY,
+            dir text NOT NULL,
+            size integer NOT NULL,
+            downloaded real NOT NULL,
+            shown real,
+            favorite integer NOT NULL DEFAULT 0)
+    ''',
+    'file_columns': '''
+        PRAGMA table_info({table}_files)
+    ''',
+    'add_file_shown': '''
+        ALTER TABLE {table}_files ADD COLUMN shown real
+    ''',
+    'add_file_favorite': '''
+        ALTER TABLE {table}_files ADD COLUMN favorite integer NOT NULL DEFAULT 0
+    ''',
+    'create_dirs': '''
+        CREATE TABLE IF NOT EXISTS {table}_dirs (
+            dir text PRIMARY KEY,
+            mtime integer NOT NULL,
+            scanned real NOT NULL)
+    ''',
+    'dir_synced': '''
+        SELECT mtime, scanned FROM {table}_dirs WHERE dir=?
+    ''',
+    'set_dir_synced': '''
+        INSERT OR REPLACE INTO {table}_dirs (dir, mtime, scanned) VALUES (?, ?, ?)
+    ''',
+    'set_dir_mtime': '''
+        UPDATE {table}_dirs SET mtime=? WHERE dir=?
+    ''',
+    'create_files_index': '''
+        CREATE INDEX IF NOT EXISTS {table}_files_dir
+        ON {table}_files (dir, downloaded)
+    ''',
+    'create_files_lru_index': '''
+        CREATE INDEX IF NOT EXISTS {table}_files_lru
+        ON {table}_files (dir, coalesce(shown, downloaded))
+    ''',
+    'add_file': '''
+        INSERT OR IGNORE INTO {table}_files (path, dir, size, downloaded)
+        VALUES (?, ?, ?, ?)
+    ''',
+    'update_file': '''
+        UPDATE {table}_files SET size=?, downloaded=? WHERE path=?
+    ''',
+    'dir_files': '''
+        SELECT path FROM {table}_files WHERE dir=?
+    ''',
+    'count_files': '''
+        SELECT count(*) FROM {table}_files WHERE dir=?
+    ''',
+    'oldest_files': '''
+        SELECT path FROM {table}_files WHERE dir=? ORDER BY downloaded, rowid LIMIT ?
+    ''',
+    'lru_files': '''
+        SELECT path, size, downloaded, shown, favorite FROM {table}_files
+        WHERE dir=? ORDER BY coalesce(shown, downloaded), rowid
+    ''',
+    'files_size': '''
+        SELECT coalesce(sum(size), 0) FROM {table}_files WHERE dir=?
+    ''',
+    'mark_file_shown': '''
+        UPDATE {table}_files SET shown=? WHERE path=?
+    ''',
+    'set_favorite': '''
+        UPDATE {table}_files SET favorite=? WHERE path=?
+    ''',
+    'last_shown_file': '''
+        SELECT path FROM {table}_files WHERE shown IS NOT NULL ORDER BY shown DESC LIMIT 1
+    ''',
+    'remove_file': '''
+        DELETE FROM {table}_files WHERE path=?
+    ''',
+    'create_digests': '''
+        CREATE TABLE IF NOT EXISTS {table}_digests (
+            url text PRIMARY KEY,
+            digest text NOT NULL)
+    ''',
+    'create_digests_index': '''
+        CREATE INDEX IF NOT EXISTS {table}_digests_digest ON {table}_digests (digest)
+    ''',
+    'add_digest': '''
+        INSERT OR REPLACE INTO {table}_digests (url, digest) VALUES (?, ?)
+    ''',
+    'digest_for': '''
+        SELECT digest FROM {table}_digests WHERE url=?
+    ''',
+    'count_digest': '''
+        SELECT count(*) FROM {table}_digests WHERE digest=?
+    ''',
+    'path_of': '''
+        SELECT path FROM {table} WHERE url=?
+    ''',
+    'create_phashes': '''
+        CREATE TABLE IF NOT EXISTS {table}_phashes (
+            url text PRIMARY KEY,
+            phash integer NOT NULL)
+    ''',
+    'add_phash': '''
+        INSERT OR REPLACE INTO {table}_phashes (url, phash) VALUES (?, ?)
+    ''',
+    'phashes': '''
+        SELECT url, phash FROM {table}_phashes
+    ''',
+    'create_artists': '''
+        CREATE TABLE IF NOT EXISTS {table}_artists (
+            id integer PRIMARY KEY,
+            name text NOT NULL UNIQUE,
+            url text)
+    ''',
+    'create_paintings': '''
+        CREATE TABLE IF NOT EXISTS {table}_paintings (
+            url text PRIMARY KEY,
+            painting_id text,
+            title text,
+            artist_id integer REFERENCES {table}_artists (id),
+            year integer,
+            width integer,
+            height integer,
+            page_url text)
+    ''',
+    'create_paintings_artist_index': '''
+        CREATE INDEX IF NOT EXISTS {table}_paintings_artist ON {table}_paintings (artist_id)
+    ''',
+    'create_paintings_year_index': '''
+        CREATE INDEX IF NOT EXISTS {table}_paintings_year ON {table}_paintings (year)
+    ''',
+    'create_pages': '''
+        CREATE TABLE IF NOT EXISTS {table}_pages (
+            source text NOT NULL,
+            page integer NOT NULL,
+            fetched real NOT NULL,
+            PRIMARY KEY (source, page))
+    ''',
+    'add_artist': '''
+        INSERT OR IGNORE INTO {table}_artists (name, url) VALUES (?, ?)
+    ''',
+    'add_painting': '''
+        INSERT OR REPLACE INTO {table}_paintings
+            (url, painting_id, title, artist_id, year, width, height, page_url)
+        VALUES (?, ?, ?, (SELECT id FROM {table}_artists WHERE name=?), ?, ?, ?, ?)
+    ''',
+    'set_page_fetched': '''
+        INSERT OR REPLACE INTO {table}_pages (source, page, fetched) VALUES (?, ?, ?)
+    ''',
+    'page_fetched': '''
+        SELECT fetched FROM {table}_pages WHERE source=? AND page=?
+    ''',
+    'painting': '''
+        SELECT p.url, p.painting_id, p.title, a.name, p.year, p.width, p.height, p.page_url
+        FROM {table}_paintings AS p LEFT JOIN {table}_artists AS a ON a.id = p.artist_id
+        WHERE p.url=?
+    ''',
+    'count_paintings': '''
+        SELECT count(*), count(DISTINCT artist_id) FROM {table}_paintings
+    ''',
+    'recent_artists': '''
+        SELECT a.name FROM {table} AS d
+        JOIN {table}_paintings AS p ON p.url = d.url
+        JOIN {table}_artists AS a ON a.id = p.artist_id
+        WHERE d.state!='skipped'
+        ORDER BY d.id DESC LIMIT ?
+    ''',
+    'top_artists': '''
+        SELECT a.name, count(*) AS shown FROM {table} AS d
+        JOIN {table}_paintings AS p ON p.url = d.url
+        JOIN {table}_artists AS a ON a.id = p.artist_id
+        WHERE d.state='shown'
+        GROUP BY a.id ORDER BY shown DESC, a.name LIMIT ?
+    ''',
+    'count_by_state': '''
+        SELECT state, count(*) FROM {table} GROUP BY state
+    ''',
+}
+
+
+def _integer(value):
+    """Return `value` as int or None if it isn't a number. """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _text(value):
+    return None if value is None else str(value)
+
 
 class DownloadDatabase:
     """Configure and establish connection to tweet database.
@@ -26,15 +345,31 @@ class DownloadDatabase:
         This class acts as a context manager.
 
     Args:
-        db_filename (`str`, optional): filename of database
+        db_filename (`str`, optional): filename of database. Default is
+            wikiwall.db in the data directory.
+        pragmas (`dict`, optional): PRAGMA settings applied on connect.
 
     """
 
     def __init__(
-        self, db_filename=os.path.join(data_dir(), 'wikiwall.db'), tablename='downloads'
+        self,
+        db_filename=None,
+        tablename='downloads',
+        pragmas=PRAGMAS,
     ):
+        if db_filename is None:
+            db_filename = os.path.join(data_dir(), 'wikiwall.db')
+
         self.db_filename = db_filename
         self.tablename = tablename
+        self.pragmas = pragmas
+
+        # Identical statement strings let sqlite3 reuse its prepared statements.
+        self.sql = {
+            name: query.format(table=tablename, params='{params}')
+            for name, query in SQL.items()
+        }
+        self._seen_sql = {}
 
     def __enter__(self):
         self._connect()
@@ -47,50 +382,118 @@ class DownloadDatabase:
             self.conn.close()
 
     def _connect(self):
-        """Connect to database. """
+        """Connect to database and apply `pragmas`.
+
+        The connection may be used from other threads, one at a time.
+
+        """
         try:
-            self.conn = sqlite3.connect(self.db_filename)
+            self.conn = sqlite3.connect(
+                self.db_filename, timeout=BUSY_TIMEOUT, check_same_thread=False
+            )
+            for name, value in self.pragmas.items():
+                self.conn.execute(f'PRAGMA {name}={value}')
         except sqlite3.Error:
             logger.exception('Failed to connect to database!')
 
     def _create_table(self):
         """Create a table for image data if it does not exist.
 
-        Args:
-            name (`str`, optional): name of table
+        Note:
+            Tables from older versions get the `state`, `path` and
+            `picked` columns added. Existing rows count as shown.
 
         """
-        query = '''
-            CREATE TABLE IF NOT EXISTS {} (
-                id integer PRIMARY KEY,
-                url text NOT NULL UNIQUE)
-            '''.format(
-            self.tablename
-        )
+        self.conn.execute(self.sql['create_table'])
+
+        columns = {row[1] for row in self.conn.execute(self.sql['columns'])}
+        if 'state' not in columns:
+            self.conn.execute(self.sql['add_state'])
+        if 'path' not in columns:
+            self.conn.execute(self.sql['add_path'])
+        if 'picked' not in columns:
+            self.conn.execute(self.sql['add_picked'])
+
+        self.conn.execute(self.sql['create_state_index'])
 
-        self.conn.execute(query)
+        self.conn.execute(self.sql['create_files'])
 
-    def add(self, url):
+        columns = {row[1] for row in self.conn.execute(self.sql['file_columns'])}
+        if 'shown' not in columns:
+            self.conn.execute(self.sql['add_file_shown'])
+        if 'favorite' not in columns:
+            self.conn.execute(self.sql['add_file_favorite'])
+
+        self.conn.execute(self.sql['create_files_index'])
+        self.conn.execute(self.sql['create_files_lru_index'])
+        self.conn.execute(self.sql['create_dirs'])
+
+        self.conn.execute(self.sql['create_digests'])
+        self.conn.execute(self.sql['create_digests_index'])
+
+        self.conn.execute(self.sql['create_phashes'])
+
+        self.conn.execute(self.sql['create_artists'])
+        self.conn.execute(self.sql['create_paintings'])
+        self.conn.execute(self.sql['create_paintings_artist_index'])
+        self.conn.execute(self.sql['create_paintings_year_index'])
+        self.conn.execute(self.sql['create_pages'])
+
+    def add(self, url, state=STATE_SHOWN, path=None):
         """Add image url to database.
 
         Args:
             url (str): image url
+            state (`str`, optional): `STATE_SHOWN`, `STATE_PREFETCHED` or
+                `STATE_SKIPPED`.
+            path (`str`, optional): local path of the image.
+
+        Note:
+            Urls reserved with `reserve` get `state` and `path`. Other
+            urls in the database already are left as they are.
+
+        """
+        with self.conn:
+            added = self.conn.execute(self.sql['add'], (url, state, path)).rowcount
+            if not added:
+                added = self.conn.execute(
+                    self.sql['add_reserved'], (state, path, url)
+                ).rowcount
+        if not added:
+            logger.warning('%s is in the database already.', url)
+
+    def reserve(self, urls):
+        """Record `urls` as picked, keeping them out of other runs' picks.
+
+        Note:
+            Call with the lock of `pick_lock` held from picking the urls
+            on. Reserved urls become shown, prefetched or skipped with
+            `add`, or can be picked again after `release`. Reservations
+            older than `LOCK_TIMEOUT`, left by runs that were killed,
+            are dropped here.
 
         Raises:
-            sqlite3.IntegrityError: If data already exists in database.
+            ValueError: if a url is in the database already.
 
         """
-        record_sql = '''
-            INSERT INTO {} (url)
-            VALUES (?)
-        '''.format(
-            self.tablename
-        )
-        try:
-            with self.conn:
-                self.conn.execute(record_sql, (url,))
-        except sqlite3.IntegrityError:
-            logger.exception('Already tweeted %s!', url)
+        now = time.time()
+        with self.conn:
+            self.conn.execute(self.sql['expire_picks'], (now - LOCK_TIMEOUT,))
+            for url in urls:
+                if not self.conn.execute(self.sql['reserve'], (url, now)).rowcount:
+                    raise ValueError(f'{url} is in the database already.')
+
+    def release(self, urls):
+        """Drop reservations of `urls` that weren't added since. """
+        with self.conn:
+            self.conn.executemany(self.sql['release'], ((url,) for url in urls))
+
+    def pick_lock(self):
+        """Return `FileLock` held by runs while they pick and reserve urls. """
+        # Imported here since only picking runs need locks.
+        from locks import FileLock
+
+        return FileLock(self.db_filename + '.pick.lock')
 
     def is_duplicate(self, url):
         """Check if `url` already exists in database.
@@ -99,10 +502,371 @@ class DownloadDatabase:
             url(`str`): url of image
 
         """
-        dupl_check_sql = '''
-            SELECT url FROM {} WHERE url=?
-        '''.format(
-            self.tablename
-        )
         with self.conn:
-            return self.conn.execute(dupl_check_sql, (url,)).fetchone()
+            return self.conn.execute(self.sql['is_duplicate'], (url,)).fetchone()
+
+    def add_many(self, urls):
+        """Add image urls to database in a single transaction.
+
+        Args:
+            urls: iterable of image urls. Urls already in the database
+                are skipped.
+
+        Returns:
+            Number of urls added.
+
+        """
+        with self.conn:
+            added = self.conn.executemany(
+                self.sql['add_many'], ((url,) for url in urls)
+            ).rowcount
+
+        return added
+
+    def filter_new(self, urls):
+        """Return urls that don't exist in database yet.
+
+        Note:
+            Up to `MAX_QUERY_VARS` urls are checked with one IN query.
+            Larger batches go through a temporary table so they still
+            take a single query. Urls picked more than `LOCK_TIMEOUT`
+            ago count as new, see `reserve`.
+
+        Args:
+            urls: iterable of image urls.
+
+        Returns:
+            List of unseen urls in their original order.
+
+        """
+        urls = list(urls)
+        expired = time.time() - LOCK_TIMEOUT
+
+        if len(urls) <= MAX_QUERY_VARS:
+            # Pages are mostly the same size, so this is formatted once.
+            if len(urls) not in self._seen_sql:
+                self._seen_sql[len(urls)] = self.sql['seen'].format(
+                    params=', '.join('?' * len(urls))
+                )
+            seen_sql = self._seen_sql[len(urls)]
+            seen = {row[0] for row in self.conn.execute(seen_sql, urls + [expired])}
+            return [url for url in urls if url not in seen]
+
+        with self.conn:
+            self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS candidates (url text)')
+            self.conn.execute('DELETE FROM temp.candidates')
+            self.conn.executemany(
+                'INSERT INTO temp.candidates (url) VALUES (?)', ((url,) for url in urls)
+            )
+            return [row[0] for row in self.conn.execute(self.sql['new'], (expired,))]
+
+    def next_prefetched(self):
+        """Return (url, path) of oldest prefetched image or None. """
+        return self.conn.execute(self.sql['next_prefetched']).fetchone()
+
+    def claim_prefetched(self, url):
+        """Reserve prefetched image at `url` for this run, as `reserve` does.
+
+        Returns:
+            False if another run took it off the queue first.
+
+        """
+        with self.conn:
+            return bool(
+                self.conn.execute(self.sql['claim_prefetched'], (time.time(), url)).rowcount
+            )
+
+    def count_prefetched(self):
+        """Return number of prefetched images not shown yet. """
+        return self.conn.execute(self.sql['count_prefetched']).fetchone()[0]
+
+    def mark_shown(self, url, path=None):
+        """Record that claimed image at `url` was shown from `path`. """
+        with self.conn:
+            self.conn.execute(self.sql['mark_shown'], (path, url))
+
+    def remove(self, url):
+        """Remove `url` from database so it can be downloaded again. """
+        with self.conn:
+            self.conn.execute(self.sql['remove'], (url,))
+
+    def add_file(self, path, size=None, downloaded=None):
+        """Record image file at `path` in manifest of its directory.
+
+        Args:
+            path (`str`): path of image file.
+            size (`int`, optional): file size in bytes. Read from disk
+                if not given.
+            downloaded (`float`, optional): timestamp of download. Default
+                is now.
+
+        Note:
+            A file in the manifest already gets the new size and
+            timestamp, but stays a favorite and keeps when it was shown.
+
+        """
+        path = os.path.abspath(path)
+        if size is None:
+            size = os.path.getsize(path)
+        if downloaded is None:
+            downloaded = time.time()
+
+        with self.conn:
+            added = self.conn.execute(
+                self.sql['add_file'], (path, os.path.dirname(path), size, downloaded)
+            ).rowcount
+            if not added:
+                self.conn.execute(self.sql['update_file'], (size, downloaded, path))
+            self._changed_dirs([os.path.dirname(path)])
+
+    def _changed_dirs(self, directories):
+        """Keep manifests of `directories` valid after changing them ourselves. """
+        for directory in set(directories):
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            self.conn.execute(self.sql['set_dir_mtime'], (mtime, directory))
+
+    def count_files(self, directory):
+        """Return number of files in manifest of `directory`. """
+        directory = os.path.abspath(directory)
+        return self.conn.execute(self.sql['count_files'], (directory,)).fetchone()[0]
+
+    def oldest_files(self, directory, n):
+        """Return paths of the `n` least recently downloaded files in `directory`. """
+        directory = os.path.abspath(directory)
+        return [row[0] for row in self.conn.execute(self.sql['oldest_files'], (directory, n))]
+
+    def files_size(self, directory):
+        """Return total size in bytes of files in manifest of `directory`. """
+        directory = os.path.abspath(directory)
+        return self.conn.execute(self.sql['files_size'], (directory,)).fetchone()[0]
+
+    def lru_files(self, directory):
+        """Iterate over files in `directory`, least recently used first.
+
+        Files are ordered by when they were last shown, or downloaded
+        if they weren't shown yet.
+
+        Returns:
+            Cursor of (path, size, downloaded, shown, favorite) rows.
+
+        """
+        directory = os.path.abspath(directory)
+        return self.conn.execute(self.sql['lru_files'], (directory,))
+
+    def mark_file_shown(self, path, when=None):
+        """Record that file at `path` was shown at timestamp `when`, default now. """
+        if when is None:
+            when = time.time()
+
+        with self.conn:
+            self.conn.execute(self.sql['mark_file_shown'], (when, os.path.abspath(path)))
+
+    def set_favorite(self, path, favorite=True):
+        """Mark file at `path` as favorite, or not.
+
+        Returns:
+            True if `path` is in the manifest.
+
+        """
+        with self.conn:
+            return bool(
+                self.conn.execute(
+                    self.sql['set_favorite'], (int(favorite), os.path.abspath(path))
+                ).rowcount
+            )
+
+    def last_shown_file(self):
+        """Return path of file shown most recently, or None. """
+        row = self.conn.execute(self.sql['last_shown_file']).fetchone()
+        return row[0] if row else None
+
+    def remove_files(self, paths):
+        """Remove files at `paths` from manifest. """
+        paths = [os.path.abspath(p) for p in paths]
+        with self.conn:
+            self.conn.executemany(self.sql['remove_file'], ((p,) for p in paths))
+            self._changed_dirs(os.path.dirname(p) for p in paths)
+
+    def sync_files(
+        self, directory, suffixes=IMAGE_EXTENSIONS, rescan_interval=MANIFEST_RESCAN_INTERVAL
+    ):
+        """Reconcile manifest of `directory` with files on disk.
+
+        Note:
+            The directory is only scanned if its manifest is missing or
+            out of date: if the directory changed since the last scan
+            other than through `add_file` and `remove_files`, or was
+            last scanned more than `rescan_interval` seconds ago. A scan
+            takes a single `os.scandir` pass. Only files missing from
+            the manifest are stat'ed, using their modification time as
+            download time. Files changed by hand just before one of our
+            own changes are picked up by the next periodic scan.
+
+        Args:
+            directory (`str`): directory to scan.
+            suffixes (`tuple`, optional): only track files ending in one
+                of these, ignoring case.
+            rescan_interval (`float`, optional): max seconds between scans.
+
+        Returns:
+            Tuple of number of files added to and removed from manifest.
+
+        """
+        directory = os.path.abspath(directory)
+
+        # Changes during the scan make the next call scan again.
+        mtime = os.stat(directory).st_mtime_ns
+        now = time.time()
+        row = self.conn.execute(self.sql['dir_synced'], (directory,)).fetchone()
+        if row is not None and row[0] == mtime and now - row[1] < rescan_interval:
+            return 0, 0
+
+        known = {row[0] for row in self.conn.execute(self.sql['dir_files'], (directory,))}
+
+        added = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.name.lower().endswith(suffixes) or not entry.is_file():
+                    continue
+
+                # `directory` is absolute, so this is too.
+                if entry.path in known:
+                    known.discard(entry.path)
+                else:
+                    st = entry.stat()
+                    added.append((entry.path, directory, st.st_size, st.st_mtime))
+
+        with self.conn:
+            self.conn.executemany(self.sql['add_file'], added)
+            self.conn.executemany(self.sql['remove_file'], ((p,) for p in known))
+            self.conn.execute(self.sql['set_dir_synced'], (directory, mtime, now))
+
+        if added or known:
+            logger.info(
+                'Manifest of %s: %s files added, %s removed.', directory, len(added), len(known)
+            )
+
+        return len(added), len(known)
+
+    def add_digest(self, url, digest):
+        """Record content `digest` of image at `url`.
+
+        Note:
+            Urls are stored without query string, so variants of the
+            same url share a digest.
+
+        """
+        with self.conn:
+            self.conn.execute(self.sql['add_digest'], (url_key(url), digest))
+
+    def digest_for(self, url):
+        """Return content digest of image at `url` or None if unknown. """
+        row = self.conn.execute(self.sql['digest_for'], (url_key(url),)).fetchone()
+        return row[0] if row else None
+
+    def count_digest(self, digest):
+        """Return number of urls known to serve content `digest`. """
+        return self.conn.execute(self.sql['count_digest'], (digest,)).fetchone()[0]
+
+    def path_of(self, url):
+        """Return local path recorded for `url`, or None. """
+        row = self.conn.execute(self.sql['path_of'], (url,)).fetchone()
+        return row[0] if row else None
+
+    def add_phash(self, url, phash):
+        """Record 64-bit perceptual hash `phash` of image at `url`. """
+        # SQLite integers are signed.
+        if phash >= 1 << 63:
+            phash -= 1 << 64
+
+        with self.conn:
+            self.conn.execute(self.sql['add_phash'], (url, phash))
+
+    def phashes(self):
+        """Yield (url, perceptual hash) of every hashed image. """
+        for url, phash in self.conn.execute(self.sql['phashes']):
+            yield url, phash % (1 << 64)
+
+    def add_paintings(self, paintings, page=None, fetched=None, source=SOURCE):
+        """Add or update painting records of the `Paintings` json data.
+
+        Note:
+            All records are written in one transaction with a batched
+            statement per table.
+
+        Args:
+            paintings: iterable of painting records (dicts). Records
+                without an image url are skipped.
+            page (`int`, optional): json page the records come from.
+            fetched (`float`, optional): timestamp `page` was fetched at.
+            source (`str`, optional): name of the source `page` is a page
+                of, like 'dir:/Volumes/art'.
+
+        Returns:
+            Number of paintings written.
+
+        """
+        rows = []
+        artists = {}
+        for painting in paintings:
+            if not painting.get('image'):
+                continue
+            name = painting.get('artistName') or None
+            if name is not None:
+                artists.setdefault(name, painting.get('artistUrl'))
+            rows.append(
+                (
+                    painting['image'],
+                    _text(painting.get('id')),
+                    painting.get('title'),
+                    name,
+                    painting_year(painting),
+                    _integer(painting.get('width')),
+                    _integer(painting.get('height')),
+                    painting.get('paintingUrl'),
+                )
+            )
+
+        with self.conn:
+            self.conn.executemany(self.sql['add_artist'], artists.items())
+            self.conn.executemany(self.sql['add_painting'], rows)
+            if page is not None:
+                self.conn.execute(self.sql['set_page_fetched'], (source, page, fetched))
+
+        return len(rows)
+
+    def page_fetched(self, page, source=SOURCE):
+        """Return fetch time of the stored records of `page` of `source` or None. """
+        row = self.conn.execute(self.sql['page_fetched'], (source, page)).fetchone()
+        return row[0] if row else None
+
+    def painting(self, url):
+        """Return stored record of painting with image `url` or None.
+
+        Returns:
+            Dict with the keys of the `Paintings` json data.
+
+        """
+        row = self.conn.execute(self.sql['painting'], (url,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(PAINTING_KEYS, row))
+
+    def count_paintings(self):
+        """Return number of stored paintings and of their artists. """
+        return self.conn.execute(self.sql['count_paintings']).fetchone()
+
+    def recent_artists(self, n):
+        """Return artists of the last `n` downloads with a known artist, newest first. """
+        return [row[0] for row in self.conn.execute(self.sql['recent_artists'], (n,))]
+
+    def top_artists(self, n):
+        """Return (artist, number of images shown) of the `n` most shown artists. """
+        return self.conn.execute(self.sql['top_artists'], (n,)).fetchall()
+
+    def count_by_state(self):
+        """Return dict of number of downloads by state. """
+        return dict(self.conn.execute(self.sql['count_by_state']))
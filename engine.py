@@ -0,0 +1,151 @@
+"""
+
+engine.py
+~~~~~~~~~
+
+Asyncio engine for the fetch-pick-download pipeline.
+
+Each step is the same function the synchronous path uses, run on a
+thread pool so page fetches, picks and image downloads for several
+destinations overlap on one event loop without blocking it. Pool
+threads share the database through `_SerializedDatabase`, which lets
+one call in at a time.
+
+This is a library API for fetching to many targets at once. A single
+wallpaper has nothing to overlap, so the command line doesn't use it.
+
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import logging
+import threading
+
+from utils import SCRAPE_WORKERS
+from wikiwall import _find_new_urls, _pick_urls, download_img, scrape_urls, store_img
+
+
+logger = logging.getLogger(__name__)
+
+
+class _SerializedDatabase:
+    """Open `DownloadDatabase` whose methods can be called from any thread.
+
+    Calls are serialized with a lock, so transactions of different
+    threads never interleave on the shared connection.
+
+    """
+
+    def __init__(self, db):
+        self._db = db
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attr = getattr(self._db, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+
+        return call
+
+
+class AsyncEngine:
+    """Coroutine versions of the pipeline steps.
+
+    Note:
+        This class acts as a context manager that shuts down its
+        thread pool on exit. `db` must not be used by other threads
+        while the engine runs.
+
+    Args:
+        db: open `DownloadDatabase` of previous downloads.
+        session: `requests.Session` used for every request.
+        workers (`int`, optional): max number of requests in flight.
+        segments (`int`, optional): parallel range requests per large image.
+
+    """
+
+    def __init__(self, db, session, workers=SCRAPE_WORKERS, segments=1):
+        self.db = _SerializedDatabase(db)
+        self.session = session
+        self.workers = workers
+        self.segments = segments
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def close(self):
+        """Shut down thread pool without waiting on unfinished requests. """
+        self._pool.shutdown(wait=False)
+
+    async def _run(self, func, *args):
+        """Run blocking `func` on the thread pool. """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._pool, functools.partial(func, *args))
+
+    async def scrape_urls(self, src_url):
+        """Return list of jpg urls scraped from `src_url`. """
+        return await self._run(lambda: list(scrape_urls(src_url, self.session)))
+
+    async def filter_new(self, urls):
+        """Return urls that aren't in download history. """
+        return await self._run(self.db.filter_new, urls)
+
+    async def download_img(self, url, dest=None):
+        """Download image at `url` to `dest` and return its local path. """
+        return await self._run(download_img, url, dest, self.session, self.segments)
+
+    async def store_img(self, url, dest=None):
+        """Download image at `url` to `dest` unless its content is known.
+
+        See `wikiwall.store_img`.
+
+        Returns:
+            Local path of image, named by its content digest.
+
+        """
+        return await self._run(store_img, url, dest, self.db, self.session, self.segments)
+
+    async def find_new_urls(self, catalog, page=1):
+        """Return unseen urls of the first page from `page` on that has any.
+
+        See `wikiwall._find_new_urls`.
+
+        Raises:
+            ValueError: if a page without any images is reached.
+
+        """
+        return await self._run(_find_new_urls, catalog, self.db, page, self.workers)
+
+    async def fetch_new_images(self, catalog, dests, selector=None):
+        """Download a different unseen image to each of `dests` at once.
+
+        Args:
+            catalog: `Catalog` to take pages of urls from.
+            dests: list of download directories, one per wallpaper target.
+            selector (optional): `Selector` picking the images. Default
+                is uniform picks from the first page with unseen images.
+
+        Returns:
+            List of (url, local path) tuples in the order of `dests`.
+            Shorter than `dests` if fewer unseen images are left on the
+            first page that has any.
+
+        """
+        urls = await self._run(_pick_urls, catalog, self.db, len(dests), self.workers, selector)
+        try:
+            paths = await asyncio.gather(
+                *(self.store_img(url, dest) for url, dest in zip(urls, dests))
+            )
+        except Exception:
+            await self._run(self.db.release, urls)
+            raise
+        return list(zip(urls, paths))
@@ -0,0 +1,210 @@
+"""
+
+eviction.py
+~~~~~~~~~~~
+
+Policies deciding which downloaded images to delete.
+
+Files of a download directory are walked least recently used first,
+by when they were last shown or downloaded if they weren't shown yet.
+Every policy looks at each file in turn: any policy can claim a file
+for deletion and any policy can keep it. The walk stops as soon as no
+policy wants more files, or once its time budget is used up. Whatever
+is left is picked up on the next run.
+
+"""
+from collections import namedtuple
+import logging
+import os
+import time
+
+from utils import EVICT_TIME_BUDGET
+
+
+logger = logging.getLogger(__name__)
+
+
+# Row of the download directory manifest.
+FileEntry = namedtuple('FileEntry', 'path size downloaded shown favorite')
+
+
+class Policy:
+    """Base class of eviction policies.
+
+    Subclasses override the methods they need. The default policy
+    neither claims nor keeps any file.
+
+    """
+
+    def start(self, db, directory, now):
+        """Prepare for a walk over files of `directory` at timestamp `now`. """
+
+    def wants(self, entry):
+        """Return True if `FileEntry` `entry` should be deleted. """
+        return False
+
+    def keeps(self, entry):
+        """Return True if `FileEntry` `entry` must not be deleted. """
+        return False
+
+    def evicted(self, entry):
+        """Called for each deleted file, whichever policy claimed it. """
+
+    @property
+    def done(self):
+        """True once this policy won't claim any more files. """
+        return True
+
+
+class MaxCount(Policy):
+    """Keep at most `limit` files. """
+
+    def __init__(self, limit):
+        if not isinstance(limit, int) or limit < 0:
+            raise ValueError('`limit` must be a positive integer.')
+        self.limit = limit
+        self.excess = 0
+
+    def start(self, db, directory, now):
+        self.excess = db.count_files(directory) - self.limit
+
+    def wants(self, entry):
+        return self.excess > 0
+
+    def evicted(self, entry):
+        self.excess -= 1
+
+    @property
+    def done(self):
+        return self.excess <= 0
+
+
+class MaxBytes(Policy):
+    """Keep at most `limit` bytes of files. """
+
+    def __init__(self, limit):
+        if not isinstance(limit, int) or limit < 0:
+            raise ValueError('`limit` must be a positive integer.')
+        self.limit = limit
+        self.excess = 0
+
+    def start(self, db, directory, now):
+        self.excess = db.files_size(directory) - self.limit
+
+    def wants(self, entry):
+        return self.excess > 0
+
+    def evicted(self, entry):
+        self.excess -= entry.size
+
+    @property
+    def done(self):
+        return self.excess <= 0
+
+
+class MaxAge(Policy):
+    """Delete files not shown, or downloaded, in the last `seconds`. """
+
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ValueError('`seconds` must be positive.')
+        self.seconds = seconds
+        self.cutoff = None
+        self._done = False
+
+    def start(self, db, directory, now):
+        self.cutoff = now - self.seconds
+        self._done = False
+
+    def wants(self, entry):
+        used = entry.shown if entry.shown is not None else entry.downloaded
+        if used < self.cutoff:
+            return True
+
+        # Files come least recently used first, so the rest are newer.
+        self._done = True
+        return False
+
+    @property
+    def done(self):
+        return self._done
+
+
+class KeepFavorites(Policy):
+    """Never delete files marked as favorite. """
+
+    def keeps(self, entry):
+        return bool(entry.favorite)
+
+
+class Evictor:
+    """Delete files of a download directory that `policies` claim.
+
+    Args:
+        db: open `DownloadDatabase` holding the directory manifest.
+        directory (`str`): download directory.
+        policies: list of `Policy` objects.
+
+    """
+
+    def __init__(self, db, directory, policies):
+        self.db = db
+        self.directory = directory
+        self.policies = policies
+
+    def run(self, time_budget=EVICT_TIME_BUDGET, now=None):
+        """Delete claimed files for at most `time_budget` seconds.
+
+        Args:
+            time_budget (`float`, optional): seconds to spend before
+                leaving the rest for the next run. None for no limit.
+            now (`float`, optional): timestamp to judge ages by.
+                Default is now.
+
+        Returns:
+            List of deleted paths.
+
+        """
+        if now is None:
+            now = time.time()
+        if time_budget is not None:
+            deadline = time.monotonic() + time_budget
+
+        for policy in self.policies:
+            policy.start(self.db, self.directory, now)
+
+        removed = []
+        if all(policy.done for policy in self.policies):
+            return removed
+
+        files = self.db.lru_files(self.directory)
+        try:
+            for entry in map(FileEntry._make, files):
+                if all(policy.done for policy in self.policies):
+                    break
+                if time_budget is not None and time.monotonic() > deadline:
+                    logger.info('Eviction out of time. Continuing next run.')
+                    break
+
+                if any(policy.keeps(entry) for policy in self.policies):
+                    continue
+                # Every policy sees every file, so stateful ones stay in sync.
+                if not any([policy.wants(entry) for policy in self.policies]):
+                    continue
+
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+                else:
+                    logger.info('%s removed.', entry.path)
+
+                removed.append(entry.path)
+                for policy in self.policies:
+                    policy.evicted(entry)
+        finally:
+            files.close()
+
+        self.db.remove_files(removed)
+
+        return removed
@@ -0,0 +1,118 @@
+"""
+
+fileadapter.py
+~~~~~~~~~~~~~~
+
+Requests transport adapter for `file://` urls.
+
+Mounted on sessions so images of local sources go through the same
+download, hashing and resume code as images on the web. GET and HEAD
+requests and single byte ranges are supported.
+
+"""
+import logging
+import os
+import re
+import urllib.parse
+import urllib.request
+
+from requests import Response
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+
+logger = logging.getLogger(__name__)
+
+_range = re.compile(r'bytes=(\d*)-(\d*)$')
+
+
+class _FileBody:
+    """Readable `length` bytes of open file `f`, like urllib3's raw response. """
+
+    decode_content = False
+
+    def __init__(self, f, length):
+        self._f = f
+        self._left = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._left:
+            size = self._left
+        data = self._f.read(size) if size else b''
+        self._left -= len(data)
+        return data
+
+    def readinto(self, buf):
+        size = min(len(buf), self._left)
+        n = self._f.readinto(memoryview(buf)[:size]) if size else 0
+        self._left -= n
+        return n
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+
+
+class FileAdapter(BaseAdapter):
+    """Answer requests for `file://` urls from the local file system. """
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        response = Response()
+        response.request = request
+        response.url = request.url
+        response.headers = CaseInsensitiveDict({'Accept-Ranges': 'bytes'})
+        response.raw = _FileBody(None, 0)
+
+        path = urllib.request.url2pathname(urllib.parse.urlsplit(request.url).path)
+
+        if request.method not in ('GET', 'HEAD'):
+            return self._status(response, 405, 'Method Not Allowed')
+
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return self._status(response, 404, 'Not Found')
+        except OSError:
+            return self._status(response, 403, 'Forbidden')
+
+        size = os.fstat(f.fileno()).st_size
+        start, end = 0, size - 1
+        response.status_code, response.reason = 200, 'OK'
+
+        match = _range.match(request.headers.get('Range', ''))
+        if match and any(match.groups()):
+            first, last = match.groups()
+            if not first:
+                # Suffix range: the last `last` bytes.
+                start = max(0, size - int(last))
+            else:
+                start = int(first)
+                if last:
+                    end = min(int(last), size - 1)
+
+            if start >= size or start > end:
+                f.close()
+                response.headers['Content-Range'] = f'bytes */{size}'
+                return self._status(response, 416, 'Range Not Satisfiable')
+
+            response.status_code, response.reason = 206, 'Partial Content'
+            response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+        length = end - start + 1
+        response.headers['Content-Length'] = str(length)
+
+        if request.method == 'HEAD':
+            f.close()
+            return response
+
+        f.seek(start)
+        response.raw = _FileBody(f, length)
+        return response
+
+    def _status(self, response, code, reason):
+        response.status_code, response.reason = code, reason
+        response.headers['Content-Length'] = '0'
+        return response
+
+    def close(self):
+        pass
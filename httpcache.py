@@ -0,0 +1,222 @@
+"""
+
+httpcache.py
+~~~~~~~~~~~~
+
+On-disk HTTP cache for json pages.
+
+Responses are stored as their decoded body next to a small json file
+of the headers needed to reuse them. A stored response is served
+without a request while `Cache-Control: max-age` or `Expires` says it
+is fresh. After that, it is revalidated with `If-None-Match` and
+`If-Modified-Since`, and a `304 Not Modified` answer serves the stored
+body again, so an unchanged page costs one round trip and no body.
+
+Responses marked `no-store` are never stored and ones marked
+`no-cache` are revalidated every time. Without any freshness
+information a response is stored but revalidated every time.
+
+"""
+from email.utils import parsedate_to_datetime
+import hashlib
+import json
+import logging
+import os
+import os.path
+import tempfile
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_cache_control(value):
+    """Return dict of directives of `Cache-Control` header `value`.
+
+    Directives without a value map to True. Names are lowercase.
+
+    """
+    directives = {}
+    for part in (value or '').split(','):
+        name, _, arg = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = arg.strip('"') if arg else True
+    return directives
+
+
+def _timestamp(value):
+    """Return timestamp of http date `value` or None if it isn't one. """
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def freshness(headers, now):
+    """Return seconds a response with `headers` received at `now` stays fresh.
+
+    Returns:
+        None if the response must not be stored.
+
+    """
+    cache_control = parse_cache_control(headers.get('Cache-Control'))
+    if 'no-store' in cache_control:
+        return None
+    if 'no-cache' in cache_control:
+        return 0
+
+    try:
+        age = int(headers.get('Age', 0))
+    except ValueError:
+        age = 0
+
+    if 'max-age' in cache_control:
+        try:
+            return max(0, int(cache_control['max-age']) - age)
+        except ValueError:
+            return 0
+
+    expires = _timestamp(headers.get('Expires'))
+    if expires is not None:
+        date = _timestamp(headers.get('Date')) or now
+        return max(0, expires - date - age)
+
+    return 0
+
+
+class HTTPCache:
+    """Directory of cached response bodies.
+
+    Args:
+        path (`str`): directory to store responses in.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        os.makedirs(path, exist_ok=True)
+
+    def _files(self, url):
+        """Return paths of body and header files of `url`. """
+        name = os.path.join(self.path, hashlib.sha256(url.encode()).hexdigest()[:32])
+        return name + '.body', name + '.json'
+
+    def lookup(self, url):
+        """Return stored headers record of `url` or None. """
+        body, meta = self._files(url)
+        try:
+            with open(meta, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger.warning('Corrupt cache entry for %s. Ignoring.', url)
+            return None
+
+        if record.get('url') != url or not os.path.isfile(body):
+            return None
+        return record
+
+    def _save(self, url, record):
+        _, meta = self._files(url)
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(record, f)
+        os.replace(tmp, meta)
+
+    def _record(self, url, headers, now, record=None):
+        """Return headers record of response to `url` with `headers`. """
+        record = dict(record or {}, url=url, stored=now, fresh_for=freshness(headers, now))
+        for key, header in (('etag', 'ETag'), ('last_modified', 'Last-Modified')):
+            if headers.get(header):
+                record[key] = headers[header]
+        return record
+
+    def _read(self, url, chunk_size):
+        body, _ = self._files(url)
+        with open(body, 'rb') as f:
+            yield from iter(lambda: f.read(chunk_size), b'')
+
+    def is_fresh(self, record, now=None):
+        """Check if stored response `record` can be used without asking. """
+        now = time.time() if now is None else now
+        return now - record['stored'] < record['fresh_for']
+
+    def fetch(self, session, url, chunk_size):
+        """Yield body of `url` in chunks, from cache when possible.
+
+        A new body is written to the cache as it is read. If reading
+        stops early, the rest of the body is read on close so the
+        entry is complete.
+
+        Args:
+            session: `requests.Session` to use.
+            url (`str`): url to get.
+            chunk_size (`int`): bytes per chunk.
+
+        Raises:
+            Any typical Requests exceptions.
+
+        """
+        record = self.lookup(url)
+        if record is not None and self.is_fresh(record):
+            logger.info('Using fresh cached response of %s.', url)
+            yield from self._read(url, chunk_size)
+            return
+
+        headers = {}
+        if record is not None:
+            if record.get('etag'):
+                headers['If-None-Match'] = record['etag']
+            if record.get('last_modified'):
+                headers['If-Modified-Since'] = record['last_modified']
+
+        r = session.get(url, headers=headers, stream=True)
+        try:
+            now = time.time()
+            if r.status_code == 304 and record is not None:
+                logger.info('%s not modified. Using cached response.', url)
+                record = self._record(url, r.headers, now, record)
+                if record['fresh_for'] is not None:
+                    self._save(url, record)
+                yield from self._read(url, chunk_size)
+                return
+
+            r.raise_for_status()
+
+            record = self._record(url, r.headers, now)
+            chunks = r.iter_content(chunk_size)
+            if record['fresh_for'] is None:
+                yield from chunks
+                return
+
+            yield from self._store(url, record, chunks)
+        finally:
+            r.close()
+
+    def _store(self, url, record, chunks):
+        """Yield `chunks` while writing them to the cache entry of `url`. """
+        body, _ = self._files(url)
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        complete = False
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                try:
+                    for chunk in chunks:
+                        f.write(chunk)
+                        yield chunk
+                except GeneratorExit:
+                    # Parsers may stop before the end of the body.
+                    try:
+                        for chunk in chunks:
+                            f.write(chunk)
+                    except Exception:
+                        logger.info('Cannot read rest of %s. Not caching it.', url)
+                        return
+            os.replace(tmp, body)
+            complete = True
+            self._save(url, record)
+        finally:
+            if not complete:
+                os.remove(tmp)
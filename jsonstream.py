@@ -0,0 +1,216 @@
+"""
+
+jsonstream.py
+~~~~~~~~~~~~~
+
+Incremental parsing of a json array inside a json object.
+
+Each page of Wikiart's json data is one object whose `Paintings` array
+holds every record. Instead of reading the whole body and building the
+full object tree first, items of the array are decoded one at a time
+as bytes arrive, and the text they were decoded from is dropped, so
+memory stays at about one chunk plus one item however large the page.
+
+Only the standard library decoder is used: `JSONDecoder.raw_decode`
+decodes one value at a position of the buffered text. Objects, arrays
+and strings are scanned for their end first, keeping track of brackets
+and quotes across chunks, and decoded once they are complete, so a
+value spread over many chunks is still decoded only once. Other values
+are only taken once whitespace or one of `,]}` follows them, so a
+number cut off at the end of a chunk, even right after a `.`, an
+exponent or a sign, is never mistaken for a complete one.
+
+"""
+import codecs
+import json
+import logging
+import re
+
+
+logger = logging.getLogger(__name__)
+
+_decoder = json.JSONDecoder()
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+_bracket_or_quote = re.compile(r'["\[\]{}]')
+
+# Characters that can follow a whole number or literal.
+_value_end = ' \t\n\r,]}'
+
+# Text of a string up to its closing quote, or a backslash cut off
+# from the character it escapes.
+_string_text = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+
+
+class _Buffer:
+    """Text decoded from byte `chunks` that is read front to back. """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.pos = 0
+        self.done = False
+
+    def fill(self):
+        """Read next chunk, dropping text before `pos`.
+
+        Returns:
+            False if there is nothing left to read.
+
+        """
+        if self.done:
+            return False
+
+        self.text = self.text[self.pos:]
+        self.pos = 0
+
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self.done = True
+            self.text += self._utf8.decode(b'', final=True)
+        else:
+            self.text += self._utf8.decode(chunk)
+        return True
+
+    def peek(self):
+        """Return next character that isn't whitespace, or '' at the end. """
+        while True:
+            self.pos = _whitespace.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars):
+        """Consume next non-whitespace character, which must be in `chars`.
+
+        Raises:
+            ValueError: if another character or the end comes next.
+
+        """
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f'Expected one of {chars!r} at {self.pos}, got {char!r}.')
+        self.pos += 1
+        return char
+
+    def _scan(self):
+        """Read until the object, array or string at `pos` is complete.
+
+        Every character is looked at once, however many chunks the
+        value is spread over.
+
+        Returns:
+            False if the text ends first.
+
+        """
+        in_string = self.text[self.pos] == '"'
+        depth = 0 if in_string else 1
+        end = self.pos + 1
+        while True:
+            if in_string:
+                end = _string_text.match(self.text, end).end()
+                if end < len(self.text) and self.text[end] == '"':
+                    in_string = False
+                    end += 1
+                    if not depth:
+                        return True
+                    continue
+            else:
+                match = _bracket_or_quote.search(self.text, end)
+                if match:
+                    end = match.end()
+                    if match.group() == '"':
+                        in_string = True
+                    elif match.group() in '[{':
+                        depth += 1
+                    else:
+                        depth -= 1
+                        if not depth:
+                            return True
+                    continue
+                end = len(self.text)
+
+            # `fill` drops the text before `pos`.
+            scanned = end - self.pos
+            if not self.fill():
+                return False
+            end = self.pos + scanned
+
+    def value(self):
+        """Decode and consume next json value.
+
+        Raises:
+            ValueError: if the text isn't valid json.
+
+        """
+        if self.peek() in ('{', '[', '"'):
+            self._scan()
+            value, self.pos = _decoder.raw_decode(self.text, self.pos)
+            return value
+
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                # Most likely cut off by the end of the chunk.
+                if not self.fill():
+                    raise
+                continue
+
+            # Numbers and literals are only known to be whole once a
+            # delimiter follows them, since `1.` and `1e` decode as 1.
+            if (end < len(self.text) and self.text[end] in _value_end) or not self.fill():
+                self.pos = end
+                return value
+
+
+def iter_array(chunks, key):
+    """Yield items of array `key` of the json object in byte `chunks`.
+
+    Args:
+        chunks: iterable of bytes of utf-8 encoded json, such as
+            `Response.iter_content`.
+        key (`str`): key of the array in the top level object.
+
+    Raises:
+        KeyError: if the object has no `key` or its value is null.
+        ValueError: if the data isn't a json object or `key` isn't an
+            array.
+
+    Yields:
+        Items of the array, in order, as they are decoded.
+
+    """
+    buf = _Buffer(chunks)
+
+    buf.expect('{')
+    if buf.peek() == '}':
+        raise KeyError(key)
+
+    while True:
+        name = buf.value()
+        if not isinstance(name, str):
+            raise ValueError(f'Expected object key at {buf.pos}.')
+        buf.expect(':')
+
+        if name == key:
+            if buf.peek() != '[':
+                if buf.value() is None:
+                    raise KeyError(key)
+                raise ValueError(f'{key!r} is not an array.')
+            buf.expect('[')
+
+            if buf.peek() == ']':
+                return
+            while True:
+                yield buf.value()
+                if buf.expect(',]') == ']':
+                    return
+
+        # Skip values of other keys.
+        buf.value()
+        if buf.expect(',}') == '}':
+            raise KeyError(key)
@@ -0,0 +1,119 @@
+"""
+
+locks.py
+~~~~~~~~
+
+File locks that let one of several wikiwall processes do a job while
+the others wait for its result.
+
+Locks are `flock` locks on a file next to the data they guard, so the
+operating system releases them when a process dies and there is never
+a stale lock to clean up. The holder deletes the file before releasing
+it. A waiter that gets a lock on a deleted file opens the path again,
+so two processes never both think they hold the lock.
+
+Single flight goes like this: check for the result, take the lock,
+check again, and only do the work if the result still isn't there.
+
+"""
+import errno
+import fcntl
+import logging
+import os
+import time
+
+from utils import LOCK_TIMEOUT
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds between attempts to take a held lock.
+LOCK_POLL = 0.05
+
+
+class FileLock:
+    """Exclusive lock between processes, and threads, on file `path`.
+
+    Note:
+        This class acts as a context manager.
+
+    Args:
+        path (`str`): lock file. Created while the lock is held.
+        timeout (`float`, optional): seconds to wait for the lock. None
+            to wait forever.
+
+    """
+
+    def __init__(self, path, timeout=LOCK_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self.waited = False
+        self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.release()
+
+    def _try_lock(self):
+        """Take the lock if it is free.
+
+        Returns:
+            True if the lock is held now.
+
+        """
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as err:
+            os.close(fd)
+            if err.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            return False
+
+        # The file may have been deleted by its last holder meanwhile.
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            current = None
+        locked = os.fstat(fd)
+        if current is None or (current.st_dev, current.st_ino) != (locked.st_dev, locked.st_ino):
+            os.close(fd)
+            return False
+
+        self._fd = fd
+        return True
+
+    def acquire(self):
+        """Wait for and take the lock.
+
+        Raises:
+            TimeoutError: if the lock isn't free within `timeout` seconds.
+
+        """
+        if self._fd is not None:
+            raise RuntimeError(f'{self.path} is locked already.')
+
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        self.waited = False
+        while not self._try_lock():
+            if not self.waited:
+                logger.info('Waiting for another run holding %s.', self.path)
+                self.waited = True
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f'Gave up waiting for {self.path}.')
+            time.sleep(LOCK_POLL)
+
+    def release(self):
+        """Delete lock file and release the lock. """
+        if self._fd is None:
+            return
+
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        os.close(self._fd)
+        self._fd = None
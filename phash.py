@@ -0,0 +1,154 @@
+"""
+
+phash.py
+~~~~~~~~
+
+Perceptual hashes for spotting the same painting in different files.
+
+Wikiart often serves one painting at several resolutions or crops, so
+the same artwork turns up under urls and bytes that look nothing alike.
+A difference hash (dHash) of a small grayscale copy of an image stays
+within a few bits across such variants.
+
+Hashing needs NumPy and Pillow, which are optional:
+
+    $ pip3 install wikiwall[phash]
+
+"""
+import logging
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    np = Image = None
+
+
+logger = logging.getLogger(__name__)
+
+# Width and height of the gradient grid. Hashes have HASH_SIZE ** 2 bits.
+HASH_SIZE = 8
+
+HASH_BITS = HASH_SIZE ** 2
+
+# Python 3.10+ counts bits natively.
+_popcount = getattr(int, 'bit_count', None) or (lambda x: bin(x).count('1'))
+
+
+def available():
+    """Check if NumPy and Pillow are installed. """
+    return np is not None
+
+
+def dhash(path):
+    """Return 64-bit difference hash of image at `path`.
+
+    The image is decoded at reduced size where the format allows,
+    shrunk to a 9x8 grayscale grid, and each bit records whether a
+    pixel is brighter than its right-hand neighbour.
+
+    Raises:
+        RuntimeError: if NumPy or Pillow aren't installed.
+        OSError: if `path` can't be read as an image.
+
+    """
+    if not available():
+        raise RuntimeError('Perceptual hashing needs numpy and Pillow installed.')
+
+    with Image.open(path) as img:
+        # Let the JPEG decoder skip detail that's thrown away anyway.
+        img.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+        small = img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.BOX)
+
+    px = np.asarray(small, dtype=np.int16)
+    bits = np.packbits(px[:, 1:] > px[:, :-1])
+
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+def distance(a, b):
+    """Return number of bits hashes `a` and `b` differ in. """
+    return _popcount(a ^ b)
+
+
+class HammingIndex:
+    """Hashes searchable by Hamming distance using multi-index hashing.
+
+    Each hash is split into `radius + 1` chunks. Two hashes at most
+    `radius` bits apart agree exactly on at least one chunk, so a query
+    only compares against hashes that share a chunk with it, found with
+    one dict lookup per chunk.
+
+    Args:
+        radius (`int`): max distance of hashes returned by `query`.
+        bits (`int`, optional): size of hashes.
+        load (optional): callable returning (hash, key) pairs to add
+            before the index is first used.
+
+    Raises:
+        ValueError: if `radius` is negative or not smaller than `bits`.
+
+    """
+
+    def __init__(self, radius, bits=HASH_BITS, load=None):
+        if not 0 <= radius < bits:
+            raise ValueError(f'`radius` must be between 0 and {bits - 1}.')
+
+        self.radius = radius
+
+        # Spread bits over chunks as evenly as possible.
+        count = radius + 1
+        self._chunks = []
+        shift = 0
+        for i in range(count):
+            width = bits // count + (i < bits % count)
+            self._chunks.append((shift, (1 << width) - 1))
+            shift += width
+
+        self._tables = [{} for _ in self._chunks]
+        self._keys = {}
+        self._load = load
+
+    def __len__(self):
+        self._loaded()
+        return sum(len(keys) for keys in self._keys.values())
+
+    def _loaded(self):
+        """Add hashes of `load` if not done yet. """
+        if self._load is not None:
+            load, self._load = self._load, None
+            for h, key in load():
+                self._add(h, key)
+
+    def add(self, h, key):
+        """Add hash `h` of item `key`, like the url of an image. """
+        self._loaded()
+        self._add(h, key)
+
+    def _add(self, h, key):
+        if h not in self._keys:
+            self._keys[h] = []
+            for table, (shift, mask) in zip(self._tables, self._chunks):
+                table.setdefault((h >> shift) & mask, []).append(h)
+        self._keys[h].append(key)
+
+    def query(self, h):
+        """Return keys of hashes at most `radius` bits from `h`.
+
+        Returns:
+            List of (distance, key) tuples, closest first.
+
+        """
+        self._loaded()
+
+        candidates = set()
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            candidates.update(table.get((h >> shift) & mask, ()))
+
+        matches = []
+        for other in candidates:
+            d = _popcount(h ^ other)
+            if d <= self.radius:
+                matches.extend((d, key) for key in self._keys[other])
+
+        return sorted(matches)
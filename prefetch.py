@@ -0,0 +1,96 @@
+"""
+
+prefetch.py
+~~~~~~~~~~~
+
+Queue of downloaded images waiting to be shown.
+
+Images are fetched ahead of time into a queue directory and recorded in
+the download database as prefetched, so changing the wallpaper only has
+to take the next one off the queue.
+
+"""
+import logging
+import os
+import os.path
+import shutil
+
+from db import STATE_PREFETCHED
+
+
+logger = logging.getLogger(__name__)
+
+
+class PrefetchQueue:
+    """Directory of prefetched images tracked in a `DownloadDatabase`.
+
+    Args:
+        db: open `DownloadDatabase`.
+        path (`str`): queue directory.
+        size (`int`): number of images to keep queued.
+
+    """
+
+    def __init__(self, db, path, size):
+        self.db = db
+        self.path = path
+        self.size = size
+
+        os.makedirs(path, exist_ok=True)
+
+    def pop(self, dest):
+        """Move oldest queued image to `dest`.
+
+        Note:
+            The image is claimed in the database before its file is
+            moved, so overlapping runs never take the same one. It
+            stays reserved until `DownloadDatabase.mark_shown` or
+            `release`. Records whose file went missing are dropped from
+            the database, so their urls can be downloaded again.
+
+        Returns:
+            Tuple of image url and its new path, or None if the queue
+            is empty.
+
+        """
+        while True:
+            item = self.db.next_prefetched()
+            if item is None:
+                return None
+
+            url, queued = item
+            if not self.db.claim_prefetched(url):
+                # Another run took it since.
+                continue
+
+            if os.path.isfile(queued):
+                path = os.path.join(dest, os.path.basename(queued))
+                shutil.move(queued, path)
+                logger.info('Took %s from prefetch queue.', path)
+                return url, path
+
+            logger.warning('Prefetched image %s is missing.', queued)
+            self.db.remove(url)
+
+    def refill(self, fetch):
+        """Download images until `size` images are queued.
+
+        Args:
+            fetch: callable taking a directory, downloading a new image
+                to it and returning tuple of its url and local path.
+
+        Returns:
+            Number of images added to queue.
+
+        """
+        added = 0
+
+        while self.db.count_prefetched() < self.size:
+            url, path = fetch(self.path)
+            self.db.add(url, state=STATE_PREFETCHED, path=path)
+            added += 1
+
+        if added:
+            logger.info('%s images added to prefetch queue.', added)
+
+        return added
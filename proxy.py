@@ -0,0 +1,484 @@
+"""
+
+proxy.py
+~~~~~~~~
+
+Caching HTTP proxy so machines on a LAN fetch each image from Wikiart
+once.
+
+Clients ask for `http://PROXY/SCHEME/HOST/PATH` instead of
+`SCHEME://HOST/PATH`. `CacheProxyAdapter` does the rewriting for a
+`requests.Session`, so pointing wikiwall at a proxy takes one option.
+
+The first request for a url starts one upstream fetch that writes to a
+temporary file. Every request for that url that comes in meanwhile,
+including byte ranges, streams from the same file as it grows instead
+of fetching again. Complete responses are moved into the cache.
+Images are kept until the cache is trimmed. Anything else, like pages
+of the json feed, is kept for `ttl` seconds.
+
+"""
+import hashlib
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import logging
+import os
+import os.path
+import re
+import socketserver
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from requests.adapters import HTTPAdapter
+
+from utils import CATALOG_TTL, PROXY_HOSTS
+
+
+logger = logging.getLogger(__name__)
+
+# Bytes copied to clients at a time.
+PROXY_CHUNK_SIZE = 64 * 1024
+
+# Fetched bytes are handed to waiting clients once this many are
+# buffered, or this many seconds after the last hand over.
+PROXY_FLUSH_SIZE = 1024 * 1024
+PROXY_FLUSH_INTERVAL = 0.1
+
+_range = re.compile(r'bytes=(\d*)-(\d*)$')
+
+
+def proxied_url(proxy, url):
+    """Return url to ask `proxy` for `url` with. """
+    parts = urllib.parse.urlsplit(url)
+    path = f'{proxy.rstrip("/")}/{parts.scheme}/{parts.netloc}{parts.path or "/"}'
+    return path + ('?' + parts.query if parts.query else '')
+
+
+def upstream_url(path):
+    """Return url that request path `path` of a proxied url stands for.
+
+    Raises:
+        ValueError: if `path` isn't a proxied http or https url.
+
+    """
+    _, scheme, rest = (path.split('/', 2) + ['', ''])[:3]
+    host, _, tail = rest.partition('/')
+    if scheme not in ('http', 'https') or not host:
+        raise ValueError(f'Not a proxied url: {path}')
+    return f'{scheme}://{host}/{tail}'
+
+
+class CacheProxyAdapter(HTTPAdapter):
+    """Transport adapter sending requests through caching proxy `proxy`.
+
+    Args:
+        proxy (`str`): base url of a `wikiwall serve-cache` proxy.
+        **kwargs: passed on to `HTTPAdapter`.
+
+    """
+
+    def __init__(self, proxy, **kwargs):
+        super().__init__(**kwargs)
+        self.proxy = proxy.rstrip('/')
+
+    def send(self, request, **kwargs):
+        if not request.url.startswith(self.proxy + '/'):
+            request.url = proxied_url(self.proxy, request.url)
+        return super().send(request, **kwargs)
+
+
+class _Fill:
+    """Upstream fetch of one url, written to `path` as it arrives. """
+
+    def __init__(self, url, path):
+        self.url = url
+        self.path = path
+        self.cond = threading.Condition()
+        self.status = None
+        self.content_type = None
+        self.length = None
+        self.size = 0
+        self.done = False
+        self.error = None
+
+    def wait_headers(self):
+        with self.cond:
+            self.cond.wait_for(lambda: self.status is not None or self.done)
+
+    def wait_done(self):
+        """Wait until the fetch ended.
+
+        Returns:
+            Number of bytes written.
+
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.done)
+            return self.size
+
+    def written(self, f, n):
+        """Flush `f` and let waiting clients read the `n` bytes written since last time. """
+        f.flush()
+        with self.cond:
+            self.size += n
+            self.cond.notify_all()
+
+    def wait_for(self, offset):
+        """Wait until bytes past `offset` are written or the fetch ended.
+
+        Returns:
+            Tuple of bytes written and whether the fetch ended.
+
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.size > offset or self.done)
+            return self.size, self.done
+
+
+class CacheProxy:
+    """Cache directory and upstream fetches shared by request handlers.
+
+    Args:
+        path (`str`): directory to cache responses in.
+        session: `requests.Session` for upstream requests.
+        hosts (optional): hosts, and their subdomains, that may be
+            fetched.
+        ttl (`int`, optional): seconds to keep responses that aren't
+            images.
+        max_bytes (`int`, optional): size to trim the cache to. None
+            for no limit.
+
+    """
+
+    def __init__(self, path, session, hosts=PROXY_HOSTS, ttl=CATALOG_TTL, max_bytes=None):
+        self.path = path
+        self.session = session
+        self.hosts = tuple(hosts)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._fills = {}
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        # Bytes of cached bodies, so stores only trim once over the limit.
+        self._size = sum(size for _, _, size in self._bodies()) if max_bytes is not None else 0
+
+    def is_allowed(self, url):
+        """Check if the host of `url` may be fetched. """
+        host = (urllib.parse.urlsplit(url).hostname or '').lower()
+        return any(host == allowed or host.endswith('.' + allowed) for allowed in self.hosts)
+
+    def _files(self, url):
+        name = os.path.join(self.path, hashlib.sha256(url.encode()).hexdigest())
+        return name + '.body', name + '.json'
+
+    def lookup(self, url, now=None):
+        """Return headers record of fresh cached response to `url` or None. """
+        body, meta = self._files(url)
+        try:
+            with open(meta, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        now = time.time() if now is None else now
+        if record.get('url') != url or not os.path.isfile(body):
+            return None
+        if record['expires'] is not None and now >= record['expires']:
+            return None
+        return record
+
+    def open(self, url):
+        """Return cached record and open body, or a `_Fill` to stream from.
+
+        Returns:
+            Tuple of (record, file) for a cached response or
+            (fill, file) for a response being fetched. The caller
+            closes the file.
+
+        """
+        with self._lock:
+            record = self.lookup(url)
+            if record is not None:
+                body, _ = self._files(url)
+                try:
+                    f = open(body, 'rb')
+                except FileNotFoundError:
+                    # Trimmed just now.
+                    pass
+                else:
+                    os.utime(body)
+                    return record, f
+
+            fill = self._fills.get(url)
+            if fill is None:
+                fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+                os.close(fd)
+                fill = self._fills[url] = _Fill(url, tmp)
+                threading.Thread(target=self._fill, args=(fill,), daemon=True).start()
+            else:
+                logger.info('Joining fetch of %s.', url)
+
+            return fill, open(fill.path, 'rb')
+
+    def _fill(self, fill):
+        """Fetch `fill.url` into `fill.path` and cache complete 200 responses. """
+        stored = False
+        try:
+            logger.info('Fetching %s.', fill.url)
+            with self.session.get(fill.url, stream=True) as r:
+                with fill.cond:
+                    fill.status = r.status_code
+                    fill.content_type = r.headers.get('content-type')
+                    length = r.headers.get('content-length')
+                    if length is not None and 'content-encoding' not in r.headers:
+                        fill.length = int(length)
+                    fill.cond.notify_all()
+
+                with open(fill.path, 'wb', buffering=PROXY_FLUSH_SIZE) as f:
+                    buffered = 0
+                    flushed = time.monotonic()
+                    for chunk in r.iter_content(PROXY_CHUNK_SIZE):
+                        f.write(chunk)
+                        buffered += len(chunk)
+                        now = time.monotonic()
+                        if buffered >= PROXY_FLUSH_SIZE or now - flushed >= PROXY_FLUSH_INTERVAL:
+                            fill.written(f, buffered)
+                            buffered = 0
+                            flushed = now
+                    fill.written(f, buffered)
+
+            if fill.length is not None and fill.size != fill.length:
+                raise IOError(f'{fill.url} incomplete: got {fill.size} of {fill.length} bytes.')
+
+            if fill.status == 200:
+                self._store(fill)
+                stored = True
+        except Exception as err:
+            logger.warning('Fetching %s failed: %s', fill.url, err)
+            fill.error = err
+        finally:
+            with self._lock:
+                del self._fills[fill.url]
+            with fill.cond:
+                fill.done = True
+                fill.cond.notify_all()
+            if not stored:
+                os.remove(fill.path)
+
+        if stored and self.max_bytes is not None and self._size > self.max_bytes:
+            self.trim(self.max_bytes)
+
+    def _store(self, fill):
+        now = time.time()
+        image = (fill.content_type or '').startswith('image/')
+        record = {
+            'url': fill.url,
+            'content_type': fill.content_type,
+            'length': fill.size,
+            'stored': now,
+            'expires': None if image else now + self.ttl,
+            'etag': f'"{int(now * 1000):x}-{fill.size:x}"',
+        }
+
+        body, meta = self._files(fill.url)
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(record, f)
+
+        with self._lock:
+            try:
+                self._size -= os.path.getsize(body)
+            except FileNotFoundError:
+                pass
+            os.replace(fill.path, body)
+            os.replace(tmp, meta)
+            self._size += fill.size
+        logger.info('Cached %s (%s bytes).', fill.url, fill.size)
+
+    def _bodies(self):
+        """Return list of (last use, path, size) of cached bodies. """
+        entries = []
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if entry.name.endswith('.body'):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, entry.path, st.st_size))
+        return entries
+
+    def trim(self, max_bytes):
+        """Delete least recently used responses until at most `max_bytes` are left.
+
+        Returns:
+            Number of responses deleted.
+
+        """
+        entries = self._bodies()
+        total = sum(size for _, _, size in entries)
+
+        removed = 0
+        for _, body, size in sorted(entries):
+            if total <= max_bytes:
+                break
+            with self._lock:
+                for path in (body, body[:-len('.body')] + '.json'):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                self._size -= size
+            total -= size
+            removed += 1
+
+        return removed
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'wikiwall-cache'
+
+    def log_message(self, format, *args):
+        logger.info('%s %s', self.address_string(), format % args)
+
+    def do_HEAD(self):
+        self._serve(body=False)
+
+    def do_GET(self):
+        self._serve(body=True)
+
+    def _serve(self, body):
+        proxy = self.server.proxy
+
+        try:
+            url = upstream_url(self.path)
+        except ValueError:
+            self.send_error(400, 'Expected /SCHEME/HOST/PATH')
+            return
+        if not proxy.is_allowed(url):
+            self.send_error(403, 'Host not allowed')
+            return
+
+        source, f = proxy.open(url)
+        with f:
+            if isinstance(source, _Fill):
+                self._serve_fill(source, f, body)
+            else:
+                self._serve_cached(source, f, body)
+
+    def _requested_range(self, size):
+        """Return (start, end) of a satisfiable Range header, 'bad', or None. """
+        match = _range.match(self.headers.get('Range', ''))
+        if not match or not any(match.groups()):
+            return None
+
+        first, last = match.groups()
+        if not first:
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+
+        if start >= size or start > end:
+            return 'bad'
+        return start, end
+
+    def _send_headers(self, status, content_type, size, length, part, extra=()):
+        """Send status and headers of a body of `length` bytes. """
+        if part == 'bad':
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(206 if part else status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        if size is not None:
+            self.send_header('Accept-Ranges', 'bytes')
+        if part:
+            self.send_header('Content-Range', f'bytes {part[0]}-{part[1]}/{size}')
+        if length is not None:
+            self.send_header('Content-Length', str(length))
+        for header, value in extra:
+            self.send_header(header, value)
+        self.end_headers()
+
+    def _serve_cached(self, record, f, body):
+        if record['expires'] is None:
+            cache_control = 'max-age=31536000, immutable'
+        else:
+            cache_control = f'max-age={max(0, int(record["expires"] - time.time()))}'
+        extra = [('ETag', record['etag']), ('Cache-Control', cache_control)]
+
+        if self.headers.get('If-None-Match') == record['etag']:
+            self.send_response(304)
+            for header, value in extra:
+                self.send_header(header, value)
+            self.end_headers()
+            return
+
+        size = record['length']
+        part = self._requested_range(size)
+        start, end = part if part and part != 'bad' else (0, size - 1)
+        self._send_headers(200, record['content_type'], size, end - start + 1, part, extra)
+
+        if body and part != 'bad':
+            f.seek(start)
+            left = end - start + 1
+            while left > 0:
+                data = f.read(min(PROXY_CHUNK_SIZE, left))
+                if not data:
+                    break
+                self.wfile.write(data)
+                left -= len(data)
+
+    def _serve_fill(self, fill, f, body):
+        fill.wait_headers()
+        if fill.status is None:
+            self.send_error(502, 'Upstream request failed')
+            return
+
+        size = fill.length
+        part = None
+        if fill.status == 200 and self.headers.get('Range'):
+            if size is None:
+                # Ranges need the total, which only the end tells.
+                size = fill.wait_done()
+                if fill.error is not None:
+                    self.send_error(502, 'Upstream request failed')
+                    return
+            part = self._requested_range(size)
+
+        start, end = part if part and part != 'bad' else (0, None if size is None else size - 1)
+        length = None if end is None else end - start + 1
+        self._send_headers(fill.status, fill.content_type, size, length, part)
+
+        if not body or part == 'bad':
+            return
+
+        pos = start
+        while end is None or pos <= end:
+            written, done = fill.wait_for(pos)
+            if written <= pos:
+                # Upstream ended. Clients spot a short body by its length.
+                break
+            f.seek(pos)
+            stop = written if end is None else min(written, end + 1)
+            while pos < stop:
+                data = f.read(min(PROXY_CHUNK_SIZE, stop - pos))
+                self.wfile.write(data)
+                pos += len(data)
+
+
+class CacheProxyServer(socketserver.ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server answering requests from `proxy`, a `CacheProxy`. """
+
+    daemon_threads = True
+
+    def __init__(self, address, proxy):
+        super().__init__(address, _Handler)
+        self.proxy = proxy
@@ -0,0 +1,236 @@
+"""
+
+selection.py
+~~~~~~~~~~~~
+
+Weighted random picks from streams of painting records.
+
+Picks use weighted reservoir sampling with exponential jumps (A-ExpJ,
+Efraimidis and Spirakis). Every record gets a random key that favours
+higher weights and the `k` records with the largest keys are kept.
+Once the reservoir is full, the number of records to skip before the
+next one that makes it in is drawn directly, so long streams cost
+O(log k) random numbers per replacement instead of one per record.
+Only the reservoir is kept in memory, however many pages go by.
+
+"""
+import heapq
+import logging
+import math
+import random
+
+from utils import ARTIST_GAP, SELECT_PAGES, painting_year
+
+
+logger = logging.getLogger(__name__)
+
+
+def _pixels(painting):
+    """Return pixel count of `painting` or None if it isn't known. """
+    try:
+        return int(painting['width']) * int(painting['height']) or None
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _by_century(painting, sign):
+    year = painting_year(painting)
+    return 1.0 if year is None else 2.0 ** (sign * (year - 2000) / 100)
+
+
+# Weight functions by name. Paintings missing the data a weight is
+# based on get weight 1. `old` and `new` double the weight per century.
+WEIGHTS = {
+    'uniform': lambda painting: 1.0,
+    'size': lambda painting: _pixels(painting) or 1,
+    'old': lambda painting: _by_century(painting, -1),
+    'new': lambda painting: _by_century(painting, 1),
+}
+
+
+def artist(painting):
+    """Return artist name of `painting` or None. """
+    return painting.get('artistName') or None
+
+
+def weighted_sample(items, k=1, weight=None, stratum=None, rng=random):
+    """Return up to `k` items of iterable `items` picked by weight.
+
+    Each item is picked with probability proportional to its weight,
+    without replacement.
+
+    Args:
+        items: iterable of items. Read once.
+        k (`int`, optional): number of items to pick.
+        weight (optional): function returning weight of an item.
+            Items weighing 0 or less are never picked. Default is
+            equal weights.
+        stratum (optional): function returning group of an item, like
+            its artist. If given, at most one item per group is picked.
+            None groups are never limited.
+        rng (optional): `random.Random` compatible source of numbers.
+
+    Returns:
+        List of picked items, highest key first. Shorter than `k` if
+        there aren't enough items or groups.
+
+    """
+    if k < 1:
+        return []
+
+    # Min-heap of (key, count, item, group). Keys are log(u) / weight,
+    # the log of A-Res's u ** (1 / weight), so they don't underflow.
+    heap = []
+    groups = {}
+    count = 0
+
+    def offer(key, item, group):
+        nonlocal count
+
+        if group is not None and group in groups:
+            # Only the best item of each group counts.
+            if key <= groups[group][0]:
+                return
+            heap.remove(groups[group])
+            heapq.heapify(heap)
+        elif len(heap) == k:
+            evicted = heapq.heappop(heap)
+            groups.pop(evicted[3], None)
+
+        count += 1
+        entry = (key, count, item, group)
+        heapq.heappush(heap, entry)
+        if group is not None:
+            groups[group] = entry
+
+    # Weight still to pass before the next item that gets in.
+    jump = None
+
+    for item in items:
+        w = weight(item) if weight is not None else 1.0
+        if w <= 0:
+            continue
+        group = stratum(item) if stratum is not None else None
+
+        if len(heap) < k:
+            offer(math.log(1.0 - rng.random()) / w, item, group)
+            continue
+
+        if jump is None:
+            jump = math.log(1.0 - rng.random()) / heap[0][0]
+        jump -= w
+        if jump > 0:
+            continue
+
+        # Draw key of this item given it beats the smallest key.
+        threshold = heap[0][0]
+        low = math.exp(threshold * w)
+        key = math.log(1.0 - (1.0 - low) * rng.random()) / w
+        offer(max(key, threshold), item, group)
+        jump = None
+
+    return [entry[2] for entry in sorted(heap, reverse=True)]
+
+
+class Selector:
+    """Pick unseen paintings by weight, keeping artists apart.
+
+    Args:
+        weight (`str`, optional): name of a weight in `WEIGHTS`.
+        artist_gap (`int`, optional): number of recent picks whose
+            artists aren't picked again.
+        pages (`int`, optional): number of pages with unseen images
+            to pick from.
+        rng (optional): `random.Random` compatible source of numbers.
+
+    Raises:
+        ValueError: if `weight` is unknown.
+
+    """
+
+    def __init__(self, weight='uniform', artist_gap=ARTIST_GAP, pages=SELECT_PAGES, rng=random):
+        if weight not in WEIGHTS:
+            raise ValueError(f'Unknown weight {weight!r}.')
+
+        self.weight = weight
+        self.artist_gap = artist_gap
+        self.pages = pages
+        self.rng = rng
+
+    def sample(self, paintings, k=1):
+        """Return up to `k` of `paintings`, by different artists if `artist_gap` is set. """
+        return weighted_sample(
+            paintings,
+            k,
+            weight=WEIGHTS[self.weight],
+            stratum=artist if self.artist_gap > 0 else None,
+            rng=self.rng,
+        )
+
+    def _candidates(self, catalog, db, workers, skip_artists=()):
+        """Yield unseen paintings of the first `pages` pages that have any.
+
+        Paintings by `skip_artists` don't count.
+
+        Raises:
+            ValueError: if a page without any images is reached before
+                any candidate was found.
+
+        """
+        used = 0
+        for page, paintings in catalog.iter_paintings(1, workers):
+            paintings = [p for p in paintings if p.get('image')]
+            if not paintings:
+                if used:
+                    return
+                raise ValueError(f'No images found on page {page}.')
+
+            new_urls = set(db.filter_new(p['image'] for p in paintings))
+            candidates = [
+                p
+                for p in paintings
+                if p['image'] in new_urls and artist(p) not in skip_artists
+            ]
+            if candidates:
+                used += 1
+                yield from candidates
+                if used == self.pages:
+                    return
+            else:
+                # Every image on this page downloaded already.
+                logger.info('Trying next page %s', page + 1)
+
+    def pick(self, catalog, db, k=1, workers=1):
+        """Return urls of up to `k` unseen paintings in `catalog`.
+
+        Artists of the last `artist_gap` downloads in `db` are skipped,
+        unless no other unseen paintings are left. Records of picked
+        paintings are stored in `db`.
+
+        Args:
+            catalog: `Catalog` to take pages of paintings from.
+            db: open `DownloadDatabase`.
+            k (`int`, optional): number of paintings to pick.
+            workers (`int`, optional): number of pages to fetch at once.
+
+        Raises:
+            ValueError: if a page without any images is reached.
+
+        """
+        recent = set(db.recent_artists(self.artist_gap)) if self.artist_gap > 0 else set()
+        recent.discard(None)
+
+        picks = []
+        try:
+            picks = self.sample(self._candidates(catalog, db, workers, recent), k)
+        except ValueError:
+            if not recent:
+                raise
+
+        if not picks and recent:
+            logger.info('Only recently shown artists left. Picking from them anyway.')
+            picks = self.sample(self._candidates(catalog, db, workers), k)
+
+        db.add_paintings(picks)
+
+        return [painting['image'] for painting in picks]
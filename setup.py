@@ -19,6 +19,12 @@ REQUIRED = [
     'tqdm',
 ]
 
+# Optional packages
+EXTRAS = {
+    'phash': ['numpy', 'Pillow'],
+    'brotli': ['brotli'],
+}
+
 HERE = os.path.abspath(os.path.dirname(__file__))
 
 
@@ -72,9 +78,28 @@ setup(
     author_email=EMAIL,
     url=URL,
     license='MIT License',
-    py_modules=['wikiwall', 'db', 'utils'],
+    py_modules=[
+        'wikiwall',
+        'catalog',
+        'daemon',
+        'db',
+        'engine',
+        'eviction',
+        'fileadapter',
+        'httpcache',
+        'jsonstream',
+        'locks',
+        'phash',
+        'prefetch',
+        'proxy',
+        'selection',
+        'sources',
+        'store',
+        'utils',
+    ],
     test_suite='tests',
     install_requires=REQUIRED,
+    extras_require=EXTRAS,
     classifiers=[
         'Natural Language :: English',
         'Programming Language :: Python :: 3',
@@ -0,0 +1,269 @@
+"""
+
+sources.py
+~~~~~~~~~~
+
+Places to take painting records from.
+
+A source turns a page number into a list of painting records shaped
+like Wikiart's `Paintings` json data: at least an `image` url, and
+`title`, `artistName`, `year`, `width` and `height` where known. The
+catalog, selection and download steps only ever see such records, so
+any source works with all of them.
+
+Sources are named on the command line as `kind` or `kind:argument`:
+
+    wikiart                      Wikiart's json feed.
+    wikiart:URL                  Same feed from a mirror. URL has a {} for the page.
+    dir:PATH                     Image files in directory PATH.
+    manifest:PATH_OR_URL         JSON lines file, one record per line.
+
+"""
+import hashlib
+import json
+import logging
+import os
+import os.path
+import threading
+import urllib.parse
+import urllib.request
+
+from utils import JSON_CHUNK_SIZE, SOURCE_PAGE_SIZE, SRC_URL
+
+
+logger = logging.getLogger(__name__)
+
+# File extensions of images picked up by `DirectorySource`.
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png')
+
+
+class Source:
+    """Base class of painting record sources.
+
+    Args:
+        argument (`str`): part of the source name after the colon, or
+            None.
+        session: `requests.Session` to use for network sources.
+        cache: `HTTPCache` for network sources, or None.
+
+    """
+
+    def __init__(self, argument, session=None, cache=None):
+        self.argument = argument
+        self.session = session
+        self.cache = cache
+
+    def paintings(self, page):
+        """Return painting records of `page`, counting from 1.
+
+        An empty list marks the end of the source.
+
+        """
+        raise NotImplementedError
+
+
+class WikiartSource(Source):
+    """Wikiart's json feed, or a mirror of it at a url with {} for the page. """
+
+    def __init__(self, argument=None, session=None, cache=None):
+        super().__init__(argument or SRC_URL, session, cache)
+        if '{}' not in self.argument:
+            raise ValueError(f'Feed url {self.argument} has no {{}} for the page number.')
+
+    def paintings(self, page):
+        # Imported here since wikiwall builds on this module.
+        from wikiwall import scrape_paintings
+
+        return list(scrape_paintings(self.argument.format(page), self.session, self.cache))
+
+
+class DirectorySource(Source):
+    """Image files in a directory tree, like a local mirror.
+
+    Files are paged in path order. Files in a subdirectory get its name
+    as artist.
+
+    """
+
+    def __init__(self, argument, session=None, cache=None, page_size=SOURCE_PAGE_SIZE):
+        super().__init__(argument, session, cache)
+        if not argument or not os.path.isdir(argument):
+            raise ValueError(f'{argument} is not a directory.')
+        self.page_size = page_size
+        self._files = None
+
+        # Catalog fetches pages from several threads.
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        files = []
+        for root, _, names in os.walk(self.argument):
+            files.extend(
+                os.path.join(root, name)
+                for name in names
+                if name.lower().endswith(IMAGE_SUFFIXES)
+            )
+        return sorted(files)
+
+    def _record(self, path):
+        relpath = os.path.relpath(path, self.argument)
+        folder = os.path.dirname(relpath)
+        return {
+            'id': relpath,
+            'title': os.path.splitext(os.path.basename(path))[0],
+            'artistName': os.path.basename(folder) if folder else None,
+            'image': 'file://' + urllib.request.pathname2url(os.path.abspath(path)),
+        }
+
+    def paintings(self, page):
+        # Pages of one walk stay consistent. Page 1 looks again.
+        with self._lock:
+            if page == 1 or self._files is None:
+                self._files = self._scan()
+            files = self._files
+
+        start = (page - 1) * self.page_size
+        return [self._record(path) for path in files[start:start + self.page_size]]
+
+
+def _split_lines(chunks):
+    """Yield lines of byte `chunks`. """
+    rest = b''
+    for chunk in chunks:
+        lines = (rest + chunk).split(b'\n')
+        rest = lines.pop()
+        yield from lines
+    if rest:
+        yield rest
+
+
+class ManifestSource(Source):
+    """JSON lines file of painting records, on disk or at a url.
+
+    Relative `image` urls are resolved against the manifest's location,
+    so a directory of images with a manifest can be served from any
+    host as is.
+
+    """
+
+    def __init__(self, argument, session=None, cache=None, page_size=SOURCE_PAGE_SIZE):
+        super().__init__(argument, session, cache)
+        if not argument:
+            raise ValueError('Manifest needs a path or url.')
+
+        parts = urllib.parse.urlsplit(argument)
+        if parts.scheme in ('http', 'https'):
+            if not parts.netloc:
+                raise ValueError(f'Manifest url {argument} has no host.')
+            self.base = argument
+        else:
+            if parts.scheme == 'file':
+                path = urllib.request.url2pathname(parts.path)
+            else:
+                path = os.path.abspath(argument)
+            if not os.path.isfile(path):
+                raise ValueError(f'{argument} is not a file.')
+            self.base = 'file://' + urllib.request.pathname2url(path)
+        self.page_size = page_size
+
+        # Records of the last read, shared by pages of one walk.
+        self._cache = None
+        self._lock = threading.Lock()
+
+    def _get(self, session):
+        r = session.get(self.base, stream=True)
+        try:
+            r.raise_for_status()
+            yield from r.iter_content(JSON_CHUNK_SIZE)
+        finally:
+            r.close()
+
+    def _lines(self):
+        if not self.base.startswith('file:'):
+            # Imported here since wikiwall builds on this module.
+            from wikiwall import get_session
+
+            session = self.session or get_session()
+            if self.cache is not None:
+                chunks = self.cache.fetch(session, self.base, JSON_CHUNK_SIZE)
+            else:
+                chunks = self._get(session)
+            try:
+                yield from _split_lines(chunks)
+            finally:
+                chunks.close()
+        else:
+            path = urllib.request.url2pathname(urllib.parse.urlsplit(self.base).path)
+            with open(path, 'rb') as f:
+                yield from f
+
+    def _records(self):
+        for number, line in enumerate(self._lines(), 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.warning('Skipping invalid line %s of %s.', number, self.argument)
+                continue
+            if not isinstance(record, dict) or not record.get('image'):
+                logger.warning('Skipping line %s of %s without image.', number, self.argument)
+                continue
+
+            record['image'] = urllib.parse.urljoin(self.base, record['image'])
+            yield record
+
+    def paintings(self, page):
+        # The manifest is read once per walk. Page 1 reads it again.
+        with self._lock:
+            if page == 1 or self._cache is None:
+                self._cache = list(self._records())
+            records = self._cache
+
+        start = (page - 1) * self.page_size
+        return [dict(record) for record in records[start:start + self.page_size]]
+
+
+# Source classes by kind.
+SOURCES = {
+    'wikiart': WikiartSource,
+    'dir': DirectorySource,
+    'manifest': ManifestSource,
+}
+
+
+def parse_source(name):
+    """Split source `name` into kind and argument.
+
+    Raises:
+        ValueError: if the kind is unknown.
+
+    """
+    kind, sep, argument = name.partition(':')
+    if kind not in SOURCES:
+        raise ValueError(f'Unknown source {kind!r}. Choose from {", ".join(SOURCES)}.')
+    return kind, argument if sep else None
+
+
+def open_source(name, session=None, cache=None):
+    """Return `Source` named `name`, like 'dir:/Volumes/art'.
+
+    Raises:
+        ValueError: if `name` isn't a usable source.
+
+    """
+    kind, argument = parse_source(name)
+    return SOURCES[kind](argument, session=session, cache=cache)
+
+
+def catalog_path(data_dir, name):
+    """Return directory to keep catalog pages of source `name` in.
+
+    Pages of the default source stay where they always were. Others get
+    a directory of their own so switching sources doesn't mix pages.
+
+    """
+    path = os.path.join(data_dir, 'catalog')
+    if name == 'wikiart':
+        return path
+    return os.path.join(path, hashlib.sha256(name.encode()).hexdigest()[:16])
@@ -0,0 +1,178 @@
+"""
+
+store.py
+~~~~~~~~
+
+Content-addressed image store.
+
+Images are named by a digest of their bytes, so the same artwork under
+different urls is kept once and different artworks that happen to share
+a file name never overwrite each other.
+
+The digest is the SHA-256 of the SHA-256 digests of consecutive
+`HASH_BLOCK_SIZE` blocks of the file. Blocks hash independently, so
+bytes are hashed as they arrive, even when parallel range requests
+deliver them out of order, and a file never has to be read again.
+
+"""
+import hashlib
+import logging
+import os
+import os.path
+import urllib.parse
+
+from utils import HASH_BLOCK_SIZE, IMAGE_EXTENSIONS, url_key
+
+
+logger = logging.getLogger(__name__)
+
+
+class BlockHasher:
+    """Hash a run of bytes of a file, starting at `offset`.
+
+    Blocks that lie completely inside the run are hashed as soon as they
+    are complete. Bytes of blocks cut off by the start or end of the run
+    are kept until `content_digest` joins them with the neighbouring
+    runs.
+
+    Args:
+        offset (`int`, optional): position in the file of the first byte.
+
+    """
+
+    def __init__(self, offset=0):
+        self.digests = {}
+        self.pieces = {}
+        self._start = offset
+        self._block = bytearray()
+
+    def update(self, data):
+        """Add `data`, the bytes following those added so far. """
+        data = memoryview(data)
+        while data:
+            pos = self._start + len(self._block)
+            take = min(len(data), HASH_BLOCK_SIZE - pos % HASH_BLOCK_SIZE)
+            self._block += data[:take]
+            data = data[take:]
+
+            if (pos + take) % HASH_BLOCK_SIZE == 0:
+                self._finish_block()
+
+    def _finish_block(self):
+        if self._block:
+            if self._start % HASH_BLOCK_SIZE == 0 and len(self._block) == HASH_BLOCK_SIZE:
+                self.digests[self._start // HASH_BLOCK_SIZE] = hashlib.sha256(
+                    self._block
+                ).digest()
+            else:
+                self.pieces[self._start] = bytes(self._block)
+
+        self._start += len(self._block)
+        self._block = bytearray()
+
+    def finish(self):
+        """Stop hashing, keeping any unfinished block as a piece. """
+        self._finish_block()
+        return self
+
+
+def content_digest(hashers, size):
+    """Return hex digest of a file of `size` bytes hashed by `hashers`.
+
+    Raises:
+        ValueError: if the runs of `hashers` don't cover the whole file.
+
+    """
+    digests = {}
+    pieces = {}
+    for hasher in hashers:
+        hasher.finish()
+        digests.update(hasher.digests)
+        pieces.update(hasher.pieces)
+
+    # Blocks split between runs, plus the short last block.
+    offsets = sorted(pieces)
+    for index in range(-(-size // HASH_BLOCK_SIZE)):
+        if index in digests:
+            continue
+
+        start = index * HASH_BLOCK_SIZE
+        end = min(start + HASH_BLOCK_SIZE, size)
+        block = bytearray()
+        for offset in offsets:
+            if start <= offset < end:
+                if offset != start + len(block):
+                    raise ValueError(f'Bytes at {start + len(block)} were not hashed.')
+                block += pieces[offset]
+        if len(block) != end - start:
+            raise ValueError(f'Bytes at {start + len(block)} were not hashed.')
+
+        digests[index] = hashlib.sha256(block).digest()
+
+    return hashlib.sha256(b''.join(digests[i] for i in sorted(digests))).hexdigest()
+
+
+def extension(url):
+    """Return lowercase file extension of `url`.
+
+    Returns:
+        One of `IMAGE_EXTENSIONS`, '.jpg' if `url` has none of them.
+
+    """
+    ext = os.path.splitext(urllib.parse.urlsplit(url).path)[1].lower()
+    return ext if ext in IMAGE_EXTENSIONS else '.jpg'
+
+
+class ContentStore:
+    """Directory of files named by content digest.
+
+    Args:
+        path (`str`): directory to keep files in.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        os.makedirs(path, exist_ok=True)
+
+    def path_for(self, digest, ext='.jpg'):
+        """Return path of file with content `digest`. """
+        return os.path.join(self.path, digest + ext)
+
+    def find(self, digest, ext='.jpg'):
+        """Return path of file with content `digest` or None if it's not stored. """
+        path = self.path_for(digest, ext)
+        return path if os.path.isfile(path) else None
+
+    def part_for(self, url):
+        """Return path to download `url` to before its digest is known.
+
+        The name only depends on `url`, so an interrupted download is
+        found again and resumed.
+
+        """
+        name = hashlib.sha256(url_key(url).encode()).hexdigest()[:16]
+        return os.path.join(self.path, name + '.part')
+
+    def lock_for(self, url):
+        """Return path of lock file held while `url` is downloaded. """
+        return self.part_for(url)[:-len('.part')] + '.lock'
+
+    def put(self, part, digest, ext='.jpg'):
+        """Move downloaded file `part` into place under `digest`.
+
+        Note:
+            If the content is stored already, `part` is deleted instead.
+
+        Returns:
+            Path of stored file.
+
+        """
+        path = self.path_for(digest, ext)
+        if os.path.isfile(path):
+            logger.info('Content of %s stored already as %s.', part, path)
+            os.remove(part)
+        else:
+            os.replace(part, path)
+        return path
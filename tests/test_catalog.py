@@ -0,0 +1,150 @@
+import json
+import threading
+import os.path
+import tempfile
+import unittest
+import unittest.mock as mock
+from catalog import Catalog
+
+
+class CatalogTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+
+        self.paintings = [
+            {'id': '1', 'image': 'http://mock/image1.jpg'},
+            {'id': '2', 'image': 'http://mock/image2.jpg'},
+            {'id': '3'},
+        ]
+        self.mock_fetch = mock.Mock(return_value=self.paintings)
+
+        self.catalog = Catalog(fetch=self.mock_fetch, path=self.tempdir.name, ttl=60)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_missing_directory_is_created(self):
+        path = os.path.join(self.tempdir.name, 'sub')
+        Catalog(fetch=self.mock_fetch, path=path)
+        self.assertTrue(os.path.isdir(path))
+
+    def test_page_fetched_on_first_use(self):
+        self.assertEqual(self.catalog.paintings(1), self.paintings)
+        self.mock_fetch.assert_called_once_with(1)
+
+    def test_fresh_page_is_not_fetched_again(self):
+        self.catalog.paintings(1)
+        self.catalog.paintings(1)
+        self.mock_fetch.assert_called_once_with(1)
+
+    def test_stale_page_is_fetched_again(self):
+        self.catalog.paintings(1)
+        with mock.patch('catalog.time.time', return_value=10 ** 10):
+            self.catalog.paintings(1)
+        self.assertEqual(self.mock_fetch.call_count, 2)
+
+    def test_pages_are_stored_separately(self):
+        self.catalog.paintings(1)
+        self.catalog.paintings(2)
+        self.assertEqual(self.mock_fetch.call_count, 2)
+
+    def test_urls_skips_records_without_image(self):
+        self.assertEqual(
+            self.catalog.urls(1), ['http://mock/image1.jpg', 'http://mock/image2.jpg']
+        )
+
+    def test_corrupt_page_is_fetched_again(self):
+        with open(os.path.join(self.tempdir.name, 'page-1.json'), 'w') as f:
+            f.write('{not json')
+
+        self.assertEqual(self.catalog.paintings(1), self.paintings)
+        self.mock_fetch.assert_called_once_with(1)
+
+    def test_stored_page_has_fetch_time(self):
+        self.catalog.paintings(1)
+        with open(os.path.join(self.tempdir.name, 'page-1.json')) as f:
+            record = json.load(f)
+        self.assertIn('fetched', record)
+
+    def test_page_kept_in_memory_after_first_read(self):
+        self.catalog.paintings(1)
+        with mock.patch.object(self.catalog, '_load') as mock_load:
+            self.catalog.paintings(1)
+        mock_load.assert_not_called()
+
+    def test_invalidate_forces_fetch(self):
+        self.catalog.paintings(1)
+        self.catalog.invalidate(1)
+        self.catalog.paintings(1)
+        self.assertEqual(self.mock_fetch.call_count, 2)
+
+    def test_invalidate_missing_page(self):
+        self.catalog.invalidate(5)
+
+
+class CatalogIterUrlsTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def fetch(self, page):
+        return [{'image': f'http://mock/{page}-{n}.jpg'} for n in range(2)]
+
+    def test_pages_yielded_in_order(self):
+        catalog = Catalog(fetch=self.fetch, path=self.tempdir.name)
+        pages = catalog.iter_urls(start=3, workers=4)
+
+        self.assertEqual([next(pages)[0] for _ in range(6)], [3, 4, 5, 6, 7, 8])
+        self.assertEqual(next(pages)[1], ['http://mock/9-0.jpg', 'http://mock/9-1.jpg'])
+        pages.close()
+
+    def test_paintings_yielded_in_order(self):
+        catalog = Catalog(fetch=self.fetch, path=self.tempdir.name)
+        pages = catalog.iter_paintings(start=2, workers=2)
+
+        self.assertEqual(next(pages), (2, self.fetch(2)))
+        self.assertEqual(next(pages), (3, self.fetch(3)))
+        pages.close()
+
+    def test_zero_workers_fetch_one_page_at_a_time(self):
+        catalog = Catalog(fetch=self.fetch, path=self.tempdir.name)
+        pages = catalog.iter_paintings(workers=0)
+
+        self.assertEqual([next(pages)[0] for _ in range(3)], [1, 2, 3])
+        pages.close()
+
+    def test_only_first_page_fetched_before_first_yield(self):
+        mock_fetch = mock.Mock(side_effect=self.fetch)
+        catalog = Catalog(fetch=mock_fetch, path=self.tempdir.name)
+
+        pages = catalog.iter_urls(workers=4)
+        next(pages)
+        pages.close()
+
+        mock_fetch.assert_called_once_with(1)
+
+    def test_following_pages_fetched_concurrently(self):
+        workers = 3
+        # Pages 2 to 4 each wait for the other two to start.
+        barrier = threading.Barrier(workers, timeout=5)
+
+        def fetch(page):
+            if 1 < page <= workers + 1:
+                barrier.wait()
+            return self.fetch(page)
+
+        catalog = Catalog(fetch=fetch, path=self.tempdir.name)
+        pages = catalog.iter_urls(workers=workers)
+
+        self.assertEqual([next(pages)[0] for _ in range(workers + 1)], [1, 2, 3, 4])
+        pages.close()
+
+    def test_fetch_errors_raised_to_consumer(self):
+        catalog = Catalog(
+            fetch=mock.Mock(side_effect=ConnectionError), path=self.tempdir.name
+        )
+
+        with self.assertRaises(ConnectionError):
+            next(catalog.iter_urls(workers=2))
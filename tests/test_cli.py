@@ -1,4 +1,8 @@
 from click.testing import CliRunner
+import os.path
+import subprocess
+import tempfile
+import threading
 import unittest
 import unittest.mock as mock
 import wikiwall
@@ -22,8 +26,8 @@ class CliTest(unittest.TestCase):
         self.patcher_run_appscript = mock.patch('wikiwall._run_appscript')
         self.mock_run_appscript = self.patcher_run_appscript.start()
 
-        self.patcher_download_img = mock.patch('wikiwall.download_img')
-        self.mock_download_img = self.patcher_download_img.start()
+        self.patcher_store_img = mock.patch('wikiwall.store_img')
+        self.mock_store_img = self.patcher_store_img.start()
 
         self.patcher_get_random = mock.patch('wikiwall.get_random')
         self.mock_get_random = self.patcher_get_random.start()
@@ -31,6 +35,16 @@ class CliTest(unittest.TestCase):
         self.patcher_scrape_urls = mock.patch('wikiwall.scrape_urls')
         self.mock_scrape_urls = self.patcher_scrape_urls.start()
 
+        self.patcher_catalog = mock.patch('catalog.Catalog')
+        self.mock_catalog = self.patcher_catalog.start()
+        self.mock_catalog.return_value.loaded_pages.return_value = []
+
+        self.patcher_http_cache = mock.patch('httpcache.HTTPCache')
+        self.mock_http_cache = self.patcher_http_cache.start()
+
+        self.patcher_index = mock.patch('wikiwall._near_duplicate_index', return_value=None)
+        self.mock_index = self.patcher_index.start()
+
         self.patcher_datadir = mock.patch('wikiwall.data_dir', return_value='/tmp')
         self.mock_datadir = self.patcher_datadir.start()
 
@@ -39,13 +53,20 @@ class CliTest(unittest.TestCase):
 
         self.patcher_sys = mock.patch('wikiwall.sys')
         self.mock_sys = self.patcher_sys.start()
+        self.mock_sys.argv = ['wikiwall', '--prefetch', '2']
+
+        self.patcher_popen = mock.patch('subprocess.Popen')
+        self.mock_popen = self.patcher_popen.start()
 
         self.patcher_db = mock.patch(
-            'wikiwall.DownloadDatabase',
+            'db.DownloadDatabase',
             return_value=mock.Mock(
                 __enter__=mock.Mock(
                     return_value=mock.Mock(
-                        is_duplicate=mock.Mock(return_value=False), add=mock.Mock()
+                        filter_new=mock.Mock(return_value=['http://mock/new.jpg']),
+                        add=mock.Mock(),
+                        mark_shown=mock.Mock(),
+                        pick_lock=mock.MagicMock(),
                     )
                 ),
                 __exit__=mock.Mock(return_value=None),
@@ -58,13 +79,17 @@ class CliTest(unittest.TestCase):
         self.patcher_config_logger.stop()
         self.patcher_clean_dls.stop()
         self.patcher_run_appscript.stop()
-        self.patcher_download_img.stop()
+        self.patcher_store_img.stop()
         self.patcher_get_random.stop()
         self.patcher_scrape_urls.stop()
+        self.patcher_catalog.stop()
+        self.patcher_http_cache.stop()
+        self.patcher_index.stop()
         self.patcher_datadir.stop()
         self.patcher_time.stop()
         self.patcher_db.stop()
         self.patcher_sys.stop()
+        self.patcher_popen.stop()
 
     def test_debug_on_message(self):
         result = self.runner.invoke(cli, ['--debug'])
@@ -88,12 +113,219 @@ class CliTest(unittest.TestCase):
 
         self.mock_info.assert_any_call('Download limit set to %s.', limit)
 
+    def test_zero_workers_rejected(self):
+        for option in ('--workers', '--segments'):
+            with self.subTest(option=option):
+                result = self.runner.invoke(cli, [option, '0'])
+
+                self.assertEqual(result.exit_code, 2)
+                self.mock_catalog.assert_not_called()
+
+    def test_ttl_passed_to_catalog(self):
+        self.runner.invoke(cli, ['--ttl', '30'])
+
+        self.assertEqual(self.mock_catalog.call_args[1]['ttl'], 30)
+
+    def test_no_prefetch_by_default(self):
+        with mock.patch('prefetch.PrefetchQueue') as mock_queue:
+            self.runner.invoke(cli, [])
+
+        mock_queue.assert_not_called()
+
+    def test_prefetched_image_shown_without_download(self):
+        db = self.mock_db.return_value.__enter__.return_value
+
+        with mock.patch('prefetch.PrefetchQueue') as mock_queue:
+            mock_queue.return_value.pop.return_value = ('http://mock/q.jpg', '/tmp/q.jpg')
+            self.runner.invoke(cli, ['--prefetch', '2'])
+
+        self.mock_store_img.assert_not_called()
+        db.mark_shown.assert_called_once_with('http://mock/q.jpg', '/tmp/q.jpg')
+
+    def test_refill_left_to_detached_run(self):
+        with mock.patch('prefetch.PrefetchQueue') as mock_queue:
+            mock_queue.return_value.pop.return_value = ('http://mock/q.jpg', '/tmp/q.jpg')
+            self.runner.invoke(cli, ['--prefetch', '2'])
+
+        mock_queue.return_value.pop.assert_called_once()
+        mock_queue.return_value.refill.assert_not_called()
+
+        args, kwargs = self.mock_popen.call_args
+        self.assertEqual(args[0][1], '-c')
+        self.assertIn('from wikiwall import cli', args[0][2])
+        self.assertEqual(args[0][3:], ['--prefetch', '2', 'refill'])
+        self.assertTrue(kwargs['start_new_session'])
+        self.mock_popen.return_value.wait.assert_not_called()
+        self.mock_popen.return_value.communicate.assert_not_called()
+
+    def test_pop_returns_before_refill_finishes(self):
+        refilling = threading.Event()
+        refilled = threading.Event()
+
+        def refill(*args):
+            refilling.set()
+            refilled.wait(5)
+
+        # A stand in for the detached run, refilling until told to stop.
+        def popen(*args, **kwargs):
+            threading.Thread(
+                target=wikiwall._refill_queue, args=(mock.Mock(), mock.Mock(), '/tmp/queue', 2)
+            ).start()
+            refilling.wait(5)
+
+        self.mock_popen.side_effect = popen
+        self.addCleanup(refilled.set)
+        with mock.patch('prefetch.PrefetchQueue') as mock_queue:
+            mock_queue.return_value.pop.return_value = ('http://mock/q.jpg', '/tmp/q.jpg')
+            mock_queue.return_value.refill.side_effect = refill
+            result = self.runner.invoke(cli, ['--prefetch', '2'])
+
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertFalse(refilled.is_set())
+            refilled.set()
+
+    def test_refill_command_fills_queue(self):
+        with mock.patch('prefetch.PrefetchQueue') as mock_queue:
+            self.runner.invoke(cli, ['--prefetch', '2', 'refill'])
+
+        mock_queue.return_value.refill.assert_called_once()
+        self.mock_popen.assert_not_called()
+
+    def test_empty_queue_falls_back_to_download(self):
+        with mock.patch('prefetch.PrefetchQueue') as mock_queue:
+            mock_queue.return_value.pop.return_value = None
+            self.runner.invoke(cli, ['--prefetch', '2'])
+
+        self.mock_store_img.assert_called_once()
+
+    def test_refill_failure_does_not_fail_run(self):
+        with mock.patch('prefetch.PrefetchQueue') as mock_queue:
+            mock_queue.return_value.pop.return_value = ('http://mock/q.jpg', '/tmp/q.jpg')
+            mock_queue.return_value.refill.side_effect = ValueError
+            result = self.runner.invoke(cli, ['--prefetch', '2', 'refill'])
+
+        self.assertEqual(result.exit_code, 0)
+
+    def test_clean_up_after_wallpaper_set(self):
+        calls = []
+        self.mock_run_appscript.side_effect = lambda script: calls.append('set')
+        self.mock_clean_dls.side_effect = lambda *args, **kwargs: calls.append('clean')
+
+        self.runner.invoke(cli, [])
+
+        self.assertEqual(calls, ['set', 'clean'])
+
+    def test_new_image_released_if_wallpaper_not_set(self):
+        db = self.mock_db.return_value.__enter__.return_value
+        self.mock_get_random.return_value = ['http://mock/new.jpg']
+        self.mock_run_appscript.side_effect = ValueError
+
+        result = self.runner.invoke(cli, [])
+
+        self.assertIn('Something went wrong. Check the logs.', result.output)
+        db.add.assert_not_called()
+        db.release.assert_called_once_with(['http://mock/new.jpg'])
+
+    def test_new_image_released_if_catalog_not_recorded(self):
+        db = self.mock_db.return_value.__enter__.return_value
+        self.mock_get_random.return_value = ['http://mock/new.jpg']
+
+        with mock.patch('wikiwall._record_catalog', side_effect=ValueError):
+            self.runner.invoke(cli, [])
+
+        self.mock_run_appscript.assert_not_called()
+        db.release.assert_called_once_with(['http://mock/new.jpg'])
+
+    def test_size_and_age_limits_passed_on(self):
+        self.runner.invoke(cli, ['--limit', '-1', '--max-size', '2', '--max-age', '1'])
+
+        args, kwargs = self.mock_clean_dls.call_args
+        self.assertIsNone(args[1])
+        self.assertEqual(kwargs['max_bytes'], 2 * 1024 * 1024)
+        self.assertEqual(kwargs['max_age'], 24 * 60 * 60)
+
+    def test_near_distance_passed_to_index(self):
+        self.runner.invoke(cli, ['--near-distance', '3'])
+
+        self.assertEqual(self.mock_index.call_args[0][1], 3)
+
+    def test_unknown_source_rejected(self):
+        result = self.runner.invoke(cli, ['--source', 'ftp:/art'])
+
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn('Unknown source', result.output)
+
+    def test_missing_source_directory_rejected(self):
+        result = self.runner.invoke(cli, ['--source', 'dir:/no/such/dir'])
+
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn('not a directory', result.output)
+        self.mock_catalog.assert_not_called()
+
+    def test_source_opened_with_own_catalog(self):
+        with mock.patch('sources.open_source') as mock_open:
+            self.runner.invoke(cli, ['--source', 'dir:/art'])
+
+        self.assertEqual(mock_open.call_args[0][0], 'dir:/art')
+        self.assertEqual(
+            self.mock_catalog.call_args[1]['fetch'], mock_open.return_value.paintings
+        )
+        self.assertNotEqual(self.mock_catalog.call_args[1]['path'], '/tmp/catalog')
+
+    def test_cache_proxy_from_environment(self):
+        with mock.patch('wikiwall.make_session') as mock_session:
+            self.runner.invoke(cli, [], env={'WIKIWALL_CACHE_PROXY': 'http://cache:8765'})
+
+        self.assertEqual(mock_session.call_args[1]['cache_proxy'], 'http://cache:8765')
+
+    def test_uniform_picks_by_default(self):
+        with mock.patch('selection.Selector') as mock_selector:
+            self.runner.invoke(cli, [])
+
+        mock_selector.assert_not_called()
+        self.mock_get_random.assert_called_once()
+
+    def test_selection_options_passed_to_selector(self):
+        self.mock_store_img.return_value = '/tmp/a.jpg'
+        with mock.patch('selection.Selector') as mock_selector:
+            mock_selector.return_value.pick.return_value = ['http://mock/a.jpg']
+            self.runner.invoke(cli, ['--weight', 'old', '--artist-gap', '5', '--pages', '3'])
+
+        mock_selector.assert_called_once_with('old', 5, 3)
+        mock_selector.return_value.pick.assert_called_once()
+        self.mock_get_random.assert_not_called()
+
     def test_message_on_random_exception_in_cli_body(self):
         with mock.patch('wikiwall.get_random', side_effect=ValueError):
             result = self.runner.invoke(cli, ['--limit', '2'])
         self.assertIn('Something went wrong. Check the logs.', result.output)
 
 
+class RefillChildTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+    def test_failures_logged_to_wikiwall_log(self):
+        source = os.path.join(self.tempdir.name, 'empty')
+        os.makedirs(source)
+        argv = ['wikiwall', '--source', f'dir:{source}', '--dest', self.tempdir.name]
+        argv += ['--prefetch', '1']
+
+        with mock.patch('wikiwall.sys.argv', argv), mock.patch('subprocess.Popen') as mock_popen:
+            wikiwall._refill_in_background()
+
+        # Run the child for real, away from the source tree.
+        env = dict(os.environ, XDG_DATA_HOME=self.tempdir.name)
+        subprocess.run(
+            mock_popen.call_args[0][0], cwd=self.tempdir.name, env=env, timeout=60, check=True
+        )
+
+        with open(os.path.join(self.tempdir.name, 'wikiwall', 'wikiwall.log')) as f:
+            self.assertIn('Prefetching failed.', f.read())
+        self.assertFalse(os.path.exists(os.path.join(self.tempdir.name, '__main__.log')))
+
+
 class ShowSubcommandTest(unittest.TestCase):
     def setUp(self):
         self.runner = CliRunner()
@@ -114,3 +346,160 @@ class ShowSubcommandTest(unittest.TestCase):
 
         self.runner.invoke(cli, ['show'])
         self.mock_runapp.assert_called()
+
+
+class ImportSubcommandTest(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+        self.added = []
+        self.mock_db = mock.Mock(
+            add_many=mock.Mock(side_effect=lambda urls: self.added.extend(urls) or 2)
+        )
+        self.patcher_db = mock.patch(
+            'db.DownloadDatabase',
+            return_value=mock.Mock(
+                __enter__=mock.Mock(return_value=self.mock_db),
+                __exit__=mock.Mock(return_value=None),
+            ),
+        )
+        self.patcher_db.start()
+
+    def tearDown(self):
+        self.patcher_db.stop()
+
+    def test_urls_in_file_added_to_history(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            history = os.path.join(tempdir, 'history.txt')
+            with open(history, 'w') as f:
+                f.write('http://mock/1.jpg\n\nhttp://mock/2.jpg\n')
+
+            result = self.runner.invoke(cli, ['import', history])
+
+        self.assertEqual(self.added, ['http://mock/1.jpg', 'http://mock/2.jpg'])
+        self.assertIn('2 urls added', result.output)
+
+
+class StatsSubcommandTest(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+        self.mock_db = mock.Mock(
+            count_by_state=mock.Mock(return_value={'shown': 12}),
+            count_paintings=mock.Mock(return_value=(300, 40)),
+            top_artists=mock.Mock(return_value=[('Claude Monet', 3), ('Degas', 2)]),
+        )
+        self.patcher_db = mock.patch(
+            'db.DownloadDatabase',
+            return_value=mock.Mock(
+                __enter__=mock.Mock(return_value=self.mock_db),
+                __exit__=mock.Mock(return_value=None),
+            ),
+        )
+        self.patcher_db.start()
+
+    def tearDown(self):
+        self.patcher_db.stop()
+
+    def test_stats_printed(self):
+        result = self.runner.invoke(cli, ['stats', '--top', '2'])
+
+        self.mock_db.top_artists.assert_called_once_with(2)
+        self.assertIn('Images shown: 12', result.output)
+        self.assertIn('Images prefetched: 0', result.output)
+        self.assertIn('Near duplicates skipped: 0', result.output)
+        self.assertIn('Paintings stored: 300 by 40 artists', result.output)
+        self.assertIn('  Claude Monet  3\n  Degas         2', result.output)
+
+
+class DaemonSubcommandsTest(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+        self.patcher_send = mock.patch('daemon.send_command', return_value='ok /tmp/a.jpg')
+        self.mock_send = self.patcher_send.start()
+
+    def tearDown(self):
+        self.patcher_send.stop()
+
+    def test_next_sends_command_and_prints_reply(self):
+        result = self.runner.invoke(cli, ['next'])
+
+        self.assertEqual(self.mock_send.call_args[0][1], 'next')
+        self.assertIn('/tmp/a.jpg', result.output)
+        self.assertEqual(result.exit_code, 0)
+
+    def test_stop_sends_command(self):
+        self.runner.invoke(cli, ['stop'])
+
+        self.assertEqual(self.mock_send.call_args[0][1], 'stop')
+
+    def test_next_without_daemon(self):
+        self.mock_send.side_effect = ConnectionRefusedError
+
+        result = self.runner.invoke(cli, ['next'])
+
+        self.assertIn('No daemon running', result.output)
+        self.assertEqual(result.exit_code, 1)
+
+    def test_error_reply_exits_with_error(self):
+        self.mock_send.return_value = 'error gah'
+
+        result = self.runner.invoke(cli, ['next'])
+
+        self.assertEqual(result.exit_code, 1)
+
+    def test_daemon_serves_with_schedule(self):
+        with mock.patch('daemon.Daemon') as mock_daemon, mock.patch(
+            'db.DownloadDatabase'
+        ):
+            self.runner.invoke(cli, ['daemon', '--interval', '60', '--at', '22:00'])
+
+        schedule = mock_daemon.call_args[1]['schedule']
+        self.assertEqual(schedule.interval, 60)
+        mock_daemon.return_value.serve_forever.assert_called_once()
+
+    def test_daemon_rejects_bad_time(self):
+        result = self.runner.invoke(cli, ['daemon', '--at', 'gah'])
+
+        self.assertEqual(result.exit_code, 2)
+
+
+class FavoriteSubcommandTest(unittest.TestCase):
+    def setUp(self):
+        self.runner = CliRunner()
+
+        self.mock_db = mock.Mock(
+            last_shown_file=mock.Mock(return_value='/tmp/a.jpg'),
+            set_favorite=mock.Mock(return_value=True),
+        )
+        self.patcher_db = mock.patch(
+            'db.DownloadDatabase',
+            return_value=mock.Mock(
+                __enter__=mock.Mock(return_value=self.mock_db),
+                __exit__=mock.Mock(return_value=None),
+            ),
+        )
+        self.patcher_db.start()
+
+    def tearDown(self):
+        self.patcher_db.stop()
+
+    def test_current_wallpaper_marked_by_default(self):
+        result = self.runner.invoke(cli, ['favorite'])
+
+        self.mock_db.set_favorite.assert_called_once_with('/tmp/a.jpg', True)
+        self.assertIn('/tmp/a.jpg marked as favorite.', result.output)
+
+    def test_unmark(self):
+        self.runner.invoke(cli, ['favorite', '--remove', '/tmp/b.jpg'])
+
+        self.mock_db.set_favorite.assert_called_once_with('/tmp/b.jpg', False)
+
+    def test_unknown_path(self):
+        self.mock_db.set_favorite.return_value = False
+
+        result = self.runner.invoke(cli, ['favorite', '/tmp/gah.jpg'])
+
+        self.assertIn('No such download.', result.output)
+        self.assertEqual(result.exit_code, 1)
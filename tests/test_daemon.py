@@ -0,0 +1,137 @@
+import datetime
+import os.path
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock as mock
+from daemon import Daemon, Schedule, send_command
+
+
+class ScheduleTest(unittest.TestCase):
+    def timestamp(self, *args):
+        return datetime.datetime(*args).timestamp()
+
+    def test_needs_interval_or_times(self):
+        with self.assertRaises(ValueError):
+            Schedule()
+
+    def test_invalid_time(self):
+        with self.assertRaises(ValueError):
+            Schedule(times=['25:00'])
+
+    def test_interval(self):
+        self.assertEqual(Schedule(interval=60).next_run(1000), 1060)
+
+    def test_time_later_today(self):
+        now = self.timestamp(2019, 5, 1, 21, 0)
+        self.assertEqual(
+            Schedule(times=['22:00']).next_run(now), self.timestamp(2019, 5, 1, 22, 0)
+        )
+
+    def test_time_passed_today_runs_tomorrow(self):
+        now = self.timestamp(2019, 5, 1, 22, 0)
+        self.assertEqual(
+            Schedule(times=['22:00']).next_run(now), self.timestamp(2019, 5, 2, 22, 0)
+        )
+
+    def test_earliest_of_interval_and_times(self):
+        now = self.timestamp(2019, 5, 1, 21, 0)
+        schedule = Schedule(interval=7200, times=['08:00', '21:30'])
+        self.assertEqual(schedule.next_run(now), self.timestamp(2019, 5, 1, 21, 30))
+
+
+class DaemonTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.socket_path = os.path.join(self.tempdir.name, 'test.sock')
+
+        self.mock_change = mock.Mock(return_value='/tmp/new.jpg')
+        self.mock_after_change = mock.Mock()
+
+    def wait_for_daemon(self):
+        for _ in range(100):
+            try:
+                send_command(self.socket_path, 'ping', timeout=1)
+                return
+            except OSError:
+                time.sleep(0.01)
+
+    def start(self, interval=3600):
+        daemon = Daemon(
+            self.mock_change,
+            Schedule(interval=interval),
+            self.socket_path,
+            after_change=self.mock_after_change,
+        )
+        thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+        thread.start()
+
+        self.wait_for_daemon()
+
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(send_command, self.socket_path, 'stop', 5)
+        return daemon
+
+    def test_next_changes_wallpaper(self):
+        self.start()
+
+        reply = send_command(self.socket_path, 'next', timeout=5)
+
+        self.assertEqual(reply, 'ok /tmp/new.jpg')
+        self.mock_change.assert_called_once()
+
+    def test_after_change_runs_after_next(self):
+        self.start()
+        send_command(self.socket_path, 'next', timeout=5)
+        send_command(self.socket_path, 'ping', timeout=5)
+
+        self.mock_after_change.assert_called_once()
+
+    def test_failed_change_is_reported(self):
+        self.mock_change.side_effect = ValueError('gah')
+        self.start()
+
+        self.assertEqual(send_command(self.socket_path, 'next', timeout=5), 'error gah')
+
+    def test_unknown_command(self):
+        self.start()
+
+        self.assertTrue(send_command(self.socket_path, 'gah', timeout=5).startswith('error'))
+
+    def test_scheduled_change(self):
+        self.start(interval=0.05)
+        time.sleep(0.3)
+        send_command(self.socket_path, 'ping', timeout=5)
+
+        self.assertGreaterEqual(self.mock_change.call_count, 2)
+
+    def test_stop_removes_socket(self):
+        daemon = Daemon(self.mock_change, Schedule(interval=3600), self.socket_path)
+        thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+        thread.start()
+        self.wait_for_daemon()
+
+        self.assertEqual(send_command(self.socket_path, 'stop', timeout=5), 'ok stopping')
+        thread.join(5)
+
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    def test_second_daemon_refused(self):
+        self.start()
+
+        with self.assertRaises(RuntimeError):
+            Daemon(self.mock_change, Schedule(interval=3600), self.socket_path)._listen()
+
+    def test_stale_socket_replaced(self):
+        with open(self.socket_path, 'w'):
+            pass
+
+        self.start()
+
+        self.assertEqual(send_command(self.socket_path, 'ping', timeout=5), 'ok pong')
+
+    def test_send_command_without_daemon(self):
+        with self.assertRaises(OSError):
+            send_command(self.socket_path, 'next', timeout=1)
@@ -0,0 +1,558 @@
+import multiprocessing
+import os.path
+import sqlite3
+import tempfile
+import time
+import unittest
+import unittest.mock as mock
+from db import STATE_PREFETCHED, STATE_SHOWN, STATE_SKIPPED, DownloadDatabase
+from utils import LOCK_TIMEOUT
+
+
+def _add_urls(db_filename, writer, count):
+    with DownloadDatabase(db_filename) as db:
+        for n in range(count):
+            db.add(f'http://mock/{writer}/{n}.jpg')
+
+
+class DownloadDatabaseTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.db = DownloadDatabase(os.path.join(self.tempdir.name, 'test.db'))
+        self.db.__enter__()
+
+    def tearDown(self):
+        self.db.__exit__(None, None, None)
+        self.tempdir.cleanup()
+
+    def test_added_url_is_duplicate(self):
+        self.db.add('http://mock/1.jpg')
+        self.assertTrue(self.db.is_duplicate('http://mock/1.jpg'))
+        self.assertFalse(self.db.is_duplicate('http://mock/2.jpg'))
+
+    def test_filter_new_removes_seen_urls_and_keeps_order(self):
+        self.db.add('http://mock/2.jpg')
+        urls = ['http://mock/3.jpg', 'http://mock/2.jpg', 'http://mock/1.jpg']
+
+        self.assertEqual(
+            self.db.filter_new(urls), ['http://mock/3.jpg', 'http://mock/1.jpg']
+        )
+
+    def test_filter_new_with_more_urls_than_query_limit(self):
+        urls = [f'http://mock/{n}.jpg' for n in range(1200)]
+        for url in urls[::2]:
+            self.db.add(url)
+
+        self.assertEqual(self.db.filter_new(iter(urls)), urls[1::2])
+
+    def test_filter_new_with_no_urls(self):
+        self.assertEqual(self.db.filter_new([]), [])
+
+
+class DownloadDatabaseBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.db_filename = os.path.join(self.tempdir.name, 'test.db')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_add_many_skips_existing_urls(self):
+        with DownloadDatabase(self.db_filename) as db:
+            db.add('http://mock/1.jpg')
+            added = db.add_many(f'http://mock/{n}.jpg' for n in range(3))
+
+            urls = [f'http://mock/{n}.jpg' for n in range(4)]
+
+            self.assertEqual(added, 2)
+            self.assertEqual(db.filter_new(urls), ['http://mock/3.jpg'])
+
+    def test_add_many_uses_one_transaction(self):
+        with DownloadDatabase(self.db_filename) as db:
+            with mock.patch.object(db, 'conn', wraps=db.conn) as mock_conn:
+                db.add_many(['http://mock/1.jpg', 'http://mock/2.jpg'])
+            mock_conn.__enter__.assert_called_once()
+            mock_conn.executemany.assert_called_once()
+
+    def test_filter_new_large_batch_uses_single_query(self):
+        urls = [f'http://mock/{n}.jpg' for n in range(2000)]
+
+        with DownloadDatabase(self.db_filename) as db:
+            db.add_many(urls[:1500])
+            self.assertEqual(db.filter_new(reversed(urls)), urls[:1499:-1])
+            # Temp table is cleared between calls.
+            self.assertEqual(db.filter_new(urls), urls[1500:])
+
+
+class DownloadDatabaseTuningTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.db_filename = os.path.join(self.tempdir.name, 'test.db')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_pragmas_applied_on_connect(self):
+        with DownloadDatabase(self.db_filename) as db:
+            self.assertEqual(db.conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            # NORMAL
+            self.assertEqual(db.conn.execute('PRAGMA synchronous').fetchone()[0], 1)
+
+    def test_custom_pragmas(self):
+        with DownloadDatabase(self.db_filename, pragmas={}) as db:
+            self.assertEqual(
+                db.conn.execute('PRAGMA journal_mode').fetchone()[0], 'delete'
+            )
+
+    def test_statements_formatted_with_table_name(self):
+        db = DownloadDatabase(self.db_filename, tablename='history')
+        self.assertIn('INSERT OR IGNORE INTO history', db.sql['add'])
+
+    def test_concurrent_writer_processes(self):
+        writers, count = 4, 50
+        with DownloadDatabase(self.db_filename):
+            pass
+
+        procs = [
+            multiprocessing.Process(target=_add_urls, args=(self.db_filename, w, count))
+            for w in range(writers)
+        ]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+            self.assertEqual(p.exitcode, 0)
+
+        with DownloadDatabase(self.db_filename) as db:
+            self.assertEqual(
+                db.conn.execute(db.sql['count']).fetchone()[0], writers * count
+            )
+
+
+class DownloadDatabaseStateTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.db_filename = os.path.join(self.tempdir.name, 'test.db')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_old_table_gets_state_and_path_columns(self):
+        conn = sqlite3.connect(self.db_filename)
+        conn.execute('CREATE TABLE downloads (id integer PRIMARY KEY, url text NOT NULL UNIQUE)')
+        conn.execute("INSERT INTO downloads (url) VALUES ('http://mock/old.jpg')")
+        conn.commit()
+        conn.close()
+
+        with DownloadDatabase(self.db_filename) as db:
+            row = db.conn.execute('SELECT url, state, path, picked FROM downloads').fetchone()
+
+        self.assertEqual(row, ('http://mock/old.jpg', STATE_SHOWN, None, None))
+
+    def test_prefetched_images_returned_oldest_first(self):
+        with DownloadDatabase(self.db_filename) as db:
+            db.add('http://mock/1.jpg')
+            db.add('http://mock/2.jpg', state=STATE_PREFETCHED, path='/q/2.jpg')
+            db.add('http://mock/3.jpg', state=STATE_PREFETCHED, path='/q/3.jpg')
+
+            self.assertEqual(db.count_prefetched(), 2)
+            self.assertEqual(db.next_prefetched(), ('http://mock/2.jpg', '/q/2.jpg'))
+
+    def test_mark_shown(self):
+        with DownloadDatabase(self.db_filename) as db:
+            db.add('http://mock/1.jpg', state=STATE_PREFETCHED, path='/q/1.jpg')
+            db.mark_shown('http://mock/1.jpg', '/d/1.jpg')
+
+            self.assertIsNone(db.next_prefetched())
+            self.assertEqual(db.count_prefetched(), 0)
+
+    def test_prefetched_images_are_not_new(self):
+        with DownloadDatabase(self.db_filename) as db:
+            db.add('http://mock/1.jpg', state=STATE_PREFETCHED, path='/q/1.jpg')
+
+            self.assertEqual(db.filter_new(['http://mock/1.jpg']), [])
+
+    def test_removed_url_is_new_again(self):
+        with DownloadDatabase(self.db_filename) as db:
+            db.add('http://mock/1.jpg')
+            db.remove('http://mock/1.jpg')
+
+            self.assertEqual(db.filter_new(['http://mock/1.jpg']), ['http://mock/1.jpg'])
+
+
+class DownloadDatabaseManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.db_filename = os.path.join(self.tempdir.name, 'test.db')
+
+        self.dest = os.path.join(self.tempdir.name, 'dest')
+        os.mkdir(self.dest)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def create_file(self, name, mtime=None):
+        path = os.path.join(self.dest, name)
+        with open(path, 'w') as f:
+            f.write('faux jpeg file')
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_added_files_returned_oldest_first(self):
+        with DownloadDatabase(self.db_filename) as db:
+            db.add_file(self.create_file('b.jpg'), downloaded=2)
+            db.add_file(self.create_file('a.jpg'), downloaded=1)
+            db.add_file(self.create_file('c.jpg'), downloaded=3)
+
+            self.assertEqual(db.count_files(self.dest), 3)
+            self.assertEqual(
+                db.oldest_files(self.dest, 2),
+                [os.path.join(self.dest, 'a.jpg'), os.path.join(self.dest, 'b.jpg')],
+            )
+
+    def test_add_file_reads_size(self):
+        with DownloadDatabase(self.db_filename) as db:
+            db.add_file(self.create_file('a.jpg'))
+            size = db.conn.execute('SELECT size FROM downloads_files').fetchone()[0]
+
+        self.assertEqual(size, len('faux jpeg file'))
+
+    def test_sync_adds_untracked_files_by_mtime(self):
+        new = self.create_file('new.jpg', mtime=200)
+        old = self.create_file('old.jpg', mtime=100)
+        self.create_file('notes.txt')
+        os.mkdir(os.path.join(self.dest, 'dir.jpg'))
+
+        with DownloadDatabase(self.db_filename) as db:
+            self.assertEqual(db.sync_files(self.dest), (2, 0))
+            self.assertEqual(db.oldest_files(self.dest, 5), [old, new])
+
+    def test_sync_removes_missing_files(self):
+        with DownloadDatabase(self.db_filename) as db:
+            path = self.create_file('a.jpg')
+            db.add_file(path)
+            os.remove(path)
+
+            self.assertEqual(db.sync_files(self.dest), (0, 1))
+            self.assertEqual(db.count_files(self.dest), 0)
+
+    def test_sync_does_not_stat_tracked_files(self):
+        with DownloadDatabase(self.db_filename) as db:
+            db.add_file(self.create_file('a.jpg'))
+
+            with mock.patch('db.os.scandir', wraps=os.scandir) as mock_scandir:
+                with mock.patch('os.DirEntry.stat', create=True) as mock_stat:
+                    db.sync_files(self.dest)
+
+        mock_scandir.assert_called_once()
+        mock_stat.assert_not_called()
+
+    def test_sync_tracks_every_stored_extension(self):
+        for name in ('a.jpg', 'b.JPEG', 'c.png', 'd.gif', 'e.webp', 'f.part'):
+            self.create_file(name)
+
+        with DownloadDatabase(self.db_filename) as db:
+            self.assertEqual(db.sync_files(self.dest), (5, 0))
+
+    def set_dir_mtime(self, mtime):
+        os.utime(self.dest, (mtime, mtime))
+
+    def test_sync_skips_scan_of_unchanged_directory(self):
+        with DownloadDatabase(self.db_filename) as db:
+            db.sync_files(self.dest)
+            db.add_file(self.create_file('a.jpg'))
+            path = self.create_file('b.jpg')
+            os.remove(path)
+            db.remove_files([path])
+
+            with mock.patch('db.os.scandir') as mock_scandir:
+                self.assertEqual(db.sync_files(self.dest), (0, 0))
+
+        mock_scandir.assert_not_called()
+
+    def test_sync_scans_directory_changed_by_hand(self):
+        self.set_dir_mtime(100)
+        with DownloadDatabase(self.db_filename) as db:
+            db.sync_files(self.dest)
+            self.create_file('a.jpg')
+            self.set_dir_mtime(200)
+
+            self.assertEqual(db.sync_files(self.dest), (1, 0))
+
+    def test_sync_scans_again_after_interval(self):
+        with DownloadDatabase(self.db_filename) as db:
+            db.sync_files(self.dest)
+            mtime = os.stat(self.dest).st_mtime_ns
+            self.create_file('a.jpg')
+            os.utime(self.dest, ns=(mtime, mtime))
+
+            self.assertEqual(db.sync_files(self.dest), (0, 0))
+            self.assertEqual(db.sync_files(self.dest, rescan_interval=0), (1, 0))
+
+    def test_files_tracked_per_directory(self):
+        other = os.path.join(self.tempdir.name, 'other')
+        os.mkdir(other)
+
+        with DownloadDatabase(self.db_filename) as db:
+            db.add_file(self.create_file('a.jpg'))
+            db.sync_files(other)
+
+            self.assertEqual(db.count_files(self.dest), 1)
+            self.assertEqual(db.count_files(other), 0)
+
+    def test_remove_files(self):
+        with DownloadDatabase(self.db_filename) as db:
+            path = self.create_file('a.jpg')
+            db.add_file(path)
+            db.remove_files([path])
+
+            self.assertEqual(db.count_files(self.dest), 0)
+
+    def test_lru_files_ordered_by_last_use(self):
+        with DownloadDatabase(self.db_filename) as db:
+            a = self.create_file('a.jpg')
+            b = self.create_file('b.jpg')
+            db.add_file(a, downloaded=1)
+            db.add_file(b, downloaded=2)
+            db.mark_file_shown(a, 3)
+
+            self.assertEqual([row[0] for row in db.lru_files(self.dest)], [b, a])
+
+    def test_files_size(self):
+        with DownloadDatabase(self.db_filename) as db:
+            self.assertEqual(db.files_size(self.dest), 0)
+            db.add_file(self.create_file('a.jpg'), size=10)
+            db.add_file(self.create_file('b.jpg'), size=5)
+
+            self.assertEqual(db.files_size(self.dest), 15)
+
+    def test_favorite(self):
+        with DownloadDatabase(self.db_filename) as db:
+            path = self.create_file('a.jpg')
+            db.add_file(path)
+
+            self.assertTrue(db.set_favorite(path))
+            self.assertEqual(next(db.lru_files(self.dest))[4], 1)
+            self.assertFalse(db.set_favorite(os.path.join(self.dest, 'gah.jpg')))
+
+    def test_added_again_stays_favorite(self):
+        with DownloadDatabase(self.db_filename) as db:
+            path = self.create_file('a.jpg')
+            db.add_file(path, size=5, downloaded=1)
+            db.set_favorite(path)
+            db.mark_file_shown(path, 2)
+
+            db.add_file(path, size=10, downloaded=3)
+
+            self.assertEqual(next(db.lru_files(self.dest))[1:], (10, 3, 2, 1))
+
+    def test_last_shown_file(self):
+        with DownloadDatabase(self.db_filename) as db:
+            self.assertIsNone(db.last_shown_file())
+
+            a = self.create_file('a.jpg')
+            b = self.create_file('b.jpg')
+            db.add_file(a)
+            db.add_file(b)
+            db.mark_file_shown(b, 2)
+            db.mark_file_shown(a, 1)
+
+            self.assertEqual(db.last_shown_file(), b)
+
+    def test_old_manifest_gets_shown_and_favorite_columns(self):
+        conn = sqlite3.connect(self.db_filename)
+        conn.execute(
+            'CREATE TABLE downloads_files (path text PRIMARY KEY, dir text NOT NULL, '
+            'size integer NOT NULL, downloaded real NOT NULL)'
+        )
+        conn.commit()
+        conn.close()
+
+        with DownloadDatabase(self.db_filename) as db:
+            db.add_file(self.create_file('a.jpg'))
+            self.assertEqual(next(db.lru_files(self.dest))[3:], (None, 0))
+
+
+class DownloadDatabaseDigestTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.db_filename = os.path.join(self.tempdir.name, 'test.db')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_digest_of_unknown_url(self):
+        with DownloadDatabase(self.db_filename) as db:
+            self.assertIsNone(db.digest_for('http://mock/1.jpg'))
+
+    def test_digest_shared_by_query_variants(self):
+        with DownloadDatabase(self.db_filename) as db:
+            db.add_digest('http://mock/1.jpg?w=1', 'abc')
+
+            self.assertEqual(db.digest_for('http://mock/1.jpg'), 'abc')
+            self.assertEqual(db.digest_for('http://mock/1.jpg?w=2#x'), 'abc')
+
+    def test_count_digest(self):
+        with DownloadDatabase(self.db_filename) as db:
+            db.add_digest('http://mock/1.jpg', 'abc')
+            db.add_digest('http://mock/2.jpg', 'abc')
+
+            self.assertEqual(db.count_digest('abc'), 2)
+            self.assertEqual(db.count_digest('def'), 0)
+
+    def test_phashes_round_trip_all_64_bits(self):
+        with DownloadDatabase(self.db_filename) as db:
+            db.add_phash('http://mock/1.jpg', (1 << 64) - 1)
+            db.add_phash('http://mock/2.jpg', 5)
+
+            self.assertEqual(
+                sorted(db.phashes()),
+                [('http://mock/1.jpg', (1 << 64) - 1), ('http://mock/2.jpg', 5)],
+            )
+
+    def test_path_of(self):
+        with DownloadDatabase(self.db_filename) as db:
+            db.add('http://mock/1.jpg', path='/d/1.jpg')
+
+            self.assertEqual(db.path_of('http://mock/1.jpg'), '/d/1.jpg')
+            self.assertIsNone(db.path_of('http://mock/2.jpg'))
+
+    def test_recent_artists_newest_first(self):
+        with DownloadDatabase(self.db_filename) as db:
+            for n, artist in enumerate(['Monet', 'Degas', None, 'Manet']):
+                url = f'http://mock/{n}.jpg'
+                db.add_paintings([{'image': url, 'artistName': artist}])
+                db.add(url)
+            # Picked but never downloaded.
+            db.add_paintings([{'image': 'http://mock/9.jpg', 'artistName': 'Klimt'}])
+
+            self.assertEqual(db.recent_artists(2), ['Manet', 'Degas'])
+
+    def test_paintings_stored_normalized(self):
+        paintings = [
+            {
+                'id': 57726,
+                'title': 'Water Lilies',
+                'year': 'c.1916',
+                'width': '2000',
+                'height': 1500,
+                'image': 'http://mock/1.jpg',
+                'paintingUrl': '/en/claude-monet/water-lilies',
+                'artistName': 'Claude Monet',
+                'artistUrl': '/en/claude-monet',
+            },
+            {'image': 'http://mock/2.jpg', 'artistName': 'Claude Monet', 'width': '?'},
+            {'title': 'No image'},
+        ]
+        with DownloadDatabase(self.db_filename) as db:
+            self.assertEqual(db.add_paintings(paintings, page=3, fetched=10.0), 2)
+
+            self.assertEqual(
+                db.painting('http://mock/1.jpg'),
+                {
+                    'image': 'http://mock/1.jpg',
+                    'id': '57726',
+                    'title': 'Water Lilies',
+                    'artistName': 'Claude Monet',
+                    'year': 1916,
+                    'width': 2000,
+                    'height': 1500,
+                    'paintingUrl': '/en/claude-monet/water-lilies',
+                },
+            )
+            self.assertIsNone(db.painting('http://mock/2.jpg')['width'])
+            self.assertIsNone(db.painting('http://mock/3.jpg'))
+            self.assertEqual(db.count_paintings(), (2, 1))
+            self.assertEqual(db.page_fetched(3), 10.0)
+            self.assertIsNone(db.page_fetched(4))
+
+    def test_paintings_updated_in_place(self):
+        with DownloadDatabase(self.db_filename) as db:
+            db.add_paintings([{'image': 'http://mock/1.jpg', 'title': 'Old'}])
+            db.add_paintings([{'image': 'http://mock/1.jpg', 'title': 'New'}])
+
+            self.assertEqual(db.painting('http://mock/1.jpg')['title'], 'New')
+            self.assertEqual(db.count_paintings(), (1, 0))
+
+    def test_top_artists_and_states(self):
+        with DownloadDatabase(self.db_filename) as db:
+            db.add_paintings(
+                {'image': f'http://mock/{n}.jpg', 'artistName': artist}
+                for n, artist in enumerate(['Monet', 'Degas', 'Monet', 'Manet'])
+            )
+            for n in range(3):
+                db.add(f'http://mock/{n}.jpg')
+            db.add('http://mock/3.jpg', state=STATE_PREFETCHED)
+
+            self.assertEqual(db.top_artists(5), [('Monet', 2), ('Degas', 1)])
+            self.assertEqual(db.count_by_state(), {'shown': 3, 'prefetched': 1})
+
+    def test_reserved_urls_kept_out_of_picks_until_released(self):
+        with DownloadDatabase(self.db_filename) as db:
+            db.reserve(['http://mock/1.jpg', 'http://mock/2.jpg'])
+            self.assertEqual(
+                db.filter_new(['http://mock/1.jpg', 'http://mock/3.jpg']), ['http://mock/3.jpg']
+            )
+
+            db.add('http://mock/1.jpg', path='/d/1.jpg')
+            db.release(['http://mock/1.jpg', 'http://mock/2.jpg'])
+
+            self.assertEqual(db.count_by_state(), {'shown': 1})
+            self.assertEqual(db.path_of('http://mock/1.jpg'), '/d/1.jpg')
+
+    def test_stale_reservations_taken_back(self):
+        with DownloadDatabase(self.db_filename) as db:
+            db.reserve(['http://mock/1.jpg'])
+
+            later = time.time() + LOCK_TIMEOUT + 1
+            with mock.patch('db.time.time', return_value=later):
+                self.assertEqual(db.filter_new(['http://mock/1.jpg']), ['http://mock/1.jpg'])
+                self.assertEqual(
+                    db.filter_new([f'http://mock/{n}.jpg' for n in range(1000)])[1],
+                    'http://mock/1.jpg',
+                )
+                db.reserve(['http://mock/1.jpg'])
+
+            self.assertEqual(db.filter_new(['http://mock/1.jpg']), [])
+            self.assertEqual(db.count_by_state(), {'picked': 1})
+
+    def test_reserve_taken_url_raises(self):
+        with DownloadDatabase(self.db_filename) as db:
+            db.add('http://mock/2.jpg')
+
+            with self.assertRaises(ValueError):
+                db.reserve(['http://mock/1.jpg', 'http://mock/2.jpg'])
+            self.assertEqual(db.count_by_state(), {'shown': 1})
+
+    def test_add_keeps_shown_url(self):
+        with DownloadDatabase(self.db_filename) as db:
+            db.add('http://mock/1.jpg', path='/d/1.jpg')
+
+            with self.assertLogs('db', 'WARNING'):
+                db.add('http://mock/1.jpg', STATE_PREFETCHED, '/q/1.jpg')
+            self.assertEqual(db.count_by_state(), {'shown': 1})
+
+    def test_skipped_images_not_recent(self):
+        with DownloadDatabase(self.db_filename) as db:
+            db.add_paintings(
+                {'image': f'http://mock/{n}.jpg', 'artistName': artist}
+                for n, artist in enumerate(['Monet', 'Degas'])
+            )
+            db.add('http://mock/0.jpg')
+            db.add('http://mock/1.jpg', state=STATE_SKIPPED)
+
+            self.assertEqual(db.recent_artists(5), ['Monet'])
+            self.assertEqual(db.top_artists(5), [('Monet', 1)])
+            self.assertEqual(db.filter_new(['http://mock/1.jpg']), [])
+
+    def test_pages_of_sources_kept_apart(self):
+        with DownloadDatabase(self.db_filename) as db:
+            db.add_paintings([{'image': 'http://mock/1.jpg'}], page=1, fetched=10.0)
+            db.add_paintings(
+                [{'image': 'file:///art/1.jpg'}], page=1, fetched=20.0, source='dir:/art'
+            )
+
+            self.assertEqual(db.page_fetched(1), 10.0)
+            self.assertEqual(db.page_fetched(1, 'dir:/art'), 20.0)
+            self.assertIsNone(db.page_fetched(1, 'dir:/other'))
@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import unittest
+import unittest.mock as mock
+from engine import AsyncEngine
+
+
+class AsyncEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.pages = {
+            1: ['http://mock/1.jpg', 'http://mock/2.jpg'],
+            2: ['http://mock/3.jpg', 'http://mock/4.jpg'],
+            3: ['http://mock/5.jpg'],
+            4: [],
+        }
+        self.mock_catalog = mock.Mock(
+            iter_urls=mock.Mock(
+                side_effect=lambda page, workers: ((p, self.pages[p]) for p in range(page, 5))
+            )
+        )
+
+        self.seen = set()
+        self.mock_db = mock.Mock(
+            filter_new=mock.Mock(
+                side_effect=lambda urls: [u for u in urls if u not in self.seen]
+            ),
+            digest_for=mock.Mock(return_value=None),
+            count_digest=mock.Mock(return_value=0),
+            pick_lock=mock.MagicMock(),
+        )
+        self.mock_session = mock.Mock()
+
+        self.patcher_download = mock.patch(
+            'wikiwall.download_to_store',
+            side_effect=lambda url, store, session, segments: (store.path + '/img.jpg', 'abc'),
+        )
+        self.mock_download = self.patcher_download.start()
+
+        self.patcher_store = mock.patch('store.ContentStore')
+        self.mock_store = self.patcher_store.start()
+        self.mock_store.side_effect = lambda path: mock.Mock(
+            path=path, find=mock.Mock(return_value=None)
+        )
+
+        self.patcher_lock = mock.patch('locks.FileLock')
+        self.mock_lock = self.patcher_lock.start()
+
+        self.loop = asyncio.new_event_loop()
+        self.engine = AsyncEngine(self.mock_db, self.mock_session, workers=2)
+
+    def tearDown(self):
+        self.engine.close()
+        self.loop.close()
+        self.patcher_download.stop()
+        self.patcher_store.stop()
+        self.patcher_lock.stop()
+
+    def run_coro(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_find_new_urls_on_first_page(self):
+        self.seen.add('http://mock/1.jpg')
+
+        urls = self.run_coro(self.engine.find_new_urls(self.mock_catalog))
+
+        self.assertEqual(urls, ['http://mock/2.jpg'])
+        self.mock_catalog.iter_urls.assert_called_once_with(1, 2)
+
+    def test_find_new_urls_skips_used_up_pages(self):
+        self.seen.update(self.pages[1] + self.pages[2])
+
+        urls = self.run_coro(self.engine.find_new_urls(self.mock_catalog))
+
+        self.assertEqual(urls, self.pages[3])
+
+    def test_find_new_urls_raises_on_empty_page(self):
+        self.seen.update(self.pages[1] + self.pages[2] + self.pages[3])
+
+        with self.assertRaises(ValueError):
+            self.run_coro(self.engine.find_new_urls(self.mock_catalog))
+
+    def test_fetch_new_images_downloads_distinct_images_per_dest(self):
+        results = self.run_coro(
+            self.engine.fetch_new_images(self.mock_catalog, ['/tmp/a', '/tmp/b'])
+        )
+
+        self.assertEqual(sorted(url for url, _ in results), self.pages[1])
+        self.assertEqual([path for _, path in results], ['/tmp/a/img.jpg', '/tmp/b/img.jpg'])
+        self.mock_download.assert_called_with(mock.ANY, mock.ANY, self.mock_session, 1)
+        self.mock_db.add_digest.assert_any_call(results[0][0], 'abc')
+
+    def test_picks_reserved_and_released_on_failure(self):
+        self.mock_download.side_effect = IOError
+
+        with self.assertRaises(IOError):
+            self.run_coro(self.engine.fetch_new_images(self.mock_catalog, ['/tmp/a', '/tmp/b']))
+
+        urls = self.mock_db.reserve.call_args[0][0]
+        self.assertEqual(sorted(urls), self.pages[1])
+        self.mock_db.release.assert_called_once_with(urls)
+
+    def test_known_content_not_downloaded(self):
+        self.mock_db.digest_for.return_value = 'abc'
+        self.mock_store.side_effect = lambda path: mock.Mock(
+            find=mock.Mock(return_value=path + '/abc.jpg')
+        )
+
+        path = self.run_coro(self.engine.store_img('http://mock/1.jpg?w=1', '/tmp/a'))
+
+        self.assertEqual(path, '/tmp/a/abc.jpg')
+        self.mock_download.assert_not_called()
+        self.mock_lock.return_value.__enter__.assert_called_once_with()
+        self.mock_lock.return_value.__exit__.assert_called_once()
+
+    def test_duplicate_content_logged(self):
+        self.mock_db.count_digest.return_value = 1
+
+        with self.assertLogs('wikiwall', 'INFO') as logs:
+            self.run_coro(self.engine.store_img('http://mock/1.jpg', '/tmp/a'))
+
+        self.assertIn('same content', logs.output[0])
+        self.mock_db.add_digest.assert_called_once_with('http://mock/1.jpg', 'abc')
+
+    def test_selector_picks_on_pool(self):
+        loop_thread = threading.get_ident()
+        pick_threads = []
+
+        def pick(catalog, db, k, workers):
+            pick_threads.append(threading.get_ident())
+            return self.pages[2][:k]
+
+        results = self.run_coro(
+            self.engine.fetch_new_images(self.mock_catalog, ['/tmp/a'], mock.Mock(pick=pick))
+        )
+
+        self.assertEqual(results, [('http://mock/3.jpg', '/tmp/a/img.jpg')])
+        self.assertNotIn(loop_thread, pick_threads)
+
+    def test_scrape_urls_uses_engine_session(self):
+        with mock.patch('engine.scrape_urls', return_value=iter(['a.jpg'])) as mock_scrape:
+            urls = self.run_coro(self.engine.scrape_urls('http://mock'))
+
+        self.assertEqual(urls, ['a.jpg'])
+        mock_scrape.assert_called_once_with('http://mock', self.mock_session)
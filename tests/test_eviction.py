@@ -0,0 +1,150 @@
+import os
+import os.path
+import tempfile
+import unittest
+import unittest.mock as mock
+from db import DownloadDatabase
+from eviction import Evictor, FileEntry, KeepFavorites, MaxAge, MaxBytes, MaxCount, Policy
+
+
+class PolicyTest(unittest.TestCase):
+    def entry(self, size=10, downloaded=100, shown=None, favorite=0):
+        return FileEntry('/d/a.jpg', size, downloaded, shown, favorite)
+
+    def test_base_policy_claims_nothing(self):
+        policy = Policy()
+
+        self.assertFalse(policy.wants(self.entry()))
+        self.assertFalse(policy.keeps(self.entry()))
+        self.assertTrue(policy.done)
+
+    def test_max_count_claims_excess(self):
+        policy = MaxCount(2)
+        policy.start(mock.Mock(count_files=mock.Mock(return_value=3)), '/d', 0)
+
+        self.assertTrue(policy.wants(self.entry()))
+        policy.evicted(self.entry())
+        self.assertTrue(policy.done)
+        self.assertFalse(policy.wants(self.entry()))
+
+    def test_max_count_rejects_negative_limit(self):
+        with self.assertRaises(ValueError):
+            MaxCount(-1)
+
+    def test_max_bytes_claims_until_under_limit(self):
+        policy = MaxBytes(15)
+        policy.start(mock.Mock(files_size=mock.Mock(return_value=30)), '/d', 0)
+
+        policy.evicted(self.entry(size=10))
+        self.assertFalse(policy.done)
+        policy.evicted(self.entry(size=10))
+        self.assertTrue(policy.done)
+
+    def test_max_age_uses_last_shown_time(self):
+        policy = MaxAge(50)
+        policy.start(None, '/d', 200)
+
+        self.assertTrue(policy.wants(self.entry(downloaded=100)))
+        self.assertFalse(policy.wants(self.entry(downloaded=100, shown=180)))
+        self.assertTrue(policy.done)
+
+    def test_keep_favorites(self):
+        self.assertTrue(KeepFavorites().keeps(self.entry(favorite=1)))
+        self.assertFalse(KeepFavorites().keeps(self.entry()))
+
+
+class EvictorTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+        self.dest = os.path.join(self.tempdir.name, 'dest')
+        os.mkdir(self.dest)
+
+        self.db = DownloadDatabase(os.path.join(self.tempdir.name, 'test.db')).__enter__()
+        self.addCleanup(self.db.__exit__, None, None, None)
+
+    def create_file(self, name, size=10, downloaded=100, shown=None):
+        path = os.path.join(self.dest, name)
+        with open(path, 'wb') as f:
+            f.write(bytes(size))
+        self.db.add_file(path, downloaded=downloaded)
+        if shown is not None:
+            self.db.mark_file_shown(path, shown)
+        return path
+
+    def remaining(self):
+        return sorted(os.listdir(self.dest))
+
+    def test_least_recently_shown_removed_first(self):
+        self.create_file('a.jpg', downloaded=100, shown=300)
+        self.create_file('b.jpg', downloaded=200, shown=250)
+        self.create_file('c.jpg', downloaded=300)
+
+        removed = Evictor(self.db, self.dest, [MaxCount(2)]).run()
+
+        self.assertEqual(removed, [os.path.join(self.dest, 'b.jpg')])
+        self.assertEqual(self.remaining(), ['a.jpg', 'c.jpg'])
+        self.assertEqual(self.db.count_files(self.dest), 2)
+
+    def test_max_bytes(self):
+        self.create_file('a.jpg', size=100, downloaded=1)
+        self.create_file('b.jpg', size=100, downloaded=2)
+        self.create_file('c.jpg', size=50, downloaded=3)
+
+        Evictor(self.db, self.dest, [MaxBytes(140)]).run()
+
+        self.assertEqual(self.remaining(), ['c.jpg'])
+
+    def test_max_age(self):
+        self.create_file('a.jpg', downloaded=100)
+        self.create_file('b.jpg', downloaded=100, shown=900)
+
+        Evictor(self.db, self.dest, [MaxAge(500)]).run(now=1000)
+
+        self.assertEqual(self.remaining(), ['b.jpg'])
+
+    def test_favorites_kept(self):
+        fav = self.create_file('a.jpg', downloaded=1)
+        self.create_file('b.jpg', downloaded=2)
+        self.create_file('c.jpg', downloaded=3)
+        self.db.set_favorite(fav)
+
+        Evictor(self.db, self.dest, [KeepFavorites(), MaxCount(1)]).run()
+
+        # Favorites count towards the limit but are never deleted.
+        self.assertEqual(self.remaining(), ['a.jpg'])
+
+    def test_removal_counts_towards_every_policy(self):
+        self.create_file('a.jpg', size=100, downloaded=1)
+        self.create_file('b.jpg', size=100, downloaded=2)
+
+        Evictor(self.db, self.dest, [MaxAge(10), MaxCount(1)]).run(now=5)
+
+        self.assertEqual(self.remaining(), ['b.jpg'])
+
+    def test_stops_when_out_of_time(self):
+        for n in range(3):
+            self.create_file(f'{n}.jpg', downloaded=n)
+
+        with mock.patch('eviction.time.monotonic', side_effect=[0, 0, 1, 2, 3]):
+            removed = Evictor(self.db, self.dest, [MaxCount(0)]).run(time_budget=0.5)
+
+        self.assertEqual(len(removed), 1)
+        self.assertEqual(self.db.count_files(self.dest), 2)
+
+    def test_missing_file_dropped_from_manifest(self):
+        path = self.create_file('a.jpg')
+        os.remove(path)
+
+        Evictor(self.db, self.dest, [MaxCount(0)]).run()
+
+        self.assertEqual(self.db.count_files(self.dest), 0)
+
+    def test_no_walk_if_nothing_to_do(self):
+        self.create_file('a.jpg')
+
+        with mock.patch.object(self.db, 'lru_files') as mock_lru:
+            Evictor(self.db, self.dest, [MaxCount(5)]).run()
+
+        mock_lru.assert_not_called()
@@ -0,0 +1,73 @@
+import os.path
+import tempfile
+import unittest
+import urllib.request
+import requests
+from fileadapter import FileAdapter
+
+
+class FileAdapterTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+        path = os.path.join(self.tempdir.name, 'a b.jpg')
+        with open(path, 'wb') as f:
+            f.write(b'0123456789')
+        self.url = 'file://' + urllib.request.pathname2url(path)
+
+        self.session = requests.Session()
+        self.session.mount('file://', FileAdapter())
+        self.addCleanup(self.session.close)
+
+    def test_get(self):
+        r = self.session.get(self.url)
+
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.content, b'0123456789')
+        self.assertEqual(r.headers['Content-Length'], '10')
+
+    def test_head(self):
+        r = self.session.head(self.url)
+
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(r.headers['Content-Length'], '10')
+        self.assertEqual(r.content, b'')
+
+    def test_ranges(self):
+        for header, status, body in (
+            ('bytes=2-4', 206, b'234'),
+            ('bytes=7-', 206, b'789'),
+            ('bytes=-2', 206, b'89'),
+            ('bytes=8-100', 206, b'89'),
+            ('bytes=10-', 416, b''),
+            ('pages=1-2', 200, b'0123456789'),
+        ):
+            with self.subTest(header=header):
+                r = self.session.get(self.url, headers={'Range': header})
+                self.assertEqual(r.status_code, status)
+                self.assertEqual(r.content, body)
+
+    def test_streamed_readinto(self):
+        with self.session.get(self.url, stream=True, headers={'Range': 'bytes=3-'}) as r:
+            r.raw.decode_content = True
+            buf = bytearray(4)
+            chunks = []
+            while True:
+                n = r.raw.readinto(buf)
+                if not n:
+                    break
+                chunks.append(bytes(buf[:n]))
+
+        self.assertEqual(chunks, [b'3456', b'789'])
+
+    def test_missing_file(self):
+        r = self.session.get(self.url + '.missing')
+
+        self.assertEqual(r.status_code, 404)
+        with self.assertRaises(requests.HTTPError):
+            r.raise_for_status()
+
+    def test_other_methods_not_allowed(self):
+        self.assertEqual(self.session.post(self.url).status_code, 405)
@@ -0,0 +1,162 @@
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+import requests
+from requests.exceptions import HTTPError
+from requests.structures import CaseInsensitiveDict
+from httpcache import HTTPCache, freshness, parse_cache_control
+
+URL = 'http://mock/?json=2&page=1'
+
+
+def response(status_code=200, body=b'', headers=None):
+    resp = mock.Mock(spec=requests.models.Response)
+    resp.status_code = status_code
+    resp.headers = CaseInsensitiveDict(headers or {})
+    resp.iter_content.side_effect = lambda chunk_size: (
+        body[i:i + chunk_size] for i in range(0, len(body), chunk_size)
+    )
+    if status_code >= 400:
+        resp.raise_for_status.side_effect = HTTPError
+    return resp
+
+
+class FreshnessTest(unittest.TestCase):
+    def test_parse_cache_control(self):
+        self.assertEqual(
+            parse_cache_control('public, Max-Age=60, no-cache="Set-Cookie"'),
+            {'public': True, 'max-age': '60', 'no-cache': 'Set-Cookie'},
+        )
+        self.assertEqual(parse_cache_control(None), {})
+
+    def test_max_age_minus_age(self):
+        self.assertEqual(freshness({'Cache-Control': 'max-age=60', 'Age': '15'}, 0), 45)
+
+    def test_expires_relative_to_date(self):
+        headers = {
+            'Date': 'Mon, 05 Oct 2026 10:00:00 GMT',
+            'Expires': 'Mon, 05 Oct 2026 10:05:00 GMT',
+        }
+        self.assertEqual(freshness(headers, 0), 300)
+
+    def test_no_store_no_cache_and_nothing(self):
+        self.assertIsNone(freshness({'Cache-Control': 'max-age=60, no-store'}, 0))
+        self.assertEqual(freshness({'Cache-Control': 'no-cache, max-age=60'}, 0), 0)
+        self.assertEqual(freshness({'Expires': '0'}, 0), 0)
+        self.assertEqual(freshness({}, 0), 0)
+
+
+class HTTPCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+        self.cache = HTTPCache(os.path.join(self.tempdir.name, 'http'))
+        self.session = mock.Mock(spec=requests.Session)
+
+    def fetch(self, chunk_size=4):
+        return b''.join(self.cache.fetch(self.session, URL, chunk_size))
+
+    def test_body_stored_and_revalidated(self):
+        self.session.get.return_value = response(
+            body=b'{"Paintings": []}',
+            headers={'ETag': '"v1"', 'Last-Modified': 'Mon, 05 Oct 2026 10:00:00 GMT'},
+        )
+        self.assertEqual(self.fetch(), b'{"Paintings": []}')
+        self.session.get.assert_called_once_with(URL, headers={}, stream=True)
+
+        self.session.get.return_value = response(304)
+        self.assertEqual(self.fetch(), b'{"Paintings": []}')
+        self.session.get.assert_called_with(
+            URL,
+            headers={
+                'If-None-Match': '"v1"',
+                'If-Modified-Since': 'Mon, 05 Oct 2026 10:00:00 GMT',
+            },
+            stream=True,
+        )
+
+    def test_changed_body_replaces_stored_one(self):
+        self.session.get.return_value = response(body=b'old', headers={'ETag': '"v1"'})
+        self.fetch()
+        self.session.get.return_value = response(body=b'new', headers={'ETag': '"v2"'})
+        self.fetch()
+
+        self.session.get.return_value = response(304)
+        self.assertEqual(self.fetch(), b'new')
+        self.assertEqual(self.cache.lookup(URL)['etag'], '"v2"')
+
+    def test_fresh_body_served_without_request(self):
+        self.session.get.return_value = response(
+            body=b'body', headers={'Cache-Control': 'max-age=600'}
+        )
+        self.fetch()
+        self.fetch()
+        self.assertEqual(self.session.get.call_count, 1)
+
+        with mock.patch('httpcache.time.time', return_value=10 ** 10):
+            self.session.get.return_value = response(304)
+            self.assertEqual(self.fetch(), b'body')
+        self.assertEqual(self.session.get.call_count, 2)
+
+    def test_304_refreshes_stored_entry(self):
+        self.session.get.return_value = response(body=b'body', headers={'ETag': '"v1"'})
+        self.fetch()
+        self.session.get.return_value = response(
+            304, headers={'Cache-Control': 'max-age=600'}
+        )
+        self.fetch()
+
+        self.fetch()
+        self.assertEqual(self.session.get.call_count, 2)
+
+    def test_no_store_response_not_stored(self):
+        self.session.get.return_value = response(
+            body=b'body', headers={'Cache-Control': 'no-store'}
+        )
+
+        self.assertEqual(self.fetch(), b'body')
+        self.assertIsNone(self.cache.lookup(URL))
+        self.assertEqual(os.listdir(self.cache.path), [])
+
+    def test_rest_of_body_stored_when_reading_stops_early(self):
+        self.session.get.return_value = response(body=b'0123456789')
+
+        chunks = self.cache.fetch(self.session, URL, 4)
+        next(chunks)
+        chunks.close()
+
+        self.session.get.return_value = response(304)
+        self.assertEqual(self.fetch(), b'0123456789')
+        self.session.get.return_value.close.assert_called_once_with()
+
+    def test_failed_read_leaves_no_entry(self):
+        resp = response()
+
+        def chunks(chunk_size):
+            yield b'0123'
+            raise requests.exceptions.ConnectionError
+
+        resp.iter_content.side_effect = chunks
+        self.session.get.return_value = resp
+
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.fetch()
+        self.assertIsNone(self.cache.lookup(URL))
+        self.assertEqual(os.listdir(self.cache.path), [])
+
+    def test_error_status_raised(self):
+        self.session.get.return_value = response(404)
+
+        with self.assertRaises(HTTPError):
+            self.fetch()
+
+    def test_corrupt_entry_ignored(self):
+        self.session.get.return_value = response(body=b'body')
+        self.fetch()
+        _, meta = self.cache._files(URL)
+        with open(meta, 'w') as f:
+            f.write('{oops')
+
+        self.assertIsNone(self.cache.lookup(URL))
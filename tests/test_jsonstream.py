@@ -0,0 +1,91 @@
+import json
+import unittest
+import unittest.mock as mock
+import jsonstream
+from jsonstream import iter_array
+
+
+def chunked(text, size):
+    data = text.encode()
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class IterArrayTest(unittest.TestCase):
+    def setUp(self):
+        self.data = {
+            'Count': 12345,
+            'Flag': True,
+            'Nested': {'Paintings': ['not', 'this']},
+            'Paintings': [
+                {'id': 1, 'title': 'Café de nuit ☕', 'year': None, 'size': [1.5e3, -2]},
+                {'id': 2, 'escaped': 'a "quoted" \\ é'},
+                314159,
+                'text',
+                [],
+            ],
+            'After': 'ignored',
+        }
+        self.text = json.dumps(self.data, ensure_ascii=False)
+
+    def test_items_decoded_across_any_chunk_boundary(self):
+        for size in (1, 2, 3, 5, 64, len(self.text.encode())):
+            with self.subTest(size=size):
+                items = list(iter_array(chunked(self.text, size), 'Paintings'))
+                self.assertEqual(items, self.data['Paintings'])
+
+    def test_whitespace(self):
+        text = json.dumps(self.data, indent=4)
+        self.assertEqual(
+            list(iter_array(chunked(text, 4), 'Paintings')), self.data['Paintings']
+        )
+
+    def test_numbers_not_cut_off(self):
+        chunks = [b'{"a": [12', b'34, 5', b'6]}']
+        self.assertEqual(list(iter_array(chunks, 'a')), [1234, 56])
+
+    def test_numbers_split_after_point_exponent_or_sign(self):
+        for number, value in (('1.5', 1.5), ('1e3', 1e3), ('-2', -2)):
+            for cut in range(1, len(number)):
+                with self.subTest(number=number, cut=cut):
+                    text = f'{{"n": {number}, "a": [{number}, {number}]}}'.encode()
+                    head = text.index(number.encode()) + cut
+                    tail = text.rindex(number.encode()) + cut
+                    chunks = [text[:head], text[head:tail], text[tail:]]
+                    self.assertEqual(list(iter_array(chunks, 'a')), [value, value])
+
+    def test_large_item_decoded_once(self):
+        item = {'title': 'x' * 1000, 'tags': [['a "b" \\'] * 50], 'n': list(range(100))}
+        chunks = chunked(json.dumps({'a': [item, item]}), 7)
+
+        with mock.patch.object(
+            jsonstream, '_decoder', wraps=jsonstream._decoder
+        ) as decoder:
+            self.assertEqual(list(iter_array(chunks, 'a')), [item, item])
+
+        # Key and two items.
+        self.assertEqual(decoder.raw_decode.call_count, 3)
+
+    def test_escapes_cut_off_at_chunk_end(self):
+        chunks = [b'{"a": ["x\\', b'"y', b'\\', b'\\"]}']
+        self.assertEqual(list(iter_array(chunks, 'a')), ['x"y\\'])
+
+    def test_empty_array(self):
+        self.assertEqual(list(iter_array([b'{"a": [ ]}'], 'a')), [])
+
+    def test_rest_of_stream_not_read(self):
+        chunks = iter([b'{"a": [1], ', b'"b": 2}'])
+
+        self.assertEqual(list(iter_array(chunks, 'a')), [1])
+        self.assertEqual(next(chunks), b'"b": 2}')
+
+    def test_missing_or_null_key(self):
+        for text in ('{}', '{"b": 1}', '{"a": null}'):
+            with self.subTest(text=text):
+                with self.assertRaises(KeyError):
+                    list(iter_array([text.encode()], 'a'))
+
+    def test_invalid_data(self):
+        for text in ('[1, 2]', '{"a": 1}', '{"a": [1 2]}', '{"a": [1, ', '{"a": [{"b": }]}', ''):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    list(iter_array([text.encode()], 'a'))
@@ -0,0 +1,251 @@
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import os
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from locks import FileLock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMAGE = bytes(range(256)) * 1024
+
+# One `wikiwall` run: fetch page 1 and download its first image.
+RUN = '''
+import os, sys
+from catalog import Catalog
+from db import DownloadDatabase
+from wikiwall import make_session, scrape_paintings, store_img
+
+base, tmp = sys.argv[1:]
+session = make_session()
+catalog = Catalog(
+    lambda page: scrape_paintings(f'{base}/feed?page={page}', session),
+    os.path.join(tmp, 'catalog'),
+)
+url = catalog.urls(1)[0]
+with DownloadDatabase(os.path.join(tmp, 'wikiwall.db')) as db:
+    print(store_img(url, os.path.join(tmp, 'dest'), db, session))
+'''
+
+# One `wikiwall` run picking an unseen image and downloading it.
+PICK = '''
+import os, sys
+from catalog import Catalog
+from db import DownloadDatabase
+from wikiwall import _fetch_new_image, make_session, scrape_paintings
+
+base, tmp = sys.argv[1:]
+session = make_session()
+catalog = Catalog(
+    lambda page: scrape_paintings(f'{base}/feed?page={page}', session),
+    os.path.join(tmp, 'catalog'),
+)
+with DownloadDatabase(os.path.join(tmp, 'wikiwall.db')) as db:
+    url, path = _fetch_new_image(catalog, db, session, os.path.join(tmp, 'dest'), 1, 1)
+    db.add(url, path=path)
+    print(url, path)
+'''
+
+
+class Upstream(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 64
+
+    def __init__(self, images=1):
+        super().__init__(('127.0.0.1', 0), UpstreamHandler)
+        self.hits = Counter()
+        self.lock = threading.Lock()
+        self.images = images
+
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.hits[self.path.split('?')[0]] += 1
+
+        # Slow enough for runs to overlap.
+        time.sleep(0.2)
+        if self.path.startswith('/feed'):
+            host, port = self.server.server_address
+            names = ['img.jpg'] + [f'img{n}.jpg' for n in range(1, self.server.images)]
+            paintings = [{'image': f'http://{host}:{port}/{name}'} for name in names]
+            if not self.path.endswith('page=1'):
+                paintings = []
+            body = json.dumps({'Paintings': paintings}).encode()
+            content_type = 'application/json'
+        else:
+            # Each image has its own content.
+            body = IMAGE + self.path.encode()
+            content_type = 'image/jpeg'
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        for i in range(0, len(body), 64 * 1024):
+            self.wfile.write(body[i:i + 64 * 1024])
+            time.sleep(0.02)
+
+
+class FileLockTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.path = os.path.join(self.tempdir.name, 'a.lock')
+
+    def test_file_removed_on_release(self):
+        with FileLock(self.path) as lock:
+            self.assertTrue(os.path.exists(self.path))
+            self.assertFalse(lock.waited)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_times_out_while_held(self):
+        with FileLock(self.path):
+            with self.assertRaises(TimeoutError):
+                FileLock(self.path, timeout=0.1).acquire()
+
+    def test_excludes_other_processes(self):
+        holder = subprocess.Popen(
+            [
+                sys.executable,
+                '-c',
+                'import sys, time; from locks import FileLock\n'
+                'with FileLock(sys.argv[1]):\n'
+                '    print("locked", flush=True); time.sleep(0.5)',
+                self.path,
+            ],
+            cwd=ROOT,
+            stdout=subprocess.PIPE,
+        )
+        self.addCleanup(holder.wait)
+        self.addCleanup(holder.stdout.close)
+        self.assertEqual(holder.stdout.readline(), b'locked\n')
+
+        start = time.monotonic()
+        with FileLock(self.path, timeout=10) as lock:
+            self.assertTrue(lock.waited)
+            self.assertGreater(time.monotonic() - start, 0.2)
+
+    def test_released_when_holder_dies(self):
+        holder = subprocess.Popen(
+            [
+                sys.executable,
+                '-c',
+                'import sys, time; from locks import FileLock\n'
+                'FileLock(sys.argv[1]).acquire(); print("locked", flush=True); time.sleep(60)',
+                self.path,
+            ],
+            cwd=ROOT,
+            stdout=subprocess.PIPE,
+        )
+        self.addCleanup(holder.stdout.close)
+        self.assertEqual(holder.stdout.readline(), b'locked\n')
+        holder.kill()
+        holder.wait()
+
+        with FileLock(self.path, timeout=5):
+            pass
+
+    def test_threads_take_turns(self):
+        inside = []
+        overlaps = []
+
+        def work():
+            for _ in range(20):
+                with FileLock(self.path, timeout=10):
+                    inside.append(1)
+                    if len(inside) > 1:
+                        overlaps.append(1)
+                    inside.pop()
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(overlaps, [])
+        self.assertFalse(os.path.exists(self.path))
+
+
+class ConcurrentRunsTest(unittest.TestCase):
+    """Many runs started at once fetch the page and image once. """
+
+    RUNS = 12
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+        self.upstream = Upstream()
+        threading.Thread(target=self.upstream.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(self.upstream.server_close)
+        self.addCleanup(self.upstream.shutdown)
+
+    def test_single_flight(self):
+        host, port = self.upstream.server_address
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        runs = [
+            subprocess.Popen(
+                [sys.executable, '-c', RUN, f'http://{host}:{port}', self.tempdir.name],
+                cwd=ROOT,
+                env=env,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            for _ in range(self.RUNS)
+        ]
+        results = [run.communicate(timeout=120) for run in runs]
+
+        for run, (_, err) in zip(runs, results):
+            self.assertEqual(run.returncode, 0, err.decode())
+        paths = {out.decode().splitlines()[-1] for out, _ in results}
+
+        self.assertEqual(self.upstream.hits, {'/feed': 1, '/img.jpg': 1})
+        self.assertEqual(len(paths), 1)
+        with open(paths.pop(), 'rb') as f:
+            self.assertEqual(f.read(), IMAGE + b'/img.jpg')
+
+        dest = os.path.join(self.tempdir.name, 'dest')
+        self.assertEqual([name for name in os.listdir(dest) if not name.endswith('.jpg')], [])
+
+    def test_overlapping_runs_pick_different_images(self):
+        self.upstream.images = self.RUNS
+        host, port = self.upstream.server_address
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        runs = [
+            subprocess.Popen(
+                [sys.executable, '-c', PICK, f'http://{host}:{port}', self.tempdir.name],
+                cwd=ROOT,
+                env=env,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            for _ in range(self.RUNS)
+        ]
+        results = [run.communicate(timeout=120) for run in runs]
+
+        for run, (_, err) in zip(runs, results):
+            self.assertEqual(run.returncode, 0, err.decode())
+        picks = dict(out.decode().splitlines()[-1].split() for out, _ in results)
+
+        self.assertEqual(len(picks), self.RUNS)
+        self.assertEqual(self.upstream.hits['/feed'], 1)
+        for url, path in picks.items():
+            name = url.rsplit('/', 1)[1]
+            self.assertEqual(self.upstream.hits['/' + name], 1)
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), IMAGE + b'/' + name.encode())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import os.path
+import random
+import tempfile
+import unittest
+import unittest.mock as mock
+import phash
+from phash import HammingIndex, distance, dhash
+
+
+class HammingIndexTest(unittest.TestCase):
+    def test_finds_hashes_within_radius(self):
+        index = HammingIndex(3)
+        index.add(0b0000, 'a')
+        index.add(0b0111, 'b')
+        index.add(0b1111, 'c')
+
+        self.assertEqual(index.query(0), [(0, 'a'), (3, 'b')])
+
+    def test_same_hash_of_several_keys(self):
+        index = HammingIndex(2)
+        index.add(42, 'a')
+        index.add(42, 'b')
+
+        self.assertEqual(index.query(42), [(0, 'a'), (0, 'b')])
+        self.assertEqual(len(index), 2)
+
+    def test_loaded_on_first_use(self):
+        load = mock.Mock(return_value=[(0b0001, 'a')])
+        index = HammingIndex(1, load=load)
+        load.assert_not_called()
+
+        index.add(0b0011, 'b')
+        self.assertEqual(index.query(0), [(1, 'a')])
+        self.assertEqual(len(index), 2)
+        load.assert_called_once_with()
+
+    def test_matches_linear_scan(self):
+        rand = random.Random(1)
+        hashes = [rand.getrandbits(64) for _ in range(2000)]
+        index = HammingIndex(6)
+        for i, h in enumerate(hashes):
+            index.add(h, i)
+
+        for h in hashes[:50]:
+            # Flip up to 6 random bits.
+            query = h
+            for bit in rand.sample(range(64), rand.randint(0, 6)):
+                query ^= 1 << bit
+
+            expected = sorted(
+                (distance(query, other), i)
+                for i, other in enumerate(hashes)
+                if distance(query, other) <= 6
+            )
+            self.assertEqual(index.query(query), expected)
+
+    def test_invalid_radius(self):
+        with self.assertRaises(ValueError):
+            HammingIndex(-1)
+        with self.assertRaises(ValueError):
+            HammingIndex(64)
+
+
+@unittest.skipUnless(phash.available(), 'needs numpy and Pillow')
+class DhashTest(unittest.TestCase):
+    def setUp(self):
+        from PIL import Image, ImageDraw
+
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+        self.img = Image.new('RGB', (400, 300), 'white')
+        draw = ImageDraw.Draw(self.img)
+        draw.ellipse((50, 40, 250, 260), fill='navy')
+        draw.rectangle((220, 30, 380, 150), fill='firebrick')
+
+    def save(self, img, name):
+        path = os.path.join(self.tempdir.name, name)
+        img.save(path)
+        return path
+
+    def test_resized_copy_is_close(self):
+        original = dhash(self.save(self.img, 'a.jpg'))
+        small = dhash(self.save(self.img.resize((200, 150)), 'b.jpg'))
+
+        self.assertLessEqual(distance(original, small), 4)
+
+    def test_different_image_is_far(self):
+        original = dhash(self.save(self.img, 'a.jpg'))
+        other = dhash(self.save(self.img.transpose(0), 'b.png'))
+
+        self.assertGreater(distance(original, other), 10)
+
+    def test_hash_fits_64_bits(self):
+        self.assertLess(dhash(self.save(self.img, 'a.png')), 1 << 64)
+
+    def test_not_an_image(self):
+        path = os.path.join(self.tempdir.name, 'a.jpg')
+        with open(path, 'w') as f:
+            f.write('faux jpeg file')
+
+        with self.assertRaises(OSError):
+            dhash(path)
+
+
+class DhashWithoutDependenciesTest(unittest.TestCase):
+    def test_raises(self):
+        with mock.patch('phash.np', None):
+            self.assertFalse(phash.available())
+            with self.assertRaises(RuntimeError):
+                dhash('a.jpg')
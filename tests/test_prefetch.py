@@ -0,0 +1,87 @@
+import os
+import os.path
+import tempfile
+import unittest
+import unittest.mock as mock
+from db import DownloadDatabase
+from prefetch import PrefetchQueue
+
+
+class PrefetchQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.queue_dir = os.path.join(self.tempdir.name, 'queue')
+        self.dest = os.path.join(self.tempdir.name, 'dest')
+        os.makedirs(self.dest)
+
+        self.db = DownloadDatabase(os.path.join(self.tempdir.name, 'test.db'))
+        self.db.__enter__()
+
+        self.queue = PrefetchQueue(self.db, self.queue_dir, size=2)
+        self.fetched = 0
+
+    def tearDown(self):
+        self.db.__exit__(None, None, None)
+        self.tempdir.cleanup()
+
+    def fetch(self, dest):
+        self.fetched += 1
+        path = os.path.join(dest, f'{self.fetched}.jpg')
+        with open(path, 'w') as f:
+            f.write('faux jpeg file')
+        return f'http://mock/{self.fetched}.jpg', path
+
+    def test_queue_directory_created(self):
+        self.assertTrue(os.path.isdir(self.queue_dir))
+
+    def test_pop_from_empty_queue(self):
+        self.assertIsNone(self.queue.pop(self.dest))
+
+    def test_refill_up_to_size(self):
+        self.assertEqual(self.queue.refill(self.fetch), 2)
+        self.assertEqual(self.queue.refill(self.fetch), 0)
+
+        self.assertEqual(sorted(os.listdir(self.queue_dir)), ['1.jpg', '2.jpg'])
+        self.assertEqual(self.db.count_prefetched(), 2)
+
+    def test_pop_moves_oldest_image_to_dest(self):
+        self.queue.refill(self.fetch)
+
+        url, path = self.queue.pop(self.dest)
+
+        self.assertEqual(url, 'http://mock/1.jpg')
+        self.assertEqual(path, os.path.join(self.dest, '1.jpg'))
+        self.assertTrue(os.path.isfile(path))
+        self.assertEqual(os.listdir(self.queue_dir), ['2.jpg'])
+
+    def test_pop_skips_and_forgets_missing_files(self):
+        self.queue.refill(self.fetch)
+        os.remove(os.path.join(self.queue_dir, '1.jpg'))
+
+        url, _ = self.queue.pop(self.dest)
+
+        self.assertEqual(url, 'http://mock/2.jpg')
+        self.assertEqual(self.db.filter_new(['http://mock/1.jpg']), ['http://mock/1.jpg'])
+
+    def test_pop_claims_image(self):
+        self.queue.refill(self.fetch)
+
+        url, path = self.queue.pop(self.dest)
+        self.assertEqual(self.db.count_by_state(), {'picked': 1, 'prefetched': 1})
+
+        self.db.mark_shown(url, path)
+        self.assertEqual(self.db.count_by_state(), {'shown': 1, 'prefetched': 1})
+
+    def test_pop_leaves_image_taken_by_other_run(self):
+        self.queue.refill(self.fetch)
+        first = self.db.next_prefetched()
+        self.assertTrue(self.db.claim_prefetched(first[0]))
+
+        # The other run claimed the row this run is about to pop.
+        with mock.patch.object(
+            self.db, 'next_prefetched', side_effect=[first, self.db.next_prefetched()]
+        ):
+            url, _ = self.queue.pop(self.dest)
+
+        self.assertEqual(url, 'http://mock/2.jpg')
+        self.assertEqual(self.db.count_by_state(), {'picked': 2})
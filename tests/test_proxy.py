@@ -0,0 +1,265 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import os
+import socketserver
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock as mock
+import requests
+from proxy import CacheProxy, CacheProxyServer, proxied_url, upstream_url
+from wikiwall import make_session
+
+IMAGE = bytes(range(256)) * 1024
+
+
+class Upstream(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), UpstreamHandler)
+        self.hits = Counter()
+        self.lock = threading.Lock()
+        # Cleared to hold image bodies after their first bytes.
+        self.flowing = threading.Event()
+        self.flowing.set()
+
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.hits[self.path] += 1
+
+        if self.path == '/img.jpg':
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(IMAGE)))
+            self.end_headers()
+            self.wfile.write(IMAGE[:1024])
+            self.wfile.flush()
+            self.server.flowing.wait(5)
+            self.wfile.write(IMAGE[1024:])
+        elif self.path == '/stream':
+            # No Content-Length: the body ends when the connection closes.
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.end_headers()
+            self.wfile.write(IMAGE[:1024])
+            self.wfile.flush()
+            self.server.flowing.wait(5)
+            self.wfile.write(IMAGE[1024:])
+        elif self.path == '/feed':
+            body = b'{"Paintings": []}'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_error(404)
+
+
+def serve(server):
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    return server
+
+
+class UrlTest(unittest.TestCase):
+    def test_round_trip(self):
+        url = 'https://uploads0.wikiart.org/images/a/b.jpg?x=1'
+        path = proxied_url('http://cache:8765/', url)
+        self.assertEqual(path, 'http://cache:8765/https/uploads0.wikiart.org/images/a/b.jpg?x=1')
+        self.assertEqual(upstream_url(path[len('http://cache:8765'):]), url)
+
+    def test_bad_paths(self):
+        for path in ('/', '/ftp/host/x', '/https/'):
+            with self.assertRaises(ValueError):
+                upstream_url(path)
+
+    def test_allowed_hosts(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            proxy = CacheProxy(tempdir, None, hosts=('wikiart.org',))
+        self.assertTrue(proxy.is_allowed('https://uploads4.wikiart.org/x.jpg'))
+        self.assertTrue(proxy.is_allowed('https://WikiArt.org/x'))
+        self.assertFalse(proxy.is_allowed('https://evilwikiart.org/x'))
+        self.assertFalse(proxy.is_allowed('http://localhost/x'))
+
+
+class CacheProxyTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+        self.upstream = serve(Upstream())
+        self.addCleanup(self.upstream.server_close)
+        self.addCleanup(self.upstream.shutdown)
+        self.base = 'http://127.0.0.1:%s' % self.upstream.server_address[1]
+
+        self.proxy = CacheProxy(
+            os.path.join(self.tempdir.name, 'proxy'), make_session(), hosts=('127.0.0.1',)
+        )
+        self.server = serve(CacheProxyServer(('127.0.0.1', 0), self.proxy))
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.proxy_url = 'http://127.0.0.1:%s' % self.server.server_address[1]
+
+        self.client = make_session(cache_proxy=self.proxy_url)
+        self.addCleanup(self.client.close)
+
+    def wait_idle(self):
+        """Wait for fetches in progress to be cached. """
+        for _ in range(500):
+            if not self.proxy._fills:
+                return
+            threading.Event().wait(0.01)
+        self.fail('Fetch never finished.')
+
+    def test_miss_then_hit(self):
+        for _ in range(3):
+            r = self.client.get(self.base + '/img.jpg')
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.content, IMAGE)
+            self.assertEqual(r.headers['Content-Type'], 'image/jpeg')
+            self.wait_idle()
+
+        self.assertEqual(self.upstream.hits['/img.jpg'], 1)
+        self.assertIsNotNone(self.proxy.lookup(self.base + '/img.jpg', now=time.time() + 1e9))
+        self.assertIn('immutable', r.headers['Cache-Control'])
+
+    def test_concurrent_misses_are_coalesced(self):
+        self.upstream.flowing.clear()
+
+        def get(_):
+            with requests.Session() as session:
+                return session.get(proxied_url(self.proxy_url, self.base + '/img.jpg')).content
+
+        with ThreadPoolExecutor(8) as pool:
+            bodies = pool.map(get, range(8))
+            threading.Event().wait(0.2)
+            self.upstream.flowing.set()
+            bodies = list(bodies)
+
+        self.assertEqual(bodies, [IMAGE] * 8)
+        self.assertEqual(self.upstream.hits['/img.jpg'], 1)
+
+    def test_range_while_filling_and_cached(self):
+        self.upstream.flowing.clear()
+        headers = {'Range': 'bytes=2000-2999'}
+
+        with ThreadPoolExecutor(1) as pool:
+            part = pool.submit(self.client.get, self.base + '/img.jpg', headers=headers)
+            threading.Event().wait(0.2)
+            self.upstream.flowing.set()
+            r = part.result()
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(r.headers['Content-Range'], f'bytes 2000-2999/{len(IMAGE)}')
+        self.assertEqual(r.content, IMAGE[2000:3000])
+        self.wait_idle()
+
+        r = self.client.get(self.base + '/img.jpg', headers={'Range': 'bytes=-10'})
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(r.content, IMAGE[-10:])
+
+        r = self.client.get(self.base + '/img.jpg', headers={'Range': f'bytes={len(IMAGE)}-'})
+        self.assertEqual(r.status_code, 416)
+        self.assertEqual(self.upstream.hits['/img.jpg'], 1)
+
+    def test_range_while_filling_unknown_size(self):
+        self.upstream.flowing.clear()
+
+        with ThreadPoolExecutor(1) as pool:
+            part = pool.submit(
+                self.client.get, self.base + '/stream', headers={'Range': 'bytes=-10'}
+            )
+            threading.Event().wait(0.2)
+            self.assertFalse(part.done())
+            self.upstream.flowing.set()
+            r = part.result()
+
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(
+            r.headers['Content-Range'], f'bytes {len(IMAGE) - 10}-{len(IMAGE) - 1}/{len(IMAGE)}'
+        )
+        self.assertEqual(r.content, IMAGE[-10:])
+
+    def test_head(self):
+        r = self.client.head(self.base + '/img.jpg')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(int(r.headers['Content-Length']), len(IMAGE))
+        self.assertEqual(r.headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(r.content, b'')
+
+    def test_feed_expires(self):
+        r = self.client.get(self.base + '/feed')
+        self.assertEqual(r.json(), {'Paintings': []})
+        self.wait_idle()
+
+        etag = self.client.get(self.base + '/feed').headers['ETag']
+        r = self.client.get(self.base + '/feed', headers={'If-None-Match': etag})
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(self.upstream.hits['/feed'], 1)
+
+        later = time.time() + self.proxy.ttl
+        self.assertIsNone(self.proxy.lookup(self.base + '/feed', now=later))
+
+    def test_errors_are_passed_on_uncached(self):
+        for _ in range(2):
+            r = self.client.get(self.base + '/missing')
+            self.assertEqual(r.status_code, 404)
+            self.wait_idle()
+        self.assertEqual(self.upstream.hits['/missing'], 2)
+        self.assertEqual(
+            [name for name in os.listdir(self.proxy.path) if not name.endswith('.json')], []
+        )
+
+    def test_refuses_other_hosts(self):
+        r = requests.get(self.proxy_url + '/https/example.com/x.jpg')
+        self.assertEqual(r.status_code, 403)
+        r = requests.get(self.proxy_url + '/nothing')
+        self.assertEqual(r.status_code, 400)
+
+    def test_trim(self):
+        self.client.get(self.base + '/feed')
+        self.wait_idle()
+        self.client.get(self.base + '/img.jpg')
+        self.wait_idle()
+
+        self.assertEqual(self.proxy.trim(len(IMAGE)), 1)
+        self.client.get(self.base + '/feed')
+        self.assertEqual(self.upstream.hits['/feed'], 2)
+        self.client.get(self.base + '/img.jpg')
+        self.assertEqual(self.upstream.hits['/img.jpg'], 1)
+
+    def test_trimmed_only_over_limit(self):
+        self.proxy.max_bytes = len(IMAGE)
+        with mock.patch.object(self.proxy, 'trim', wraps=self.proxy.trim) as trim:
+            self.client.get(self.base + '/img.jpg')
+            self.wait_idle()
+            trim.assert_not_called()
+
+            feed = self.client.get(self.base + '/feed').content
+            # Trimming follows the end of the fetch.
+            for _ in range(500):
+                if trim.called and self.proxy._size <= len(IMAGE):
+                    break
+                threading.Event().wait(0.01)
+            trim.assert_called_once_with(len(IMAGE))
+
+        self.assertEqual(self.proxy._size, len(feed))
+
+    def test_size_counted_on_start(self):
+        self.client.get(self.base + '/img.jpg')
+        self.wait_idle()
+
+        proxy = CacheProxy(self.proxy.path, None, max_bytes=1)
+        self.assertEqual(proxy._size, len(IMAGE))
+
+
+if __name__ == '__main__':
+    unittest.main()
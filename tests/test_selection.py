@@ -0,0 +1,140 @@
+import os.path
+import random
+import tempfile
+import unittest
+import unittest.mock as mock
+from db import DownloadDatabase
+from selection import WEIGHTS, Selector, weighted_sample
+
+
+def painting(n, artist=None, **fields):
+    return dict(fields, image=f'http://mock/{n}.jpg', artistName=artist)
+
+
+class WeightedSampleTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(1)
+
+    def test_all_items_if_fewer_than_k(self):
+        self.assertCountEqual(weighted_sample(iter('abc'), 5, rng=self.rng), 'abc')
+
+    def test_k_below_one(self):
+        self.assertEqual(weighted_sample('abc', 0, rng=self.rng), [])
+
+    def test_items_without_weight_never_picked(self):
+        picks = weighted_sample(range(10), 5, weight=lambda i: i % 2, rng=self.rng)
+        self.assertCountEqual(picks, [1, 3, 5, 7, 9])
+
+    def test_picks_follow_weights(self):
+        # Items 100 to 199 hold 75% of the total weight.
+        weight = lambda i: i + 1  # noqa: E731
+        trials = 4000
+
+        heavy = sum(
+            weighted_sample(range(200), weight=weight, rng=self.rng)[0] >= 100
+            for _ in range(trials)
+        )
+
+        self.assertAlmostEqual(heavy / trials, 15050 / 20100, delta=0.03)
+
+    def test_long_stream_draws_few_random_numbers(self):
+        rng = mock.Mock(wraps=self.rng)
+
+        weighted_sample(range(100000), 10, rng=rng)
+
+        self.assertLess(rng.random.call_count, 1000)
+
+    def test_one_item_per_stratum(self):
+        items = [(artist, n) for artist in 'abcd' for n in range(20)]
+
+        picks = weighted_sample(items, 10, stratum=lambda item: item[0], rng=self.rng)
+
+        self.assertCountEqual([artist for artist, _ in picks], 'abcd')
+
+    def test_none_stratum_not_limited(self):
+        picks = weighted_sample(range(5), 5, stratum=lambda item: None, rng=self.rng)
+        self.assertCountEqual(picks, range(5))
+
+
+class WeightsTest(unittest.TestCase):
+    def test_size(self):
+        self.assertEqual(WEIGHTS['size'](painting(1, width=20, height='30')), 600)
+        self.assertEqual(WEIGHTS['size'](painting(1, width='')), 1)
+
+    def test_old_and_new_double_per_century(self):
+        self.assertAlmostEqual(WEIGHTS['old'](painting(1, year='c.1800')), 4)
+        self.assertAlmostEqual(WEIGHTS['new'](painting(1, year='1900')), 0.5)
+        self.assertEqual(WEIGHTS['old'](painting(1, year=None)), 1)
+
+
+class SelectorTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+        self.db = DownloadDatabase(os.path.join(self.tempdir.name, 'test.db')).__enter__()
+        self.addCleanup(self.db.__exit__, None, None, None)
+
+        self.pages = {
+            1: [painting(1, 'Monet'), painting(2, 'Monet')],
+            2: [painting(3, 'Degas'), painting(4, 'Monet')],
+            3: [painting(5, 'Manet')],
+            4: [],
+        }
+        self.mock_catalog = mock.Mock(
+            iter_paintings=mock.Mock(
+                side_effect=lambda start, workers: iter(sorted(self.pages.items()))
+            )
+        )
+
+    def test_unknown_weight(self):
+        with self.assertRaises(ValueError):
+            Selector('heavy')
+
+    def test_first_page_with_unseen_images(self):
+        self.db.add('http://mock/1.jpg')
+
+        urls = Selector().pick(self.mock_catalog, self.db)
+
+        self.assertEqual(urls, ['http://mock/2.jpg'])
+
+    def test_picks_stored(self):
+        urls = Selector().pick(self.mock_catalog, self.db)
+
+        self.assertEqual(self.db.painting(urls[0])['artistName'], 'Monet')
+
+    def test_several_pages(self):
+        urls = Selector(pages=2).pick(self.mock_catalog, self.db, k=10)
+
+        self.assertCountEqual(urls, [f'http://mock/{n}.jpg' for n in range(1, 5)])
+
+    def test_recent_artists_skipped(self):
+        self.db.add_paintings([painting(0, 'Monet')])
+        self.db.add('http://mock/0.jpg')
+
+        urls = Selector(artist_gap=1).pick(self.mock_catalog, self.db)
+
+        self.assertEqual(urls, ['http://mock/3.jpg'])
+        self.db.add(urls[0])
+        self.assertEqual(self.db.recent_artists(1), ['Degas'])
+
+    def test_recent_artists_picked_if_nothing_else_left(self):
+        self.pages = {1: [painting(1, 'Monet')], 2: []}
+        self.db.add_paintings([painting(0, 'Monet')])
+        self.db.add('http://mock/0.jpg')
+
+        urls = Selector(artist_gap=1).pick(self.mock_catalog, self.db)
+
+        self.assertEqual(urls, ['http://mock/1.jpg'])
+
+    def test_different_artists_picked_together(self):
+        urls = Selector(artist_gap=1, pages=2).pick(self.mock_catalog, self.db, k=3)
+
+        self.assertEqual(len(urls), 2)
+        self.assertIn('http://mock/3.jpg', urls)
+
+    def test_empty_page_raises(self):
+        self.pages = {1: []}
+
+        with self.assertRaises(ValueError):
+            Selector().pick(self.mock_catalog, self.db)
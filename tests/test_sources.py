@@ -0,0 +1,226 @@
+import json
+import os
+import os.path
+import tempfile
+import unittest
+import unittest.mock as mock
+import urllib.request
+import requests
+from catalog import Catalog
+from db import DownloadDatabase
+from sources import (
+    DirectorySource,
+    ManifestSource,
+    WikiartSource,
+    catalog_path,
+    open_source,
+    parse_source,
+)
+from utils import SRC_URL
+import wikiwall
+
+
+def file_url(path):
+    return 'file://' + urllib.request.pathname2url(os.path.abspath(path))
+
+
+class OpenSourceTest(unittest.TestCase):
+    def test_parse_source(self):
+        self.assertEqual(parse_source('wikiart'), ('wikiart', None))
+        self.assertEqual(parse_source('dir:/a:b'), ('dir', '/a:b'))
+        with self.assertRaises(ValueError):
+            parse_source('ftp:/a')
+
+    def test_default_wikiart_feed(self):
+        source = open_source('wikiart')
+        self.assertIsInstance(source, WikiartSource)
+        self.assertEqual(source.argument, SRC_URL)
+
+    def test_wikiart_mirror_needs_page_placeholder(self):
+        with self.assertRaises(ValueError):
+            open_source('wikiart:http://mirror/feed.json')
+
+    def test_missing_directory(self):
+        with self.assertRaises(ValueError):
+            open_source('dir:/no/such/dir')
+
+    def test_missing_manifest(self):
+        with self.assertRaises(ValueError):
+            open_source('manifest:/no/such/manifest.jsonl')
+        with self.assertRaises(ValueError):
+            open_source('manifest:http:///manifest.jsonl')
+
+    def test_catalog_path_per_source(self):
+        self.assertEqual(catalog_path('/d', 'wikiart'), os.path.join('/d', 'catalog'))
+        self.assertNotEqual(catalog_path('/d', 'dir:/a'), catalog_path('/d', 'dir:/b'))
+        self.assertTrue(catalog_path('/d', 'dir:/a').startswith(os.path.join('/d', 'catalog')))
+
+    def test_wikiart_pages_scraped(self):
+        session, cache = mock.Mock(), mock.Mock()
+        source = WikiartSource('http://mirror/?page={}', session, cache)
+
+        with mock.patch('wikiwall.scrape_paintings', return_value=iter([{'image': 'a'}])) as scrape:
+            self.assertEqual(source.paintings(3), [{'image': 'a'}])
+
+        scrape.assert_called_once_with('http://mirror/?page=3', session, cache)
+
+
+class DirectorySourceTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.path = self.tempdir.name
+
+        for name in ('b.jpg', 'a.PNG', 'notes.txt', 'Monet/water.jpeg'):
+            path = os.path.join(self.path, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(name.encode())
+
+    def test_images_paged_in_path_order(self):
+        source = DirectorySource(self.path, page_size=2)
+
+        self.assertEqual(
+            [p['image'] for p in source.paintings(1)],
+            [file_url(os.path.join(self.path, name)) for name in ('Monet/water.jpeg', 'a.PNG')],
+        )
+        self.assertEqual(len(source.paintings(2)), 1)
+        self.assertEqual(source.paintings(3), [])
+
+    def test_records_shaped_like_paintings(self):
+        first = DirectorySource(self.path).paintings(1)[0]
+
+        self.assertEqual(first['title'], 'water')
+        self.assertEqual(first['artistName'], 'Monet')
+        self.assertEqual(first['id'], os.path.join('Monet', 'water.jpeg'))
+
+    def test_new_files_seen_from_first_page(self):
+        source = DirectorySource(self.path, page_size=1)
+        source.paintings(1)
+        with open(os.path.join(self.path, 'c.jpg'), 'wb'):
+            pass
+
+        self.assertEqual(source.paintings(4), [])
+        self.assertEqual(len(source.paintings(1)), 1)
+        self.assertEqual(len(source.paintings(4)), 1)
+
+
+class ManifestSourceTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+        self.records = [
+            {'image': 'images/1.jpg', 'title': 'One', 'artistName': 'Monet'},
+            {'image': 'http://elsewhere/2.jpg'},
+            {'image': '/abs/3.jpg'},
+        ]
+        self.lines = [json.dumps(r) for r in self.records[:2]]
+        self.lines += ['', 'not json', '{"title": "no image"}', json.dumps(self.records[2])]
+
+        self.path = os.path.join(self.tempdir.name, 'manifest.jsonl')
+        with open(self.path, 'w') as f:
+            f.write('\n'.join(self.lines) + '\n')
+
+    def test_records_paged_and_images_resolved(self):
+        source = ManifestSource(self.path, page_size=2)
+
+        with self.assertLogs('sources', 'WARNING'):
+            page1 = source.paintings(1)
+            page2 = source.paintings(2)
+
+        self.assertEqual(
+            [p['image'] for p in page1],
+            [file_url(os.path.join(self.tempdir.name, 'images/1.jpg')), 'http://elsewhere/2.jpg'],
+        )
+        self.assertEqual(page1[0]['title'], 'One')
+        self.assertEqual([p['image'] for p in page2], ['file:///abs/3.jpg'])
+        self.assertEqual(source.paintings(3), [])
+
+    def test_manifest_read_once_per_walk(self):
+        source = ManifestSource(self.path, page_size=1)
+
+        with mock.patch.object(source, '_lines', wraps=source._lines) as lines:
+            with self.assertLogs('sources', 'WARNING'):
+                for page in (1, 2, 3, 4):
+                    source.paintings(page)
+            self.assertEqual(lines.call_count, 1)
+
+            with self.assertLogs('sources', 'WARNING'):
+                source.paintings(1)
+            self.assertEqual(lines.call_count, 2)
+
+    def test_manifest_at_url(self):
+        body = '\n'.join(self.lines).encode()
+        resp = mock.Mock(spec=requests.models.Response)
+        resp.iter_content.side_effect = lambda chunk_size: (
+            body[i:i + 5] for i in range(0, len(body), 5)
+        )
+        session = mock.Mock(get=mock.Mock(return_value=resp))
+
+        source = ManifestSource('http://mirror/art/manifest.jsonl', session=session)
+        with self.assertLogs('sources', 'WARNING'):
+            paintings = source.paintings(1)
+
+        self.assertEqual(
+            [p['image'] for p in paintings],
+            ['http://mirror/art/images/1.jpg', 'http://elsewhere/2.jpg', 'http://mirror/abs/3.jpg'],
+        )
+        session.get.assert_called_once_with('http://mirror/art/manifest.jsonl', stream=True)
+        resp.close.assert_called_once_with()
+
+    def test_manifest_at_url_cached(self):
+        cache = mock.Mock(fetch=mock.Mock(return_value=(c for c in [b'{"image": "1.jpg"}'])))
+        session = mock.Mock()
+
+        source = ManifestSource('http://mirror/m.jsonl', session=session, cache=cache)
+
+        self.assertEqual(source.paintings(1), [{'image': 'http://mirror/1.jpg'}])
+        cache.fetch.assert_called_once_with(session, 'http://mirror/m.jsonl', mock.ANY)
+
+
+class OfflineSourceTest(unittest.TestCase):
+    """Pick and download from a directory without any network access. """
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+        self.mirror = os.path.join(self.tempdir.name, 'mirror')
+        os.makedirs(os.path.join(self.mirror, 'Degas'))
+        for n in range(3):
+            with open(os.path.join(self.mirror, 'Degas', f'{n}.jpg'), 'wb') as f:
+                f.write(bytes([n]) * (1000 + n))
+
+        self.dest = os.path.join(self.tempdir.name, 'dest')
+
+        self.db = DownloadDatabase(os.path.join(self.tempdir.name, 'test.db')).__enter__()
+        self.addCleanup(self.db.__exit__, None, None, None)
+
+        self.session = wikiwall.make_session()
+        self.addCleanup(self.session.close)
+
+    def test_fetch_new_image_from_directory(self):
+        catalog = Catalog(
+            fetch=open_source('dir:' + self.mirror).paintings,
+            path=os.path.join(self.tempdir.name, 'catalog'),
+        )
+
+        with mock.patch('builtins.print'):
+            url, path = wikiwall._fetch_new_image(
+                catalog, self.db, self.session, self.dest, 1, 1
+            )
+
+        n = int(os.path.basename(url)[0])
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), bytes([n]) * (1000 + n))
+        self.assertEqual(os.path.dirname(path), self.dest)
+
+    def test_segmented_download_of_local_file(self):
+        url = file_url(os.path.join(self.mirror, 'Degas', '2.jpg'))
+
+        with mock.patch('wikiwall.SEGMENT_MIN_SIZE', 100), mock.patch('builtins.print'):
+            path = wikiwall.store_img(url, self.dest, self.db, self.session, segments=4)
+
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), bytes([2]) * 1002)
@@ -0,0 +1,116 @@
+import os
+import os.path
+import subprocess
+import sys
+import tempfile
+import unittest
+
+# Max seconds of imports for a cold `wikiwall --help` or `wikiwall show`.
+IMPORT_BUDGET = 0.15
+
+# Modules only fetching and saving images need.
+HEAVY_MODULES = (
+    'requests',
+    'urllib3',
+    'tqdm',
+    'sqlite3',
+    'catalog',
+    'daemon',
+    'db',
+    'engine',
+    'eviction',
+    'fileadapter',
+    'httpcache',
+    'jsonstream',
+    'locks',
+    'phash',
+    'prefetch',
+    'proxy',
+    'selection',
+    'sources',
+    'store',
+)
+
+# Runs the cli like the console script would, with osascript stubbed out,
+# then prints modules loaded after the marker line.
+DRIVER = '''
+import sys
+sys.stderr.write('-- start\\n')
+import subprocess
+subprocess.run = lambda *args, **kwargs: None
+from wikiwall import cli
+try:
+    cli(sys.argv[1:], obj={{}})
+except SystemExit:
+    pass
+print('loaded:' + ','.join(m for m in {modules!r} if m in sys.modules))
+'''
+
+
+def import_time(stderr):
+    """Return seconds spent on top-level imports after the marker line. """
+    lines = stderr.split('-- start\n', 1)[1].splitlines()
+
+    total = 0
+    for line in lines:
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line.split('|')
+        if not name.startswith('  ') and cumulative.strip().isdigit():
+            total += int(cumulative)
+
+    return total / 1e6
+
+
+class StartupTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+        self.env = dict(os.environ, XDG_DATA_HOME=self.tempdir.name)
+        self.cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def run_cli(self, *args):
+        """Run cli in a fresh interpreter.
+
+        Returns:
+            Tuple of seconds spent importing and list of heavy modules
+            that were loaded. Best of three runs.
+
+        """
+        command = [sys.executable, '-X', 'importtime', '-c', DRIVER.format(modules=HEAVY_MODULES)]
+
+        best = None
+        for _ in range(3):
+            result = subprocess.run(
+                command + list(args),
+                cwd=self.cwd,
+                env=self.env,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+                check=True,
+            )
+            seconds = import_time(result.stderr)
+            if best is None or seconds < best:
+                best = seconds
+            loaded = result.stdout.rsplit('loaded:', 1)[1].strip()
+            loaded = [m for m in loaded.split(',') if m]
+
+        return best, loaded
+
+    def test_help_skips_heavy_modules(self):
+        _, loaded = self.run_cli('--help')
+        self.assertEqual(loaded, [])
+
+    def test_show_skips_heavy_modules(self):
+        _, loaded = self.run_cli('show')
+        self.assertEqual(loaded, [])
+
+    def test_help_within_budget(self):
+        seconds, _ = self.run_cli('--help')
+        self.assertLess(seconds, IMPORT_BUDGET)
+
+    def test_show_within_budget(self):
+        seconds, _ = self.run_cli('show')
+        self.assertLess(seconds, IMPORT_BUDGET)
@@ -0,0 +1,107 @@
+import hashlib
+import os
+import os.path
+import tempfile
+import unittest
+import unittest.mock as mock
+from store import BlockHasher, ContentStore, content_digest, extension
+
+
+def digest(data):
+    hasher = BlockHasher()
+    hasher.update(data)
+    return content_digest([hasher], len(data))
+
+
+class ContentDigestTest(unittest.TestCase):
+    def setUp(self):
+        self.patcher_block = mock.patch('store.HASH_BLOCK_SIZE', 8)
+        self.patcher_block.start()
+
+        self.data = bytes(range(30))
+
+    def tearDown(self):
+        self.patcher_block.stop()
+
+    def test_hash_of_block_hashes(self):
+        blocks = [self.data[i:i + 8] for i in range(0, 30, 8)]
+        expected = hashlib.sha256(
+            b''.join(hashlib.sha256(block).digest() for block in blocks)
+        ).hexdigest()
+
+        self.assertEqual(digest(self.data), expected)
+
+    def test_same_digest_for_any_chunking(self):
+        hasher = BlockHasher()
+        for i in range(0, 30, 3):
+            hasher.update(self.data[i:i + 3])
+
+        self.assertEqual(content_digest([hasher], 30), digest(self.data))
+
+    def test_same_digest_for_runs_out_of_order(self):
+        hashers = []
+        for start, end in [(19, 30), (0, 5), (5, 19)]:
+            hasher = BlockHasher(start)
+            hasher.update(self.data[start:end])
+            hashers.append(hasher)
+
+        self.assertEqual(content_digest(hashers, 30), digest(self.data))
+
+    def test_different_content_different_digest(self):
+        self.assertNotEqual(digest(self.data), digest(self.data[:-1] + b'x'))
+
+    def test_missing_bytes_raise(self):
+        hasher = BlockHasher()
+        hasher.update(self.data[:20])
+
+        with self.assertRaises(ValueError):
+            content_digest([hasher], 30)
+
+    def test_empty_file(self):
+        self.assertEqual(digest(b''), hashlib.sha256(b'').hexdigest())
+
+
+class ContentStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+        self.store = ContentStore(os.path.join(self.tempdir.name, 'store'))
+
+    def write_part(self, data=b'abc'):
+        part = os.path.join(self.store.path, 'x.part')
+        with open(part, 'wb') as f:
+            f.write(data)
+        return part
+
+    def test_put_names_file_by_digest(self):
+        path = self.store.put(self.write_part(), 'abc', '.png')
+
+        self.assertEqual(path, os.path.join(self.store.path, 'abc.png'))
+        self.assertEqual(self.store.find('abc', '.png'), path)
+        self.assertEqual(os.listdir(self.store.path), ['abc.png'])
+
+    def test_known_content_stored_once(self):
+        self.store.put(self.write_part(b'abc'), 'abc')
+        path = self.store.put(self.write_part(b'abc'), 'abc')
+
+        self.assertEqual(os.listdir(self.store.path), ['abc.jpg'])
+        self.assertEqual(path, self.store.path_for('abc'))
+
+    def test_find_missing(self):
+        self.assertIsNone(self.store.find('abc'))
+
+    def test_part_file_shared_by_url_variants(self):
+        self.assertEqual(
+            self.store.part_for('http://mock/a.jpg?w=1'), self.store.part_for('http://mock/a.jpg')
+        )
+        self.assertNotEqual(
+            self.store.part_for('http://mock/a.jpg'), self.store.part_for('http://mock/b.jpg')
+        )
+
+    def test_extension(self):
+        self.assertEqual(extension('http://mock/a.JPG?w=1'), '.jpg')
+        self.assertEqual(extension('http://mock/a.png'), '.png')
+        self.assertEqual(extension('http://mock/a'), '.jpg')
+        self.assertEqual(extension('http://mock/a.Webp'), '.webp')
+        self.assertEqual(extension('http://mock/a.jpg!Large.php'), '.jpg')
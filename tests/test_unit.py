@@ -1,18 +1,31 @@
+import io
+import itertools
+from json import dumps as json_dumps
 import os
 import os.path
 import requests
 from requests.exceptions import HTTPError, InvalidURL, MissingSchema
+import subprocess
 import tempfile
 import unittest
 import unittest.mock as mock
+from catalog import Catalog
+from db import DownloadDatabase
+from store import ContentStore
 import wikiwall
 from wikiwall import (
     config_logger,
     data_dir,
     _clean_dls,
+    _find_new_urls,
     _run_appscript,
     download_img,
+    download_to_store,
+    store_img,
     get_random,
+    get_session,
+    make_session,
+    scrape_paintings,
     scrape_urls,
 )
 
@@ -108,13 +121,54 @@ class GetRandomTest(unittest.TestCase):
         )
 
 
+class SessionTest(unittest.TestCase):
+    def setUp(self):
+        self.patcher_session = mock.patch('wikiwall._session', None)
+        self.patcher_session.start()
+
+    def tearDown(self):
+        self.patcher_session.stop()
+
+    def test_shared_session_created_once(self):
+        self.assertIs(get_session(), get_session())
+
+    def test_pool_size_and_retries_set_on_adapters(self):
+        session = make_session(pool_size=7, retries=2, backoff=0.1)
+
+        for prefix in ('http://', 'https://'):
+            adapter = session.get_adapter(prefix + 'www.wikiart.org')
+            self.assertEqual(adapter._pool_maxsize, 7)
+            self.assertEqual(adapter.max_retries.total, 2)
+            self.assertEqual(adapter.max_retries.backoff_factor, 0.1)
+
+    def test_cache_proxy_adapter_mounted(self):
+        from proxy import CacheProxyAdapter
+
+        session = make_session(pool_size=7, cache_proxy='http://cache:8765')
+
+        for prefix in ('http://', 'https://'):
+            adapter = session.get_adapter(prefix + 'www.wikiart.org')
+            self.assertIsInstance(adapter, CacheProxyAdapter)
+            self.assertEqual(adapter._pool_maxsize, 7)
+
+    def test_accepted_encodings_match_urllib3(self):
+        from urllib3.util.request import ACCEPT_ENCODING
+
+        self.assertEqual(make_session().headers['Accept-Encoding'], ACCEPT_ENCODING)
+
+
 class ScrapeUrlsTest(unittest.TestCase):
     def setUp(self):
-        self.patcher_get = mock.patch('wikiwall.requests.get', autospec=True)
-        self.mock_get = self.patcher_get.start()
+        self.mock_session = mock.Mock(spec=requests.Session)
+        self.mock_get = self.mock_session.get
+
+        self.patcher_session = mock.patch(
+            'wikiwall.get_session', return_value=self.mock_session
+        )
+        self.patcher_session.start()
 
     def tearDown(self):
-        self.patcher_get.stop()
+        self.patcher_session.stop()
 
     def get_resp(
         self,
@@ -128,6 +182,10 @@ class ScrapeUrlsTest(unittest.TestCase):
         mock_resp.status_code = status_code
         mock_resp.headers = headers
         mock_resp.json.return_value = json
+        body = json_dumps(json).encode()
+        mock_resp.iter_content.side_effect = lambda chunk_size=1: (
+            body[i:i + chunk_size] for i in range(0, len(body), chunk_size)
+        )
 
         # mock raise_for_status call w/optional error
         if raise_for_status:
@@ -197,11 +255,84 @@ class ScrapeUrlsTest(unittest.TestCase):
         urls = scrape_urls(src)
         self.assertEqual([*urls], ['', ''])
 
+    def test_scrape_paintings_yields_records(self):
+        src_data = {'Paintings': [{'id': '1', 'image': 'image1.jpg'}]}
+        self.mock_get.return_value = self.get_resp(json=src_data)
+
+        self.assertEqual(list(scrape_paintings('http://mock')), src_data['Paintings'])
+
+    def test_scrape_paintings_yields_nothing_without_Paintings(self):
+        self.mock_get.return_value = self.get_resp(json={'Pine': []})
+
+        self.assertEqual(list(scrape_paintings('http://mock')), [])
+
+    def test_null_Paintings_treated_as_missing(self):
+        self.mock_get.return_value = self.get_resp(json={'Paintings': None})
+
+        self.assertEqual(list(scrape_urls('http://mock')), [''])
+
+    def test_paintings_parsed_from_small_chunks(self):
+        src_data = {
+            'PageSize': 2,
+            'Paintings': [{'id': n, 'image': f'{n}.jpg', 'title': 'Žena ü'} for n in range(50)],
+        }
+        self.mock_get.return_value = self.get_resp(json=src_data)
+
+        with mock.patch('wikiwall.JSON_CHUNK_SIZE', 7):
+            paintings = list(scrape_paintings('http://mock'))
+
+        self.assertEqual(paintings, src_data['Paintings'])
+
+    def test_first_painting_yielded_before_body_is_read(self):
+        resp = self.get_resp()
+        chunks = [b'{"Paintings": [{"image": "1.jpg"}, ', b'{"image": "2.jpg"}]}']
+        read = []
+        resp.iter_content.side_effect = lambda chunk_size: (
+            read.append(chunk) or chunk for chunk in chunks
+        )
+        self.mock_get.return_value = resp
+
+        urls = scrape_urls('http://mock')
+
+        self.assertEqual(next(urls), '1.jpg')
+        self.assertEqual(len(read), 1)
+        self.assertEqual(list(urls), ['2.jpg'])
+        resp.close.assert_called_once_with()
+
+    def test_cache_used_if_given(self):
+        body = b'{"Paintings": [{"image": "1.jpg"}]}'
+        mock_cache = mock.Mock(fetch=mock.Mock(return_value=(chunk for chunk in [body])))
+
+        urls = list(scrape_urls('http://mock', cache=mock_cache))
+
+        self.assertEqual(urls, ['1.jpg'])
+        mock_cache.fetch.assert_called_once_with(self.mock_session, 'http://mock', mock.ANY)
+        self.mock_get.assert_not_called()
+
+    def test_injected_session_used(self):
+        other_session = mock.Mock(spec=requests.Session)
+        other_session.get.return_value = self.get_resp(json={'Paintings': []})
+
+        list(scrape_urls('http://mock', session=other_session))
+
+        other_session.get.assert_called_once_with('http://mock', stream=True)
+        self.mock_get.assert_not_called()
+
 
 class DownloadImgTest(unittest.TestCase):
     def setUp(self):
-        self.patcher_get = mock.patch('wikiwall.requests.get', autospec=True)
-        self.mock_get = self.patcher_get.start()
+        self.mock_session = mock.MagicMock(spec=requests.Session)
+        self.mock_get = self.mock_session.get
+
+        self.mock_resp = self.mock_get.return_value.__enter__.return_value
+        self.mock_resp.status_code = 200
+        self.mock_resp.headers = {}
+        self.mock_resp.raw = io.BytesIO()
+
+        self.patcher_session = mock.patch(
+            'wikiwall.get_session', return_value=self.mock_session
+        )
+        self.patcher_session.start()
 
         self.patcher_getcwd = mock.patch(
             'wikiwall.os.getcwd', return_value='/home/gah', autospec=True
@@ -214,11 +345,11 @@ class DownloadImgTest(unittest.TestCase):
         # Suppress print and tqdm output
         self.patcher_print = mock.patch('wikiwall.print')
         self.mock_print = self.patcher_print.start()
-        self.patcher_tqdm = mock.patch('wikiwall.tqdm')
+        self.patcher_tqdm = mock.patch('tqdm.tqdm')
         self.mock_tqdm = self.patcher_tqdm.start()
 
     def tearDown(self):
-        self.patcher_get.stop()
+        self.patcher_session.stop()
         self.patcher_getcwd.stop()
         self.patcher_makedirs.stop()
         self.patcher_print.stop()
@@ -258,15 +389,17 @@ class DownloadImgTest(unittest.TestCase):
         with self.assertRaises(TypeError):
             download_img('http://www.google.com', dest=123)
 
+    @mock.patch('wikiwall.os.replace')
     @mock.patch('wikiwall.open', new_callable=mock.mock_open)
-    def test_requests_get_and_open_called_with_valid_url(self, mock_open):
+    def test_requests_get_and_open_called_with_valid_url(self, mock_open, mock_replace):
         download_img('http://www.google.com')
 
-        self.mock_get.assert_called_with('http://www.google.com', stream=True)
+        self.mock_get.assert_called_with('http://www.google.com', stream=True, headers=None)
         mock_open.assert_called()
 
+    @mock.patch('wikiwall.os.replace')
     @mock.patch('wikiwall.open', new_callable=mock.mock_open)
-    def test_path_with_None_value_becomes_the_cwdir(self, mock_open):
+    def test_path_with_None_value_becomes_the_cwdir(self, mock_open, mock_replace):
         url = 'http://www.blah.com/jeezus.jpg'
 
         fullpath = download_img(url=url, dest=None)
@@ -275,8 +408,9 @@ class DownloadImgTest(unittest.TestCase):
         self.mock_makedirs.assert_called_with(self.mock_getcwd.return_value)
         self.assertEqual(dirpath, self.mock_getcwd.return_value)
 
+    @mock.patch('wikiwall.os.replace')
     @mock.patch('wikiwall.open', new_callable=mock.mock_open)
-    def test_correct_file_path_returned_based_on_url_passed_in(self, mock_open):
+    def test_correct_file_path_returned_based_on_url_passed_in(self, mock_open, mock_replace):
         tempdir = tempfile.TemporaryDirectory()
 
         url = 'http://www.blah.com/jeezus.jpg'
@@ -288,17 +422,34 @@ class DownloadImgTest(unittest.TestCase):
 
         tempdir.cleanup()
 
+    @mock.patch('wikiwall.os.replace')
     @mock.patch('wikiwall.open', new_callable=mock.mock_open)
-    def test_write_called_with_valid_url_and_dest(self, mock_open):
+    def test_write_called_with_valid_url_and_dest(self, mock_open, mock_replace):
         tempdir = tempfile.TemporaryDirectory()
 
-        with mock.patch('wikiwall.tqdm', return_value=['chunk']):
-            download_img(url='http://jeezus', dest=tempdir.name)
+        self.mock_resp.raw = io.BytesIO(b'chunk')
+        download_img(url='http://jeezus', dest=tempdir.name)
 
         mock_open.return_value.write.assert_called()
 
         tempdir.cleanup()
 
+    @mock.patch('wikiwall.os.replace')
+    @mock.patch('wikiwall.open', new_callable=mock.mock_open)
+    def test_injected_session_used(self, mock_open, mock_replace):
+        other_session = mock.MagicMock(spec=requests.Session)
+        other_resp = other_session.get.return_value.__enter__.return_value
+        other_resp.status_code = 200
+        other_resp.headers = {}
+        other_resp.raw = io.BytesIO()
+
+        download_img('http://www.google.com', session=other_session)
+
+        other_session.get.assert_called_with(
+            'http://www.google.com', stream=True, headers=None
+        )
+        self.mock_get.assert_not_called()
+
     def test_file_path_of_downloaded_file_is_an_actual_file(self):
         tempdir = tempfile.TemporaryDirectory()
 
@@ -311,6 +462,342 @@ class DownloadImgTest(unittest.TestCase):
         tempdir.cleanup()
 
 
+class DownloadImgResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.url = 'http://www.blah.com/jeezus.jpg'
+        self.path = os.path.join(self.tempdir.name, 'jeezus.jpg')
+        self.part = self.path + '.part'
+
+        self.mock_session = mock.MagicMock(spec=requests.Session)
+        self.mock_get = self.mock_session.get
+
+        # Suppress print and tqdm output
+        self.patcher_print = mock.patch('wikiwall.print')
+        self.patcher_print.start()
+        self.patcher_tqdm = mock.patch('tqdm.tqdm')
+        self.patcher_tqdm.start()
+
+    def tearDown(self):
+        self.patcher_print.stop()
+        self.patcher_tqdm.stop()
+        self.tempdir.cleanup()
+
+    def get_resp(self, status_code=200, body=b'', headers=None):
+        '''Returns a mock streamed Response usable as a context manager.'''
+        mock_resp = mock.MagicMock()
+        mock_resp.__enter__.return_value = mock_resp
+        mock_resp.status_code = status_code
+        mock_resp.headers = (
+            headers if headers is not None else {'content-length': str(len(body))}
+        )
+        mock_resp.raw = io.BytesIO(body)
+        return mock_resp
+
+    def write_part(self, data, validator='"v1"'):
+        with open(self.part, 'wb') as f:
+            f.write(data)
+        if validator is not None:
+            with open(self.part + '.validator', 'w') as f:
+                f.write(validator)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_complete_download_renamed_from_part_file(self):
+        self.mock_get.return_value = self.get_resp(body=b'abcde')
+
+        path = download_img(self.url, self.tempdir.name, self.mock_session)
+
+        self.assertEqual(self.read(path), b'abcde')
+        self.assertFalse(os.path.exists(self.part))
+
+    def test_partial_download_resumed_with_range(self):
+        self.write_part(b'abc')
+        self.mock_get.return_value = self.get_resp(
+            status_code=206,
+            body=b'de',
+            headers={'content-length': '2', 'content-range': 'bytes 3-4/5'},
+        )
+
+        download_img(self.url, self.tempdir.name, self.mock_session)
+
+        self.mock_get.assert_called_with(
+            self.url, stream=True, headers={'Range': 'bytes=3-', 'If-Range': '"v1"'}
+        )
+        self.assertEqual(self.read(self.path), b'abcde')
+        self.assertFalse(os.path.exists(self.part + '.validator'))
+
+    def test_validator_stored_while_downloading(self):
+        self.mock_get.return_value = self.get_resp(
+            body=b'abc', headers={'content-length': '10', 'etag': '"v2"'}
+        )
+
+        with self.assertRaises(IOError):
+            download_img(self.url, self.tempdir.name, self.mock_session)
+
+        self.assertEqual(self.read(self.part + '.validator'), b'"v2"')
+
+    def test_weak_etag_falls_back_to_last_modified(self):
+        self.assertEqual(
+            wikiwall._validator({'etag': 'W/"v1"', 'last-modified': 'Mon, 05 Oct 2026'}),
+            'Mon, 05 Oct 2026',
+        )
+        self.assertIsNone(wikiwall._validator({'etag': 'W/"v1"'}))
+
+    def test_partial_file_without_validator_not_resumed(self):
+        self.write_part(b'abc', validator=None)
+        self.mock_get.return_value = self.get_resp(body=b'vwxyz')
+
+        download_img(self.url, self.tempdir.name, self.mock_session)
+
+        self.mock_get.assert_called_once_with(self.url, stream=True, headers=None)
+        self.assertEqual(self.read(self.path), b'vwxyz')
+
+    def test_wrong_content_range_starts_over(self):
+        self.write_part(b'abc')
+        self.mock_get.side_effect = [
+            self.get_resp(
+                status_code=206,
+                body=b'abcde',
+                headers={'content-length': '5', 'content-range': 'bytes 0-4/5'},
+            ),
+            self.get_resp(body=b'abcde'),
+        ]
+
+        download_img(self.url, self.tempdir.name, self.mock_session)
+
+        self.mock_get.assert_called_with(self.url, stream=True, headers=None)
+        self.assertEqual(self.read(self.path), b'abcde')
+
+    def test_whole_file_written_when_server_ignores_range(self):
+        self.write_part(b'abc')
+        self.mock_get.return_value = self.get_resp(status_code=200, body=b'vwxyz')
+
+        download_img(self.url, self.tempdir.name, self.mock_session)
+
+        self.assertEqual(self.read(self.path), b'vwxyz')
+
+    def test_unsatisfiable_range_starts_over(self):
+        self.write_part(b'abcdefgh')
+        self.mock_get.side_effect = [
+            self.get_resp(status_code=416, headers={}),
+            self.get_resp(body=b'abcde'),
+        ]
+
+        download_img(self.url, self.tempdir.name, self.mock_session)
+
+        self.mock_get.assert_called_with(self.url, stream=True, headers=None)
+        self.assertEqual(self.read(self.path), b'abcde')
+
+    def test_resumed_download_digest_covers_whole_file(self):
+        store = ContentStore(self.tempdir.name)
+        self.mock_get.return_value = self.get_resp(body=b'abcde')
+        _, full = download_to_store(self.url, store, self.mock_session)
+
+        with open(store.part_for(self.url), 'wb') as f:
+            f.write(b'abc')
+        with open(store.part_for(self.url) + '.validator', 'w') as f:
+            f.write('"v1"')
+        self.mock_get.return_value = self.get_resp(
+            status_code=206,
+            body=b'de',
+            headers={'content-length': '2', 'content-range': 'bytes 3-4/5'},
+        )
+        _, resumed = download_to_store(self.url, store, self.mock_session)
+
+        self.assertEqual(resumed, full)
+
+    def test_short_download_raises_and_keeps_part_file(self):
+        self.mock_get.return_value = self.get_resp(
+            body=b'abc', headers={'content-length': '10'}
+        )
+
+        with self.assertRaises(IOError):
+            download_img(self.url, self.tempdir.name, self.mock_session)
+
+        self.assertEqual(self.read(self.part), b'abc')
+        self.assertFalse(os.path.exists(self.path))
+
+
+class DownloadImgSegmentsTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.url = 'http://www.blah.com/jeezus.jpg'
+        self.body = bytes(range(256)) * 40
+
+        self.mock_session = mock.MagicMock(spec=requests.Session)
+        self.mock_session.head.return_value.headers = {
+            'accept-ranges': 'bytes',
+            'content-length': str(len(self.body)),
+        }
+        self.mock_session.get.side_effect = self.get_range
+
+        self.patcher_min_size = mock.patch('wikiwall.SEGMENT_MIN_SIZE', 1024)
+        self.patcher_min_size.start()
+        self.patcher_chunk_size = mock.patch('wikiwall.CHUNK_MIN_SIZE', 100)
+        self.patcher_chunk_size.start()
+
+        # Suppress print and tqdm output
+        self.patcher_print = mock.patch('wikiwall.print')
+        self.patcher_print.start()
+        self.patcher_tqdm = mock.patch('tqdm.tqdm')
+        self.patcher_tqdm.start()
+
+    def tearDown(self):
+        self.patcher_min_size.stop()
+        self.patcher_chunk_size.stop()
+        self.patcher_print.stop()
+        self.patcher_tqdm.stop()
+        self.tempdir.cleanup()
+
+    def get_range(self, url, stream, headers):
+        '''Returns a mock streamed 206 Response of the requested range.'''
+        mock_resp = mock.MagicMock()
+        mock_resp.__enter__.return_value = mock_resp
+
+        if headers is None:
+            data, mock_resp.status_code = self.body, 200
+        else:
+            start, end = headers['Range'][len('bytes='):].split('-')
+            data, mock_resp.status_code = self.body[int(start):int(end) + 1], 206
+            mock_resp.headers = {
+                'content-length': str(len(data)),
+                'content-range': f'bytes {start}-{end}/{len(self.body)}',
+            }
+            mock_resp.raw = io.BytesIO(data)
+            return mock_resp
+        mock_resp.headers = {'content-length': str(len(data))}
+        mock_resp.raw = io.BytesIO(data)
+        return mock_resp
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_segments_assembled_in_order(self):
+        path = download_img(self.url, self.tempdir.name, self.mock_session, segments=3)
+
+        self.assertEqual(self.read(path), self.body)
+        self.assertEqual(self.mock_session.get.call_count, 3)
+        self.mock_session.get.assert_any_call(
+            self.url, stream=True, headers={'Range': 'bytes=0-3413'}
+        )
+
+    def test_single_stream_without_range_support(self):
+        self.mock_session.head.return_value.headers = {
+            'content-length': str(len(self.body))
+        }
+
+        path = download_img(self.url, self.tempdir.name, self.mock_session, segments=3)
+
+        self.assertEqual(self.read(path), self.body)
+        self.mock_session.get.assert_called_once_with(self.url, stream=True, headers=None)
+
+    def test_single_stream_for_small_files(self):
+        with mock.patch('wikiwall.SEGMENT_MIN_SIZE', len(self.body) + 1):
+            download_img(self.url, self.tempdir.name, self.mock_session, segments=3)
+
+        self.mock_session.get.assert_called_once_with(self.url, stream=True, headers=None)
+
+    def test_segmented_digest_matches_single_stream(self):
+        with mock.patch('store.HASH_BLOCK_SIZE', 1000):
+            store = ContentStore(self.tempdir.name)
+            _, segmented = download_to_store(self.url, store, self.mock_session, segments=3)
+
+            self.mock_session.head.return_value.headers = {}
+            _, single = download_to_store(self.url + '?v=2', store, self.mock_session, segments=3)
+
+        self.assertEqual(segmented, single)
+        self.assertEqual(len(os.listdir(self.tempdir.name)), 1)
+
+    def test_no_head_request_for_one_segment(self):
+        download_img(self.url, self.tempdir.name, self.mock_session, segments=1)
+
+        self.mock_session.head.assert_not_called()
+        self.mock_session.get.assert_called_once_with(self.url, stream=True, headers=None)
+
+    def test_wrong_content_range_raises_and_removes_part_file(self):
+        def shifted(url, stream, headers):
+            # Honors the range but sends bytes from the start of the file.
+            mock_resp = self.get_range(url, stream, headers)
+            start, end = headers['Range'][len('bytes='):].split('-')
+            length = int(end) - int(start) + 1
+            mock_resp.raw = io.BytesIO(self.body[:length])
+            mock_resp.headers['content-range'] = f'bytes 0-{length - 1}/{len(self.body)}'
+            return mock_resp
+
+        self.mock_session.get.side_effect = shifted
+
+        with self.assertRaises(IOError):
+            download_img(self.url, self.tempdir.name, self.mock_session, segments=2)
+
+        self.assertEqual(os.listdir(self.tempdir.name), [])
+
+    def test_ignored_range_raises_and_removes_part_file(self):
+        self.mock_session.get.side_effect = lambda url, stream, headers: self.get_range(
+            url, stream, None
+        )
+
+        with self.assertRaises(IOError):
+            download_img(self.url, self.tempdir.name, self.mock_session, segments=2)
+
+        self.assertEqual(os.listdir(self.tempdir.name), [])
+
+
+class ReadChunksTest(unittest.TestCase):
+    def setUp(self):
+        self.patcher_min = mock.patch('wikiwall.CHUNK_MIN_SIZE', 4)
+        self.patcher_min.start()
+        self.patcher_max = mock.patch('wikiwall.CHUNK_MAX_SIZE', 16)
+        self.patcher_max.start()
+
+    def tearDown(self):
+        self.patcher_min.stop()
+        self.patcher_max.stop()
+
+    def get_resp(self, body):
+        return mock.Mock(raw=io.BytesIO(body))
+
+    def test_all_data_read(self):
+        body = bytes(range(100))
+        chunks = wikiwall._read_chunks(self.get_resp(body))
+        self.assertEqual(b''.join(chunks), body)
+
+    def test_chunk_size_grows_while_reads_are_fast(self):
+        sizes = [len(c) for c in wikiwall._read_chunks(self.get_resp(bytes(60)))]
+        self.assertEqual(sizes, [4, 8, 16, 16, 16])
+
+    def test_chunk_size_shrinks_when_reads_are_slow(self):
+        with mock.patch(
+            'wikiwall.time.perf_counter', side_effect=itertools.count(step=10)
+        ):
+            sizes = [len(c) for c in wikiwall._read_chunks(self.get_resp(bytes(12)))]
+        self.assertEqual(sizes, [4, 4, 4])
+
+    def test_chunks_read_from_response(self):
+        r = self.get_resp(bytes(8))
+        with mock.patch.object(r.raw, 'read', wraps=r.raw.read) as mock_read:
+            chunks = list(wikiwall._read_chunks(r))
+        self.assertEqual(chunks, [bytes(4), bytes(4)])
+        self.assertEqual(mock_read.call_args_list[0], mock.call(4))
+
+    def test_content_decoding_turned_on(self):
+        r = self.get_resp(b'')
+        list(wikiwall._read_chunks(r))
+        self.assertTrue(r.raw.decode_content)
+
+
+class ProgressBarTest(unittest.TestCase):
+    def test_hidden_when_stdout_is_not_a_tty(self):
+        with mock.patch('tqdm.tqdm') as mock_tqdm, mock.patch(
+            'wikiwall.sys.stdout.isatty', return_value=False
+        ):
+            wikiwall._progress_bar(10)
+        self.assertTrue(mock_tqdm.call_args[1]['disable'])
+
+
 class CleanDlsTest(unittest.TestCase):
     def create_dls(self, path, fnum):
         '''Create `fnum` JPEG files in `path`.'''
@@ -340,22 +827,27 @@ class CleanDlsTest(unittest.TestCase):
 
         self.tempdir = tempfile.TemporaryDirectory()
 
+        self.dbdir = tempfile.TemporaryDirectory()
+        self.db = DownloadDatabase(os.path.join(self.dbdir.name, 'test.db')).__enter__()
+
     def tearDown(self):
+        self.db.__exit__(None, None, None)
+        self.dbdir.cleanup()
         self.tempdir.cleanup()
 
     def test_negative_limit(self):
         with self.assertRaises(ValueError):
-            _clean_dls(limit=-1, path=self.tempdir.name)
+            _clean_dls(self.db, limit=-1, path=self.tempdir.name)
 
     def test_float_limit(self):
         with self.assertRaises(ValueError):
-            _clean_dls(limit=4.5, path=self.tempdir.name)
+            _clean_dls(self.db, limit=4.5, path=self.tempdir.name)
 
     def test_getcwd_called_when_no_path_given(self):
         with mock.patch(
             'wikiwall.os.getcwd', return_value=self.tempdir.name
         ) as mock_getcwd:
-            _clean_dls(limit=4, path=None)
+            _clean_dls(self.db, limit=4, path=None)
         mock_getcwd.assert_called()
 
     def test_no_removal_when_less_files_than_limit(self):
@@ -365,7 +857,7 @@ class CleanDlsTest(unittest.TestCase):
         self.create_dls(path=self.tempdir.name, fnum=fnum)
 
         with mock.patch('wikiwall.os.remove', autospec=True) as mock_remove:
-            _clean_dls(limit, path=self.tempdir.name)
+            _clean_dls(self.db, limit, path=self.tempdir.name)
 
         self.assertEqual(len(self.get_jpegs(path=self.tempdir.name)), fnum)
         mock_remove.assert_not_called()
@@ -376,7 +868,7 @@ class CleanDlsTest(unittest.TestCase):
 
         self.create_dls(path=self.tempdir.name, fnum=fnum)
 
-        _clean_dls(limit=limit, path=self.tempdir.name)
+        _clean_dls(self.db, limit=limit, path=self.tempdir.name)
 
         self.assertEqual(len(self.get_jpegs(path=self.tempdir.name)), limit)
 
@@ -393,7 +885,7 @@ class CleanDlsTest(unittest.TestCase):
         old = jpegs[: fnum - limit]
         new = jpegs[-limit:]
 
-        _clean_dls(limit=limit, path=self.tempdir.name)
+        _clean_dls(self.db, limit=limit, path=self.tempdir.name)
 
         # After cleanup
         jpegs = self.get_jpegs(path=self.tempdir.name)
@@ -403,12 +895,85 @@ class CleanDlsTest(unittest.TestCase):
         for j in new:
             self.assertIn(j, jpegs)
 
+    def test_removed_files_dropped_from_manifest(self):
+        self.create_dls(path=self.tempdir.name, fnum=5)
+
+        _clean_dls(self.db, limit=2, path=self.tempdir.name)
+
+        self.assertEqual(self.db.count_files(self.tempdir.name), 2)
+
+    def test_favorites_and_size_limit(self):
+        self.create_dls(path=self.tempdir.name, fnum=3)
+        paths = [os.path.join(self.tempdir.name, f'{n}.jpg') for n in range(3)]
+        for n, path in enumerate(paths):
+            self.db.add_file(path, downloaded=n)
+        self.db.set_favorite(paths[0])
+
+        removed = _clean_dls(
+            self.db, None, path=self.tempdir.name, max_bytes=len('faux jpeg file')
+        )
+
+        self.assertEqual(removed, [paths[1], paths[2]])
+
+    def test_oldest_download_removed_even_if_touched_later(self):
+        self.create_dls(path=self.tempdir.name, fnum=2)
+        first, second = [os.path.join(self.tempdir.name, f) for f in ('0.jpg', '1.jpg')]
+        self.db.add_file(first, downloaded=1)
+        self.db.add_file(second, downloaded=2)
+        os.utime(second, (0, 0))
+
+        _clean_dls(self.db, limit=1, path=self.tempdir.name)
+
+        self.assertEqual(self.get_jpegs(path=self.tempdir.name), [second])
+
+
+class FindNewUrlsTest(unittest.TestCase):
+    def setUp(self):
+        self.pages = {
+            1: ['http://mock/1.jpg', 'http://mock/2.jpg'],
+            2: ['http://mock/3.jpg', 'http://mock/4.jpg'],
+            3: [],
+        }
+        self.mock_catalog = mock.Mock(
+            iter_urls=mock.Mock(
+                side_effect=lambda start, workers: (
+                    (page, self.pages[page]) for page in itertools.count(start)
+                )
+            )
+        )
+        self.seen = set()
+        self.mock_db = mock.Mock(
+            filter_new=mock.Mock(
+                side_effect=lambda urls: [u for u in urls if u not in self.seen]
+            )
+        )
+
+    def test_unseen_urls_of_first_page_returned(self):
+        self.seen.add('http://mock/1.jpg')
+
+        self.assertEqual(
+            _find_new_urls(self.mock_catalog, self.mock_db), ['http://mock/2.jpg']
+        )
+        self.mock_catalog.iter_urls.assert_called_once_with(1, 1)
+
+    def test_next_page_tried_when_page_used_up(self):
+        self.seen.update(self.pages[1])
+
+        self.assertEqual(_find_new_urls(self.mock_catalog, self.mock_db), self.pages[2])
+        self.mock_db.filter_new.assert_called_with(self.pages[2])
+
+    def test_empty_page_raises_value_error(self):
+        self.seen.update(self.pages[1] + self.pages[2])
+
+        with self.assertRaises(ValueError):
+            _find_new_urls(self.mock_catalog, self.mock_db)
+
 
 class RunAppScriptTest(unittest.TestCase):
     def setUp(self):
         self.patcher_run = mock.patch(
-            'wikiwall.subprocess.run',
-            side_effect=wikiwall.subprocess.CalledProcessError(
+            'subprocess.run',
+            side_effect=subprocess.CalledProcessError(
                 returncode=1, cmd='gah', stderr=b''
             ),
         )
@@ -421,3 +986,228 @@ class RunAppScriptTest(unittest.TestCase):
 
         with self.assertRaises(ValueError):
             _run_appscript('gah')
+
+
+class StoreImgTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+        self.db = DownloadDatabase(os.path.join(self.tempdir.name, 'test.db')).__enter__()
+        self.addCleanup(self.db.__exit__, None, None, None)
+        self.dest = os.path.join(self.tempdir.name, 'dest')
+
+        self.mock_session = mock.MagicMock(spec=requests.Session)
+        self.mock_session.get.side_effect = lambda url, stream, headers: self.get_resp()
+
+        self.patcher_print = mock.patch('wikiwall.print')
+        self.patcher_print.start()
+        self.addCleanup(self.patcher_print.stop)
+        self.patcher_tqdm = mock.patch('tqdm.tqdm')
+        self.patcher_tqdm.start()
+        self.addCleanup(self.patcher_tqdm.stop)
+
+    def get_resp(self, body=b'faux jpeg'):
+        mock_resp = mock.MagicMock()
+        mock_resp.__enter__.return_value = mock_resp
+        mock_resp.status_code = 200
+        mock_resp.headers = {'content-length': str(len(body))}
+        mock_resp.raw = io.BytesIO(body)
+        return mock_resp
+
+    def test_file_named_by_digest(self):
+        path = store_img('http://mock/a.jpg', self.dest, self.db, self.mock_session)
+
+        digest = self.db.digest_for('http://mock/a.jpg')
+        self.assertEqual(path, os.path.join(self.dest, digest + '.jpg'))
+        self.assertTrue(os.path.isfile(path))
+
+    def test_known_url_variant_not_downloaded_again(self):
+        first = store_img('http://mock/a.jpg?w=1', self.dest, self.db, self.mock_session)
+        second = store_img('http://mock/a.jpg?w=2', self.dest, self.db, self.mock_session)
+
+        self.assertEqual(first, second)
+        self.mock_session.get.assert_called_once()
+
+    def test_same_content_under_other_url_stored_once(self):
+        first = store_img('http://mock/a.jpg', self.dest, self.db, self.mock_session)
+        second = store_img('http://other/b.jpg', self.dest, self.db, self.mock_session)
+
+        self.assertEqual(first, second)
+        self.assertEqual(os.listdir(self.dest), [os.path.basename(first)])
+
+    def test_same_file_name_different_content_kept_apart(self):
+        first = store_img('http://mock/artist1/a.jpg', self.dest, self.db, self.mock_session)
+        self.mock_session.get.side_effect = lambda url, stream, headers: self.get_resp(b'other')
+        second = store_img('http://mock/artist2/a.jpg', self.dest, self.db, self.mock_session)
+
+        self.assertNotEqual(first, second)
+        self.assertEqual(len(os.listdir(self.dest)), 2)
+
+    def test_deleted_file_downloaded_again(self):
+        path = store_img('http://mock/a.jpg', self.dest, self.db, self.mock_session)
+        os.remove(path)
+
+        self.assertEqual(
+            store_img('http://mock/a.jpg', self.dest, self.db, self.mock_session), path
+        )
+        self.assertEqual(self.mock_session.get.call_count, 2)
+
+
+class NearDuplicateTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+        self.db = DownloadDatabase(os.path.join(self.tempdir.name, 'test.db')).__enter__()
+        self.addCleanup(self.db.__exit__, None, None, None)
+
+        self.mock_catalog = mock.Mock(
+            iter_urls=mock.Mock(
+                side_effect=lambda start, workers: iter(
+                    [(1, ['http://mock/1.jpg', 'http://mock/2.jpg', 'http://mock/3.jpg'])]
+                )
+            )
+        )
+
+        # Each url downloads to its own file with a made up hash.
+        self.hashes = {}
+
+        def store_img(url, dest, db, session, segments):
+            path = os.path.join(self.tempdir.name, url.split('/')[-1])
+            with open(path, 'w') as f:
+                f.write(url)
+            return path
+
+        self.patcher_store_img = mock.patch('wikiwall.store_img', side_effect=store_img)
+        self.patcher_store_img.start()
+        self.addCleanup(self.patcher_store_img.stop)
+
+        self.patcher_dhash = mock.patch(
+            'phash.dhash', side_effect=lambda path: self.hashes[os.path.basename(path)]
+        )
+        self.patcher_dhash.start()
+        self.addCleanup(self.patcher_dhash.stop)
+
+        self.patcher_available = mock.patch('phash.available', return_value=True)
+        self.patcher_available.start()
+        self.addCleanup(self.patcher_available.stop)
+
+        self.patcher_random = mock.patch(
+            'wikiwall.get_random', side_effect=lambda urls, k: urls[:k]
+        )
+        self.patcher_random.start()
+        self.addCleanup(self.patcher_random.stop)
+
+    def fetch(self, index):
+        return wikiwall._fetch_new_image(
+            self.mock_catalog, self.db, None, self.tempdir.name, 1, 1, index
+        )
+
+    def test_index_loaded_from_db(self):
+        self.db.add_phash('http://mock/old.jpg', 0b1111)
+
+        index = wikiwall._near_duplicate_index(self.db, 2)
+
+        self.assertEqual(index.query(0b0111), [(1, 'http://mock/old.jpg')])
+
+    def test_index_turned_off(self):
+        self.assertIsNone(wikiwall._near_duplicate_index(self.db, -1))
+
+        with mock.patch('phash.available', return_value=False):
+            self.assertIsNone(wikiwall._near_duplicate_index(self.db, 2))
+
+    def test_unique_image_hashed_and_kept(self):
+        self.hashes['1.jpg'] = 0
+        index = wikiwall._near_duplicate_index(self.db, 2)
+
+        url, _ = self.fetch(index)
+
+        self.assertEqual(url, 'http://mock/1.jpg')
+        self.assertEqual(list(self.db.phashes()), [('http://mock/1.jpg', 0)])
+
+    def test_near_duplicate_skipped(self):
+        self.db.add_phash('http://mock/old.jpg', 0)
+        self.hashes.update({'1.jpg': 0b1, '2.jpg': 0xFFFF})
+        index = wikiwall._near_duplicate_index(self.db, 2)
+
+        url, path = self.fetch(index)
+
+        self.assertEqual(url, 'http://mock/2.jpg')
+        self.assertFalse(os.path.exists(os.path.join(self.tempdir.name, '1.jpg')))
+        self.assertEqual(self.db.filter_new(['http://mock/1.jpg']), [])
+        self.assertEqual(self.db.count_by_state(), {'skipped': 1, 'picked': 1})
+
+    def test_index_not_loaded_until_used(self):
+        index = wikiwall._near_duplicate_index(self.db, 2)
+        self.db.add_phash('http://mock/old.jpg', 0b1111)
+
+        self.assertEqual(index.query(0b0111), [(1, 'http://mock/old.jpg')])
+
+    def test_failed_download_released(self):
+        with mock.patch('wikiwall.store_img', side_effect=IOError):
+            with self.assertRaises(IOError):
+                self.fetch(None)
+
+        self.assertEqual(self.db.count_by_state(), {})
+
+    def test_failed_check_released(self):
+        with mock.patch('wikiwall._near_duplicates', side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                self.fetch(wikiwall._near_duplicate_index(self.db, 2))
+
+        self.assertEqual(self.db.count_by_state(), {})
+
+    def test_shown_anyway_after_retries(self):
+        self.db.add_phash('http://mock/old.jpg', 0)
+        self.hashes.update({'1.jpg': 0, '2.jpg': 0, '3.jpg': 0})
+        index = wikiwall._near_duplicate_index(self.db, 2)
+
+        with mock.patch('wikiwall.NEAR_DUPLICATE_RETRIES', 1):
+            url, path = self.fetch(index)
+
+        self.assertEqual(url, 'http://mock/2.jpg')
+        self.assertTrue(os.path.exists(path))
+
+
+class RecordCatalogTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+        self.db = DownloadDatabase(os.path.join(self.tempdir.name, 'test.db')).__enter__()
+        self.addCleanup(self.db.__exit__, None, None, None)
+
+        self.catalog = Catalog(
+            fetch=lambda page: [{'image': f'http://mock/{page}.jpg', 'artistName': 'Monet'}],
+            path=os.path.join(self.tempdir.name, 'catalog'),
+        )
+
+    def test_fetched_pages_stored_once(self):
+        self.catalog.paintings(1)
+        self.catalog.paintings(2)
+
+        with mock.patch.object(self.db, 'add_paintings', wraps=self.db.add_paintings) as add:
+            wikiwall._record_catalog(self.db, self.catalog)
+            wikiwall._record_catalog(self.db, self.catalog)
+
+        self.assertEqual(add.call_count, 2)
+        self.assertEqual(self.db.count_paintings(), (2, 1))
+
+    def test_refetched_page_stored_again(self):
+        self.catalog.paintings(1)
+        wikiwall._record_catalog(self.db, self.catalog)
+
+        self.catalog.invalidate(1)
+        with mock.patch('catalog.time.time', return_value=10 ** 10):
+            self.catalog.paintings(1)
+        wikiwall._record_catalog(self.db, self.catalog)
+
+        self.assertEqual(self.db.page_fetched(1), 10 ** 10)
+
+    def test_pages_recorded_under_source(self):
+        self.catalog.paintings(1)
+        wikiwall._record_catalog(self.db, self.catalog, 'dir:/art')
+
+        self.assertIsNone(self.db.page_fetched(1))
+        self.assertIsNotNone(self.db.page_fetched(1, 'dir:/art'))
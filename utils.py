@@ -8,13 +8,79 @@ Functions and values that other modules share.
 """
 
 import os
+import re
+import urllib.parse
 
 
 # Source of Hi-Res images
 SRC_URL = 'https://www.wikiart.org/?json=2&layout=new&param=high_resolution&layout=new&page={}'
 
-# If only duplicate images returned, wait before trying next page of json data.
-DUPLICATE_TIMEOUT = 3
+# Name of the default source of painting records. See `sources`.
+SOURCE = 'wikiart'
+
+# Number of painting records per page of local and manifest sources.
+SOURCE_PAGE_SIZE = 100
+
+# Seconds a scraped page of json data is reused before fetching it again.
+CATALOG_TTL = 60 * 60
+
+# Max number of json pages fetched at the same time.
+SCRAPE_WORKERS = 4
+
+# Connections kept open per host, and retries with backoff (seconds) of
+# failed requests.
+HTTP_POOL_SIZE = 10
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.5
+
+# Images of at least SEGMENT_MIN_SIZE bytes are downloaded as this many
+# parallel byte ranges.
+DOWNLOAD_SEGMENTS = 4
+SEGMENT_MIN_SIZE = 4 * 1024 * 1024
+
+# Bounds of download chunk size, adapted so each read takes about
+# CHUNK_TARGET_TIME seconds.
+CHUNK_MIN_SIZE = 64 * 1024
+CHUNK_MAX_SIZE = 4 * 1024 * 1024
+CHUNK_TARGET_TIME = 0.1
+
+# Bytes of a json page read from the response stream at a time.
+JSON_CHUNK_SIZE = 64 * 1024
+
+# Size of blocks hashed separately for content digests of images.
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Max number of bits perceptual hashes of the same painting differ by, and
+# number of near duplicates skipped before showing one anyway.
+NEAR_DUPLICATE_DISTANCE = 6
+NEAR_DUPLICATE_RETRIES = 3
+
+# Number of recent picks whose artists aren't picked again, and number of
+# pages with unseen images to pick from.
+ARTIST_GAP = 0
+SELECT_PAGES = 1
+
+# File extensions images are stored under. Others are stored as '.jpg'.
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+# Seconds spent deleting old downloads per run. The rest is deleted next run.
+EVICT_TIME_BUDGET = 0.5
+
+# Seconds after which a download directory is scanned again even if its
+# manifest looks up to date.
+MANIFEST_RESCAN_INTERVAL = 24 * 60 * 60
+
+# Seconds between wallpaper changes in daemon mode.
+DAEMON_INTERVAL = 60 * 60
+
+# Seconds to wait for another wikiwall process fetching the same page or image.
+LOCK_TIMEOUT = 10 * 60
+
+# Port `wikiwall serve-cache` listens on.
+PROXY_PORT = 8765
+
+# Hosts, with their subdomains, the caching proxy fetches from.
+PROXY_HOSTS = ('wikiart.org',)
 
 
 def data_dir():
@@ -25,7 +91,22 @@ def data_dir():
     )
     path = os.path.join(xdg_data_home, 'wikiwall')
 
-    if not os.path.exists(path):
-        os.makedirs(path)
+    os.makedirs(path, exist_ok=True)
 
     return path
+
+
+def url_key(url):
+    """Return `url` without query string and fragment.
+
+    Variants of an image url that only differ in those point at the
+    same file.
+
+    """
+    return urllib.parse.urlunsplit(urllib.parse.urlsplit(url)[:3] + ('', ''))
+
+
+def painting_year(painting):
+    """Return year of painting record as int, e.g. 1889 for 'c.1889', or None. """
+    match = re.search(r'\d{3,4}', str(painting.get('year') or ''))
+    return int(match.group()) if match else None
@@ -6,6 +6,11 @@ wikiwall.py
 Downloads a random image from Wikiart's Hi-Res page and
 sets it as the desktop background in macOS.
 
+Only modules every command needs are imported at module level.
+Network, database and process modules are imported inside the
+functions that use them, so `wikiwall --help` and `wikiwall show`
+start without loading them.
+
 """
 import click
 import logging
@@ -13,18 +18,40 @@ from logging.handlers import RotatingFileHandler
 import os
 import os.path
 import random
-import requests
-import subprocess
+import re
 import sys
 import time
-from tqdm import tqdm
 
-from db import DownloadDatabase
-from utils import DUPLICATE_TIMEOUT, SRC_URL, data_dir
+from utils import (
+    ARTIST_GAP,
+    CATALOG_TTL,
+    CHUNK_MAX_SIZE,
+    CHUNK_MIN_SIZE,
+    CHUNK_TARGET_TIME,
+    DAEMON_INTERVAL,
+    DOWNLOAD_SEGMENTS,
+    EVICT_TIME_BUDGET,
+    HTTP_BACKOFF,
+    HTTP_POOL_SIZE,
+    HTTP_RETRIES,
+    JSON_CHUNK_SIZE,
+    NEAR_DUPLICATE_DISTANCE,
+    NEAR_DUPLICATE_RETRIES,
+    PROXY_HOSTS,
+    PROXY_PORT,
+    SCRAPE_WORKERS,
+    SEGMENT_MIN_SIZE,
+    SELECT_PAGES,
+    SOURCE,
+    data_dir,
+)
 
 
 logger = logging.getLogger(__name__)
 
+# Session shared by scrape and download functions. See `get_session`.
+_session = None
+
 
 def config_logger(debug, path=None):
     """Configure module logger. """
@@ -92,41 +119,421 @@ def get_random(iterator, k=1):
     return results
 
 
-def scrape_urls(src_url):
+def make_session(
+    pool_size=HTTP_POOL_SIZE, retries=HTTP_RETRIES, backoff=HTTP_BACKOFF, cache_proxy=None
+):
+    """Create session that keeps connections alive and retries failures.
+
+    Args:
+        pool_size: max number of connections kept open per host.
+        retries: number of times to retry failed connections and
+            throttled or server error responses.
+        backoff: backoff factor, in seconds, between retries.
+        cache_proxy: base url of a `wikiwall serve-cache` proxy to send
+            http and https requests through, or None.
+
+    Returns:
+        `requests.Session` with pooled adapters mounted.
+
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.request import ACCEPT_ENCODING
+    from urllib3.util.retry import Retry
+
+    from fileadapter import FileAdapter
+
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        # Let `raise_for_status` report the last bad response.
+        raise_on_status=False,
+    )
+    options = dict(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    if cache_proxy:
+        from proxy import CacheProxyAdapter
+
+        adapter = CacheProxyAdapter(cache_proxy, **options)
+    else:
+        adapter = HTTPAdapter(**options)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    # Images of local sources.
+    session.mount('file://', FileAdapter())
+    # Includes brotli if urllib3 can decode it.
+    session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+
+    return session
+
+
+def get_session():
+    """Return session shared by module functions, creating it on first use. """
+    global _session
+
+    if _session is None:
+        _session = make_session()
+
+    return _session
+
+
+def _get_chunks(src_url, session):
+    """Yield body of `src_url` in chunks as it arrives. """
+    # Exceptions raised here if connection issue arises
+    r = session.get(src_url, stream=True)
+    try:
+        r.raise_for_status()
+        yield from r.iter_content(JSON_CHUNK_SIZE)
+    finally:
+        r.close()
+
+
+def _iter_paintings(src_url, session=None, cache=None):
+    """Fetch json data at `src_url` and yield items of its `Paintings` value.
+
+    Records are parsed from the response stream as they arrive, so the
+    first one is yielded before the page is fully downloaded and the
+    whole page is never held in memory.
+
+    Raises:
+        KeyError: if there is no `Paintings` value.
+
+    """
+    from jsonstream import iter_array
+
+    session = session or get_session()
+
+    if cache is not None:
+        chunks = cache.fetch(session, src_url, JSON_CHUNK_SIZE)
+    else:
+        chunks = _get_chunks(src_url, session)
+
+    try:
+        yield from iter_array(chunks, 'Paintings')
+    finally:
+        chunks.close()
+
+
+def scrape_paintings(src_url, session=None, cache=None):
+    """Scrape painting records.
+
+    Args:
+        src_url: URL to scrape.
+        session: `requests.Session` to use. Default is shared session.
+        cache: `HTTPCache` to revalidate and store responses in.
+            Default is no cache.
+
+    Raises:
+        Any typical Requests exceptions.
+        ValueError: if the response isn't a json object.
+
+    Yields:
+        Painting records (dicts) of the `Paintings` json data. Nothing
+        if no such data exists.
+
+    """
+    try:
+        yield from _iter_paintings(src_url, session, cache)
+    except KeyError:
+        return
+
+
+def scrape_urls(src_url, session=None, cache=None):
     """Scrape jpg urls.
 
     Args:
         src_url: URL to scrape.
+        session: `requests.Session` to use. Default is shared session.
+        cache: `HTTPCache` to revalidate and store responses in.
+            Default is no cache.
 
     Raises:
         Any typical Requests exceptions.
+        ValueError: if the response isn't a json object.
 
     Yields:
         Parsed url results in string format.
 
     """
-    # Exceptions raised here if connection issue arises
-    r = requests.get(src_url)
+    try:
+        for obj in _iter_paintings(src_url, session, cache):
+            yield obj.get('image', '')
+    except KeyError:
+        yield ''
+
+
+def _progress_bar(total):
+    """Return tqdm progress bar of bytes, hidden when stdout isn't a TTY. """
+    from tqdm import tqdm
+
+    return tqdm(
+        total=total,
+        unit='B',
+        unit_scale=True,
+        mininterval=0.5,
+        disable=not sys.stdout.isatty(),
+    )
+
+
+def _read_chunks(r):
+    """Read body of streamed response `r` in adaptively sized chunks.
+
+    The chunk size starts at `CHUNK_MIN_SIZE` and doubles, up to
+    `CHUNK_MAX_SIZE`, while full reads finish in under half of
+    `CHUNK_TARGET_TIME`. It halves when they take more than twice that.
+
+    Yields:
+        bytes of the body.
+
+    """
+    # Let urllib3 undo any content encoding while reading.
+    r.raw.decode_content = True
+
+    size = CHUNK_MIN_SIZE
+
+    while True:
+        start = time.perf_counter()
+        chunk = r.raw.read(size)
+        if not chunk:
+            break
+        elapsed = time.perf_counter() - start
+
+        yield chunk
+
+        if len(chunk) == size:
+            if elapsed < CHUNK_TARGET_TIME / 2:
+                size = min(size * 2, CHUNK_MAX_SIZE)
+            elif elapsed > CHUNK_TARGET_TIME * 2:
+                size = max(size // 2, CHUNK_MIN_SIZE)
+
+
+def _range_size(url, session):
+    """Return size of file at `url` if the server accepts range requests.
+
+    Returns:
+        Size in bytes, or None if ranges aren't supported or the size
+        isn't known.
+
+    """
+    r = session.head(url, allow_redirects=True)
     r.raise_for_status()
 
-    data = r.json().get('Paintings')
+    if r.headers.get('accept-ranges', '').lower() != 'bytes':
+        return None
 
-    if data is not None:
-        for obj in data:
-            yield obj.get('image', '')
+    file_sz = r.headers.get('content-length')
+    return int(file_sz) if file_sz is not None else None
+
+
+def _download_segments(url, path, file_sz, session, segments):
+    """Download file at `url` to `path` as parallel byte range requests.
+
+    Each segment is written at its own offset of a preallocated file, so
+    segments can arrive in any order. Each is hashed as it arrives.
+
+    Raises:
+        IOError: if the server doesn't answer a range with exactly that
+            range, or a segment comes up short.
+
+    Returns:
+        Content digest of file.
+
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from store import BlockHasher, content_digest
+
+    seg_sz = -(-file_sz // segments)
+    ranges = [(start, min(start + seg_sz, file_sz) - 1) for start in range(0, file_sz, seg_sz)]
+
+    with open(path, 'wb') as f, _progress_bar(file_sz) as progress:
+        f.truncate(file_sz)
+        fd = f.fileno()
+
+        def fetch(start, end):
+            headers = {'Range': f'bytes={start}-{end}'}
+            with session.get(url, stream=True, headers=headers) as r:
+                r.raise_for_status()
+                # Bytes of another range would be written at the wrong offset.
+                if r.status_code != 206 or _content_range(r.headers) != (start, end, file_sz):
+                    raise IOError(f'Range {start}-{end} of {url} not honored.')
+
+                offset = start
+                hasher = BlockHasher(start)
+                for chunk in _read_chunks(r):
+                    os.pwrite(fd, chunk, offset)
+                    hasher.update(chunk)
+                    offset += len(chunk)
+                    progress.update(len(chunk))
+
+            if offset != end + 1:
+                raise IOError(f'Range {start}-{end} of {url} incomplete.')
+
+            return hasher
+
+        with ThreadPoolExecutor(max_workers=segments) as pool:
+            futures = [pool.submit(fetch, start, end) for start, end in ranges]
+            hashers = [future.result() for future in futures]
+
+    return content_digest(hashers, file_sz)
+
+
+def _validator(headers):
+    """Return value for `If-Range` that identifies the body with `headers`.
+
+    Weak ETags can't be used for ranges, so `Last-Modified` is used then.
+
+    Returns:
+        None if the response has no usable validator.
+
+    """
+    etag = headers.get('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('last-modified')
+
+
+def _content_range(headers):
+    """Return (start, end, total) of `Content-Range` in `headers` or None.
+
+    `total` is None if the server doesn't know it.
+
+    """
+    match = re.match(r'bytes (\d+)-(\d+)/(\d+|\*)$', headers.get('content-range', ''))
+    if match is None:
+        return None
+    start, end, total = match.groups()
+    return int(start), int(end), None if total == '*' else int(total)
+
+
+def _read_validator(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read() or None
+    except FileNotFoundError:
+        return None
+
+
+def _write_validator(path, validator):
+    if validator is None:
+        _remove(path)
     else:
-        yield ''
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(validator)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _download_stream(url, part, session):
+    """Stream file at `url` to `part`, resuming a partial download.
+
+    The `ETag` or `Last-Modified` of the response is kept next to
+    `part`. A partial file is only resumed with a range request
+    conditional on it, so bytes of a changed image are never appended
+    to those of the old one.
+
+    Raises:
+        IOError: if fewer bytes than the server announced were received.
+
+    Returns:
+        Content digest of file.
+
+    """
+    from store import BlockHasher, content_digest
+
+    filename = os.path.basename(part)
+    validator_file = part + '.validator'
+
+    # Pick up where an interrupted download left off.
+    offset = os.path.getsize(part) if os.path.isfile(part) else 0
+    validator = _read_validator(validator_file) if offset else None
+    if offset and validator is None:
+        logger.info('Cannot tell if %s changed since. Downloading again.', filename)
+        offset = 0
+
+    headers = {'Range': f'bytes={offset}-', 'If-Range': validator} if offset else None
+
+    with session.get(url, stream=True, headers=headers) as r:
+        if offset and r.status_code == 416:
+            # Partial file doesn't match what the server has. Start over.
+            logger.warning('Cannot resume %s. Downloading again.', filename)
+            os.remove(part)
+            return _download_stream(url, part, session)
+        r.raise_for_status()
+
+        if offset and r.status_code == 206:
+            content_range = _content_range(r.headers)
+            if content_range is None or content_range[0] != offset:
+                logger.warning('%s resumed at the wrong byte. Downloading again.', filename)
+                os.remove(part)
+                return _download_stream(url, part, session)
+            logger.info('Resuming %s from byte %s.', filename, offset)
+        elif offset:
+            # Image changed or server ignored the range: whole file follows.
+            offset = 0
+
+        if not offset:
+            _write_validator(validator_file, _validator(r.headers))
+
+        # Length of an encoded body says nothing about the decoded size.
+        file_sz = r.headers.get('content-length')
+        if file_sz is not None and 'content-encoding' not in r.headers:
+            total = offset + int(file_sz)
+        else:
+            total = None
+
+        hasher = BlockHasher()
+        if offset:
+            # Bytes from the interrupted run have to be hashed too.
+            with open(part, 'rb') as f:
+                for block in iter(lambda: f.read(CHUNK_MAX_SIZE), b''):
+                    hasher.update(block)
+
+        size = offset
+        with open(part, 'ab' if offset else 'wb') as f, _progress_bar(total) as progress:
+            progress.update(offset)
+            for chunk in _read_chunks(r):
+                f.write(chunk)
+                hasher.update(chunk)
+                size += len(chunk)
+                progress.update(len(chunk))
+
+    if total is not None and size != total:
+        raise IOError(f'{filename} incomplete: got {size} of {total} bytes.')
+
+    _remove(validator_file)
+
+    return content_digest([hasher], size)
 
 
-def download_img(url, dest=None):
+def download_img(url, dest=None, session=None, segments=1):
     """Download img from url.
 
+    The image is streamed to a `.part` file that is renamed into place
+    once complete. If a `.part` file from an interrupted run exists, the
+    download resumes from where it stopped when the server supports
+    range requests.
+
     Args:
         url: url of image file.
         dest: where to download file. Default is current directory.
+        session: `requests.Session` to use. Default is shared session.
+        segments: number of parallel range requests to split files of
+            at least `SEGMENT_MIN_SIZE` bytes into. Falls back to a single
+            stream if the server doesn't support ranges.
 
     Raises:
         TypeError: if url or dest aren't strings.
+        IOError: if fewer bytes than the server announced were received.
+            The `.part` file of a single stream is kept to resume from
+            next time.
 
     Returns:
         path: local path to downloaded file.
@@ -144,66 +551,474 @@ def download_img(url, dest=None):
 
     filename = url.split('/')[-1]
     path = os.path.join(dest, filename)
+    part = path + '.part'
+
+    session = session or get_session()
 
     # download the sucker
-    with requests.get(url, stream=True) as r, open(path, 'wb') as f:
-        file_sz = int(r.headers['content-length'])
-        chunk_sz = 1024
-        print(f'Downloading {filename}...')
-        for chunk in tqdm(
-            iterable=r.iter_content(chunk_sz),
-            total=int(file_sz / chunk_sz),
-            unit_scale=True,
-            unit='KB',
-        ):
-            f.write(chunk)
+    print(f'Downloading {filename}...')
+
+    _download(url, part, session, segments)
+
+    os.replace(part, path)
 
     logger.info('%s downloaded to %s', filename, dest)
 
     return path
 
 
-def _clean_dls(limit, path=None):
-    """Check that number of images saved so far is no more than `limit`.
+def _download(url, part, session, segments):
+    """Download file at `url` to `part`.
+
+    Files of at least `SEGMENT_MIN_SIZE` bytes are split into `segments`
+    parallel range requests if the server supports them. Otherwise a
+    partial `part` file is resumed.
+
+    Returns:
+        Content digest of file.
+
+    """
+    filename = url.split('/')[-1]
+
+    file_sz = None
+    if segments > 1 and not os.path.isfile(part):
+        file_sz = _range_size(url, session)
+
+    if file_sz is not None and file_sz >= SEGMENT_MIN_SIZE:
+        logger.info('Downloading %s in %s segments.', filename, segments)
+        try:
+            return _download_segments(url, part, file_sz, session, segments)
+        except Exception:
+            # Segments leave holes, so this file can't be resumed.
+            os.remove(part)
+            raise
+
+    return _download_stream(url, part, session)
+
+
+def stored_img(url, store, db):
+    """Return path of image at `url` in `store` if its content is known.
 
     Args:
+        url: url of image file.
+        store: `ContentStore` to look in.
+        db: open `DownloadDatabase` with content digests of urls.
+
+    Returns:
+        Local path, or None if the image has to be downloaded.
+
+    """
+    from store import extension
+
+    digest = db.digest_for(url)
+    if digest is None:
+        return None
+
+    path = store.find(digest, extension(url))
+    if path is not None:
+        logger.info('Content of %s stored already as %s.', url, path)
+    return path
+
+
+def download_to_store(url, store, session=None, segments=1):
+    """Download image at `url` into content-addressed `store`.
+
+    The file is hashed while it downloads. If the same content is
+    stored already, the new copy is dropped.
+
+    Args:
+        url: url of image file.
+        store: `ContentStore` to download to.
+        session: `requests.Session` to use. Default is shared session.
+        segments: number of parallel range requests for large files.
+
+    Raises:
+        IOError: if fewer bytes than the server announced were received.
+
+    Returns:
+        Tuple of local path and content digest.
+
+    """
+    from store import extension
+
+    session = session or get_session()
+
+    print(f'Downloading {url.split("/")[-1]}...')
+
+    part = store.part_for(url)
+    digest = _download(url, part, session, segments)
+    path = store.put(part, digest, extension(url))
+
+    logger.info('%s downloaded to %s', url, path)
+
+    return path, digest
+
+
+def store_img(url, dest=None, db=None, session=None, segments=1):
+    """Download image at `url` to `dest`, named by its content digest.
+
+    Images whose content is known from an earlier download of `url`, or
+    of a variant of it with another query string, aren't downloaded
+    again. Processes downloading the same url to the same `dest` wait
+    for the first one and reuse its file.
+
+    Args:
+        url: url of image file.
+        dest: download directory. Default is current directory.
+        db: open `DownloadDatabase` to look up and record digests in.
+        session: `requests.Session` to use. Default is shared session.
+        segments: number of parallel range requests for large files.
+
+    Returns:
+        Local path of image.
+
+    """
+    from locks import FileLock
+    from store import ContentStore
+
+    store = ContentStore(dest or os.getcwd())
+
+    with FileLock(store.lock_for(url)):
+        path = stored_img(url, store, db) if db is not None else None
+        if path is None:
+            path, digest = download_to_store(url, store, session, segments)
+            if db is not None:
+                if db.count_digest(digest):
+                    logger.info('%s has the same content as an earlier download.', url)
+                db.add_digest(url, digest)
+
+    return path
+
+
+def _clean_dls(
+    db, limit, path=None, max_bytes=None, max_age=None, time_budget=EVICT_TIME_BUDGET
+):
+    """Delete least recently shown images beyond the given limits.
+
+    Favorites are always kept. The download directory is tracked in the
+    file manifest of `db`, so candidates come from an indexed query
+    instead of stat'ing every file on each run. Deleting stops after
+    `time_budget` seconds and carries on next time.
+
+    Args:
+        db: open `DownloadDatabase`.
         limit: maximum number of downloads allowed in download directory.
+            None for no limit.
         path: path to saved images. Default to current working directory.
+        max_bytes: maximum total size of downloads. None for no limit.
+        max_age: seconds to keep images after they were last shown.
+            None to keep them forever.
+        time_budget: seconds to spend deleting. None for no limit.
 
     Raises:
-        ValueError: if `limit` is not an positive integer.
+        ValueError: if `limit` or `max_bytes` is not a positive integer,
+            or `max_age` isn't positive.
+
+    Returns:
+        List of removed paths.
 
     """
-    if not isinstance(limit, int) or limit < 0:
-        raise ValueError('`limit` must be a positive integer.')
+    from eviction import Evictor, KeepFavorites, MaxAge, MaxBytes, MaxCount
+
+    policies = [KeepFavorites()]
+    if limit is not None:
+        policies.append(MaxCount(limit))
+    if max_bytes is not None:
+        policies.append(MaxBytes(max_bytes))
+    if max_age is not None:
+        policies.append(MaxAge(max_age))
 
     if path is None:
         path = os.getcwd()
 
-    # collect jpg file paths
-    jpegs = []
-    for f in os.listdir(path):
-        if os.path.isfile(os.path.join(path, f)):
-            if f.lower().endswith('.jpg'):
-                jpegs.append(os.path.join(path, f))
+    # pick up files added or removed behind our back
+    db.sync_files(path)
+
+    return Evictor(db, path, policies).run(time_budget)
+
+
+def _clean_up(db, dest, limit, max_bytes, max_age):
+    """Clean out download directory `dest` if any limit is set.
+
+    Args:
+        limit: number of files to keep in `dest`. -1 for no limit.
+        max_bytes: bytes of files to keep in `dest`. None for no limit.
+        max_age: seconds to keep a file after it was last shown. None
+            to keep it forever.
+
+    """
+    if limit == -1 and max_bytes is None and max_age is None:
+        logger.info('No download limit set. Skipping cleaning.')
+        return
+
+    if limit != -1:
+        logger.info('Download limit set to %s.', limit)
+
+    _clean_dls(
+        db, None if limit == -1 else limit, dest, max_bytes=max_bytes, max_age=max_age
+    )
+
+
+def _find_new_urls(catalog, db, page=1, workers=1):
+    """Return unseen urls of the first page from `page` on that has any.
+
+    Args:
+        catalog: `Catalog` to take pages of urls from.
+        db: `DownloadDatabase` of previous downloads.
+        page: json page to start searching from.
+        workers: number of pages to fetch at the same time once the
+            first page is used up.
+
+    Raises:
+        ValueError: if a page without any images is reached.
+
+    """
+    for page, urls in catalog.iter_urls(page, workers):
+        if not urls:
+            raise ValueError(f'No images found on page {page}.')
+
+        new_urls = db.filter_new(urls)
+        if new_urls:
+            return new_urls
+
+        # Every image on this page downloaded already.
+        logger.info('Trying next page %s', page + 1)
+
+
+def _pick_urls(catalog, db, k=1, workers=1, selector=None):
+    """Pick `k` unseen urls and reserve them in `db`.
+
+    Picking and reserving happen under one lock, so overlapping runs
+    never pick the same url. Reservations are turned into history with
+    `db.add`, or dropped with `db.release` if the download fails.
+
+    Args:
+        selector (optional): `Selector` picking the urls. Default is
+            uniform picks from the first page with unseen images.
+
+    Returns:
+        List of urls. Shorter than `k` if fewer unseen images are left
+        on the first page that has any.
+
+    """
+    with db.pick_lock():
+        if selector is not None:
+            urls = selector.pick(catalog, db, k=k, workers=workers)
+        else:
+            urls = get_random(_find_new_urls(catalog, db, workers=workers), k=k)
+        db.reserve(urls)
+
+    return urls
+
+
+def _record_catalog(db, catalog, source=SOURCE):
+    """Store painting records of pages `catalog` fetched since last stored.
+
+    Runs on the thread owning `db`, unlike page fetches.
+
+    Args:
+        source: name of the source `catalog` holds pages of.
+
+    """
+    for page, record in catalog.loaded_pages():
+        if db.page_fetched(page, source) != record['fetched']:
+            added = db.add_paintings(record['paintings'], page, record['fetched'], source)
+            logger.info('Stored %s paintings of page %s.', added, page)
+
+
+def _near_duplicate_index(db, distance):
+    """Return `HammingIndex` of perceptual hashes in `db`.
+
+    Hashes are loaded on first use, so runs that don't download an image
+    don't read them.
+
+    Returns:
+        None if `distance` is -1 or numpy and Pillow aren't installed.
+
+    """
+    if distance == -1:
+        return None
+
+    import phash
+
+    if not phash.available():
+        logger.info('numpy or Pillow missing. Not checking for near duplicates.')
+        return None
+
+    def load():
+        hashes = [(h, url) for url, h in db.phashes()]
+        logger.info('Loaded %s perceptual hashes.', len(hashes))
+        return hashes
+
+    return phash.HammingIndex(distance, load=load)
+
+
+def _near_duplicates(index, db, url, path):
+    """Return urls of earlier images that look like image `path`.
+
+    If there are none, the image's perceptual hash is added to `index`
+    and `db`.
+
+    Returns:
+        List of urls, closest first.
+
+    """
+    import phash
+
+    try:
+        h = phash.dhash(path)
+    except OSError:
+        logger.warning('Cannot hash %s. Not checking for near duplicates.', path)
+        return []
+
+    matches = [match for _, match in index.query(h) if match != url]
+    if not matches:
+        db.add_phash(url, h)
+        index.add(h, url)
+
+    return matches
+
+
+def _fetch_new_image(
+    catalog, db, session, dest, workers, segments, index=None, selector=None
+):
+    """Find an unseen image and download it to `dest`.
+
+    Images that look like one downloaded before are skipped, up to
+    `NEAR_DUPLICATE_RETRIES` times, if an `index` of perceptual hashes
+    is given. The image is picked by `selector` if given, otherwise
+    uniformly at random from the first page with unseen images.
+
+    Returns:
+        Tuple of image url and local path.
 
-    # check if limit exceeded
-    if len(jpegs) > limit:
+    """
+    for attempt in range(NEAR_DUPLICATE_RETRIES + 1):
+        url = _pick_urls(catalog, db, workers=workers, selector=selector)[0]
+        try:
+            path = store_img(url, dest, db, session, segments)
+
+            matches = _near_duplicates(index, db, url, path) if index is not None else []
+            if not matches or attempt == NEAR_DUPLICATE_RETRIES:
+                return url, path
+
+            logger.info('%s looks like %s. Trying another image.', url, matches[0])
+
+            # Identical content is stored once, so the file may be an earlier image's.
+            if path not in {db.path_of(match) for match in matches}:
+                os.remove(path)
+        except Exception:
+            db.release([url])
+            raise
+
+        # Keep it out of future picks, but not in the shown history.
+        from db import STATE_SKIPPED
+
+        db.add(url, STATE_SKIPPED)
+
+
+def _refill_queue(db, fetch, path, size):
+    """Fill prefetch queue at `path` up to `size` images.
+
+    Failures are logged, not raised: the wallpaper is already set.
+
+    Args:
+        db: open `DownloadDatabase`.
+        fetch: callable taking open `DownloadDatabase` and directory,
+            returning tuple of url and local path of a new image.
+
+    """
+    from prefetch import PrefetchQueue
+
+    try:
+        PrefetchQueue(db, path, size).refill(lambda dest: fetch(db, dest))
+    except Exception:
+        logger.exception('Prefetching failed.')
+
+
+def _refill_in_background():
+    """Start this run again as a detached `refill` command.
+
+    The wallpaper is set already, so the run can exit without waiting
+    for the downloads. The child imports this module by name rather
+    than running it as a script, so it logs to the same file.
+
+    """
+    import subprocess
+
+    code = (
+        f'import sys; sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r}); '
+        'from wikiwall import cli; cli(obj={})'
+    )
+    subprocess.Popen(
+        [sys.executable, '-c', code, *sys.argv[1:], 'refill'],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    logger.info('Refilling prefetch queue in the background.')
+
+
+def _change_wallpaper(db, fetch, dest, prefetch, queue_dir):
+    """Set desktop background to a queued or newly downloaded image.
 
-        logger.info('%s jpeg files in %s', len(jpegs), path)
-        logger.info('Cleaning...')
+    Args:
+        db: open `DownloadDatabase`.
+        fetch: callable taking open `DownloadDatabase` and directory,
+            returning tuple of url and local path of a new image.
+        dest: download directory.
+        prefetch: size of prefetch queue. 0 to not use one.
+        queue_dir: prefetch queue directory.
+
+    Returns:
+        Local path of new background image.
+
+    """
+    queued = None
+    if prefetch > 0:
+        from prefetch import PrefetchQueue
+
+        queued = PrefetchQueue(db, queue_dir, prefetch).pop(dest)
+
+    if queued is not None:
+        url, saved_img = queued
+    else:
+        print('Searching for image...')
+        url, saved_img = fetch(db, dest)
+
+    try:
+        db.add_file(saved_img)
+
+        # Set image as desktop background.
+        setwall_script = f'''
+            tell application "System Events"
+                tell every desktop
+                    set picture to "{saved_img}"
+                end tell
+            end tell
+        '''
 
-        # sort by modification time, oldest to newest
-        jpegs.sort(key=os.path.getmtime)
+        print('Setting background... ', end='')
+        _run_appscript(setwall_script)
 
-        while len(jpegs) > limit:
-            f = jpegs.pop(0)
-            os.remove(f)
-            logger.info('%s removed.', f)
+        # Save record of image to database.
+        if queued is not None:
+            db.mark_shown(url, saved_img)
+        else:
+            db.add(url, path=saved_img)
+    except Exception:
+        # The image is still reserved, so let later runs pick it again.
+        db.release([url])
+        raise
+    db.mark_file_shown(saved_img)
+
+    return saved_img
 
 
 def _run_appscript(script):
     """Execute Applescript. """
+    import subprocess
 
     try:
         subprocess.run(
@@ -217,8 +1032,30 @@ def _run_appscript(script):
         raise ValueError(err.stderr.decode())
 
 
+def _check_source(ctx, param, value):
+    """Reject unknown sources and unusable source arguments up front. """
+    if value != SOURCE:
+        from sources import open_source
+
+        try:
+            open_source(value)
+        except ValueError as err:
+            raise click.BadParameter(str(err))
+    return value
+
+
 @click.group(invoke_without_command=True)
 @click.option('--dest', help='Download images to specified destination.')
+@click.option(
+    '--source',
+    default=SOURCE,
+    callback=_check_source,
+    help=f'''
+        Where to take images from: wikiart, wikiart:URL of a mirror of the json feed with {{}}
+        for the page, dir:PATH of a directory of images, or manifest:PATH or URL of a JSON
+        lines file of painting records. Default is {SOURCE}.
+    ''',
+)
 @click.option(
     '--limit',
     default=10,
@@ -226,9 +1063,107 @@ def _run_appscript(script):
         Number of files to keep in download directory. Set to -1 for no limit. Default is 10.
     ''',
 )
+@click.option(
+    '--max-size',
+    type=int,
+    help='Megabytes of images to keep in download directory. Default is no limit.',
+)
+@click.option(
+    '--max-age',
+    type=float,
+    help='Days to keep an image after it was last shown. Default is forever.',
+)
+@click.option(
+    '--ttl',
+    default=CATALOG_TTL,
+    help=f'Seconds to reuse a scraped page before fetching it again. Default is {CATALOG_TTL}.',
+)
+@click.option(
+    '--workers',
+    default=SCRAPE_WORKERS,
+    type=click.IntRange(min=1),
+    help=f'''
+        Number of json pages to fetch at the same time once the first page is used up.
+        Default is {SCRAPE_WORKERS}.
+    ''',
+)
+@click.option(
+    '--segments',
+    default=DOWNLOAD_SEGMENTS,
+    type=click.IntRange(min=1),
+    help=f'''
+        Number of parallel range requests to download large images with.
+        Default is {DOWNLOAD_SEGMENTS}.
+    ''',
+)
+@click.option(
+    '--prefetch',
+    default=0,
+    help='''
+        Number of images to download ahead of time so the next change is instant.
+        Default is 0.
+    ''',
+)
+@click.option(
+    '--near-distance',
+    default=NEAR_DUPLICATE_DISTANCE,
+    help=f'''
+        Max number of bits the perceptual hashes of two images may differ by for them
+        to count as the same painting. Set to -1 to turn off. Needs numpy and Pillow.
+        Default is {NEAR_DUPLICATE_DISTANCE}.
+    ''',
+)
+@click.option(
+    '--weight',
+    type=click.Choice(['uniform', 'size', 'old', 'new']),
+    default='uniform',
+    help='''
+        Favour images by pixel count (size) or by year (old, new: twice as likely per
+        century). Default is uniform.
+    ''',
+)
+@click.option(
+    '--artist-gap',
+    default=ARTIST_GAP,
+    help=f'''
+        Number of recent images whose artists aren't picked again. Default is {ARTIST_GAP}.
+    ''',
+)
+@click.option(
+    '--pages',
+    default=SELECT_PAGES,
+    help=f'''
+        Number of pages with unseen images to pick from. Default is {SELECT_PAGES}.
+    ''',
+)
+@click.option(
+    '--cache-proxy',
+    envvar='WIKIWALL_CACHE_PROXY',
+    help='''
+        URL of a `wikiwall serve-cache` proxy to fetch pages and images through, like
+        http://host:8765. Can also be set with WIKIWALL_CACHE_PROXY. Default is none.
+    ''',
+)
 @click.option('--debug', is_flag=True, help='Show debugging messages.')
 @click.pass_context
-def cli(ctx, dest, limit, debug):
+def cli(
+    ctx,
+    dest,
+    source,
+    limit,
+    max_size,
+    max_age,
+    ttl,
+    workers,
+    segments,
+    prefetch,
+    near_distance,
+    weight,
+    artist_gap,
+    pages,
+    cache_proxy,
+    debug,
+):
     """Set desktop background in macOS to random WikiArt image. """
 
     DATA_DIR = data_dir()
@@ -241,62 +1176,90 @@ def cli(ctx, dest, limit, debug):
         dest = DATA_DIR
     logger.info('Destination set to %s', dest)
 
+    # Session, catalog and near duplicate index are only set up once an
+    # image is fetched.
+    pipeline = {}
+
+    def fetch(db, dest):
+        if not pipeline:
+            from catalog import Catalog
+            from httpcache import HTTPCache
+            from sources import catalog_path, open_source
+
+            # One pooled session for every page fetch and the download.
+            session = make_session(
+                pool_size=max(HTTP_POOL_SIZE, workers, segments), cache_proxy=cache_proxy
+            )
+            cache = HTTPCache(os.path.join(DATA_DIR, 'http'))
+            pipeline['session'] = session
+            pipeline['catalog'] = Catalog(
+                fetch=open_source(source, session, cache).paintings,
+                path=catalog_path(DATA_DIR, source),
+                ttl=ttl,
+            )
+            pipeline['index'] = _near_duplicate_index(db, near_distance)
+            pipeline['selector'] = None
+            if (weight, artist_gap, pages) != ('uniform', 0, 1):
+                from selection import Selector
+
+                pipeline['selector'] = Selector(weight, artist_gap, pages)
+
+        image = _fetch_new_image(
+            pipeline['catalog'],
+            db,
+            pipeline['session'],
+            dest,
+            workers,
+            segments,
+            pipeline['index'],
+            pipeline['selector'],
+        )
+        try:
+            _record_catalog(db, pipeline['catalog'], source)
+        except Exception:
+            db.release([image[0]])
+            raise
+
+        return image
+
+    queue_dir = os.path.join(DATA_DIR, 'queue')
+
     # Setup context passed to subcommands.
     ctx.ensure_object(dict)
     ctx.obj['DEST'] = dest
+    ctx.obj['DATA_DIR'] = DATA_DIR
+    ctx.obj['SOCKET'] = os.path.join(DATA_DIR, 'wikiwall.sock')
+    ctx.obj['CHANGE'] = lambda db: _change_wallpaper(db, fetch, dest, prefetch, queue_dir)
+    ctx.obj['CLEAN'] = lambda db: _clean_up(
+        db,
+        dest,
+        limit,
+        max_bytes=max_size * 1024 * 1024 if max_size is not None else None,
+        max_age=max_age * 24 * 60 * 60 if max_age is not None else None,
+    )
+    ctx.obj['REFILL'] = lambda db: _refill_queue(db, fetch, queue_dir, prefetch)
+    ctx.obj['PREFETCH'] = prefetch
 
-    # Skip below if subcommand `show` invoked.
-    if ctx.invoked_subcommand == 'show':
+    # Skip below if a subcommand like `show` invoked.
+    if ctx.invoked_subcommand is not None:
         return
 
+    from db import DownloadDatabase
+
     try:
         with DownloadDatabase() as db:
-            # Start at first page of json data.
-            json_page = 1
-
-            # Skip duplicates
-            print('Searching for image...')
-            url = get_random(scrape_urls(SRC_URL.format(json_page)))[0]
-            start = time.time()
-            while db.is_duplicate(url):
-
-                logger.warning('Duplicate!')
-                url = get_random(scrape_urls(SRC_URL.format(json_page)))[0]
-
-                if time.time() - start > DUPLICATE_TIMEOUT:
-                    # Try next page of data.
-                    json_page += 1
-                    logger.info('Trying next page %s', json_page)
-                    start = time.time()
-
-            saved_img = download_img(url, dest)
-
-            # Clean out DL directory if limit reached.
-            if limit != -1:
-                logger.info('Download limit set to %s.', limit)
-                _clean_dls(limit, path=dest)
-            else:
-                logger.info('No download limit set. Skipping cleaning.')
-
-            # Set image as desktop background.
-            setwall_script = f'''
-                tell application "System Events"
-                    tell every desktop
-                        set picture to "{saved_img}"
-                    end tell
-                end tell
-            '''
+            ctx.obj['CHANGE'](db)
 
-            print('Setting background... ', end='')
-            _run_appscript(setwall_script)
+            sys.stdout.flush()
+            time.sleep(1)
+            print('done.')
+            time.sleep(0.2)
 
-            # Save record of image to database.
-            db.add(url)
+            # Clean up only once the new wallpaper is showing.
+            ctx.obj['CLEAN'](db)
 
-        sys.stdout.flush()
-        time.sleep(1)
-        print('done.')
-        time.sleep(0.2)
+        if prefetch > 0:
+            _refill_in_background()
 
     except Exception:
         logger.exception('Something went wrong.')
@@ -304,6 +1267,21 @@ def cli(ctx, dest, limit, debug):
         sys.exit(1)
 
 
+@cli.command(hidden=True)
+@click.pass_context
+def refill(ctx):
+    """Fill prefetch queue. Started in the background by wallpaper changes. """
+    from db import DownloadDatabase
+    from locks import FileLock
+
+    try:
+        with FileLock(os.path.join(ctx.obj['DATA_DIR'], 'refill.lock'), timeout=0):
+            with DownloadDatabase() as db:
+                ctx.obj['REFILL'](db)
+    except TimeoutError:
+        logger.info('Another run is refilling the prefetch queue already.')
+
+
 @cli.command()
 @click.pass_context
 def show(ctx):
@@ -317,6 +1295,183 @@ def show(ctx):
     _run_appscript(open_script)
 
 
+@cli.command()
+@click.option('--top', default=5, help='Number of most shown artists to list. Default is 5.')
+def stats(top):
+    """Show download history and stored painting stats. """
+    from db import DownloadDatabase, STATE_PREFETCHED, STATE_SHOWN, STATE_SKIPPED
+
+    with DownloadDatabase() as db:
+        states = db.count_by_state()
+        paintings, artists = db.count_paintings()
+        top_artists = db.top_artists(top)
+
+    print(f'Images shown: {states.get(STATE_SHOWN, 0)}')
+    print(f'Images prefetched: {states.get(STATE_PREFETCHED, 0)}')
+    print(f'Near duplicates skipped: {states.get(STATE_SKIPPED, 0)}')
+    print(f'Paintings stored: {paintings} by {artists} artists')
+    if top_artists:
+        print('Most shown artists:')
+        width = max(len(name) for name, _ in top_artists)
+        for name, shown in top_artists:
+            print(f'  {name:<{width}}  {shown}')
+
+
+@cli.command('import')
+@click.argument('history', type=click.File('r'))
+def import_history(history):
+    """Add urls in HISTORY file, one per line, to download history. """
+    from db import DownloadDatabase
+
+    with DownloadDatabase() as db:
+        added = db.add_many(line.strip() for line in history if line.strip())
+
+    print(f'{added} urls added to download history.')
+
+
+@cli.command()
+@click.option(
+    '--interval',
+    default=DAEMON_INTERVAL,
+    help=f'Seconds between wallpaper changes. 0 for none. Default is {DAEMON_INTERVAL}.',
+)
+@click.option(
+    '--at',
+    'times',
+    multiple=True,
+    help='Also change wallpaper every day at HH:MM. Can be repeated.',
+)
+@click.pass_context
+def daemon(ctx, interval, times):
+    """Stay running and change wallpaper on a schedule. """
+
+    # Imported here since only the daemon needs sockets and selectors.
+    from daemon import Daemon, Schedule
+    from db import DownloadDatabase
+
+    try:
+        schedule = Schedule(interval, times)
+    except ValueError as err:
+        raise click.BadParameter(str(err))
+
+    with DownloadDatabase() as db:
+
+        def after_change():
+            ctx.obj['CLEAN'](db)
+            if ctx.obj['PREFETCH'] > 0:
+                ctx.obj['REFILL'](db)
+
+        print(f'Listening on {ctx.obj["SOCKET"]}. Stop with `wikiwall stop`.')
+        Daemon(
+            change=lambda: ctx.obj['CHANGE'](db),
+            schedule=schedule,
+            socket_path=ctx.obj['SOCKET'],
+            after_change=after_change,
+        ).serve_forever()
+
+
+@cli.command('serve-cache')
+@click.option(
+    '--host',
+    default='127.0.0.1',
+    help='''
+        Address to listen on. Use 0.0.0.0 to serve other machines on the network.
+        Default is 127.0.0.1.
+    ''',
+)
+@click.option('--port', default=PROXY_PORT, help=f'Port to listen on. Default is {PROXY_PORT}.')
+@click.option(
+    '--max-size',
+    type=int,
+    help='Megabytes of responses to keep cached. Default is no limit.',
+)
+@click.option(
+    '--ttl',
+    default=CATALOG_TTL,
+    help=f'''
+        Seconds to serve a cached page of json data before fetching it again. Images are
+        kept until trimmed. Default is {CATALOG_TTL}.
+    ''',
+)
+@click.option(
+    '--allow-host',
+    'hosts',
+    multiple=True,
+    help=f'''
+        Host to fetch from, with its subdomains. Can be repeated.
+        Default is {", ".join(PROXY_HOSTS)}.
+    ''',
+)
+@click.pass_context
+def serve_cache(ctx, host, port, max_size, ttl, hosts):
+    """Serve pages and images to other machines from a shared cache. """
+
+    # Imported here since only the proxy needs an HTTP server.
+    from proxy import CacheProxy, CacheProxyServer
+
+    proxy = CacheProxy(
+        os.path.join(ctx.obj['DATA_DIR'], 'proxy'),
+        make_session(),
+        hosts=hosts or PROXY_HOSTS,
+        ttl=ttl,
+        max_bytes=max_size * 1024 * 1024 if max_size is not None else None,
+    )
+    with CacheProxyServer((host, port), proxy) as server:
+        print(f'Serving cache on http://{host}:{port}. Point clients at it with --cache-proxy.')
+        server.serve_forever()
+
+
+@cli.command()
+@click.argument('path', required=False)
+@click.option('--remove', is_flag=True, help='Unmark image as favorite.')
+def favorite(path, remove):
+    """Never clean up PATH, or the current wallpaper. """
+    from db import DownloadDatabase
+
+    with DownloadDatabase() as db:
+        if path is None:
+            path = db.last_shown_file()
+
+        if path is None or not db.set_favorite(path, not remove):
+            print('No such download.')
+            sys.exit(1)
+
+    print(f'{path} {"unmarked" if remove else "marked"} as favorite.')
+
+
+@cli.command('next')
+@click.pass_context
+def next_wallpaper(ctx):
+    """Tell running daemon to change wallpaper now. """
+
+    _send_daemon(ctx.obj['SOCKET'], 'next')
+
+
+@cli.command()
+@click.pass_context
+def stop(ctx):
+    """Stop running daemon. """
+
+    _send_daemon(ctx.obj['SOCKET'], 'stop')
+
+
+def _send_daemon(socket_path, command):
+    """Send `command` to daemon and print its reply. """
+
+    from daemon import send_command
+
+    try:
+        reply = send_command(socket_path, command)
+    except OSError:
+        print('No daemon running. Start one with `wikiwall daemon`.')
+        sys.exit(1)
+
+    status, _, detail = reply.partition(' ')
+    print(detail)
+    if status != 'ok':
+        sys.exit(1)
+
+
 if __name__ == '__main__':
     try:
         cli(obj={})